@@ -10,6 +10,7 @@ from cactus.blast.cactus_blastTest import TestCase as blastTest
 from cactus.blast.cactus_realignTest import TestCase as realignTest
 from cactus.pipeline.cactus_workflowTest import TestCase as workflowTest
 from cactus.pipeline.cactus_evolverTest import TestCase as evolverTest
+from cactus.pipeline.ktserverControlTest import TestCase as ktserverControlTest
 from cactus.bar.cactus_barTest import TestCase as barTest
 from cactus.phylogeny.cactus_phylogenyTest import TestCase as phylogenyTest
 from cactus.faces.cactus_fillAdjacenciesTest import TestCase as adjacenciesTest
@@ -31,6 +32,7 @@ def allSuites():
                                    preprocessorTest(),
                                    unittest.makeSuite(workflowTest, 'test'),
                                    unittest.makeSuite(evolverTest, 'test'),
+                                   unittest.makeSuite(ktserverControlTest, 'test'),
                                    unittest.makeSuite(barTest, 'test'),
                                    unittest.makeSuite(realignTest, 'test'),
                                    unittest.makeSuite(phylogenyTest, 'test'),
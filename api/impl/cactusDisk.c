@@ -6,12 +6,180 @@
 
 #include "cactusGlobalsPrivate.h"
 #include <unistd.h>
+#include <fcntl.h>
+#include <errno.h>
 #include <math.h>
 
 #define CACTUS_DISK_NAME_INCREMENT 16384
 #define CACTUS_DISK_BUCKET_NUMBER 65536
 #define CACTUS_DISK_PARAMETER_KEY -100000
 #define CACTUS_DISK_SEQUENCE_CHUNK_SIZE 500
+#define CACTUS_DISK_PARTITIONS_FILE "partitions.txt"
+
+/*
+ * Functions on the databases of a partitioned database.
+ */
+
+/*
+ * The records of a kyoto tycoon database can be partitioned between several servers. The workflow
+ * then writes the host and port of each server, one per line, to the partitions file in the directory
+ * of the database (see DbElemWrapper.getDbPartitionsFile), and a record lives on the server picked
+ * by the crc32 hash of the bytes of its key, as DbElemWrapper.getDbPartitionIndex picks it.
+ */
+
+static uint32_t crc32OfKey(int64_t key) {
+    const unsigned char *bytes = (const unsigned char *) &key;
+    uint32_t crc = 0xFFFFFFFF;
+    for (int64_t i = 0; i < (int64_t) sizeof(int64_t); i++) {
+        crc ^= bytes[i];
+        for (int64_t j = 0; j < 8; j++) {
+            crc = (crc >> 1) ^ (0xEDB88320 & (0 - (crc & 1)));
+        }
+    }
+    return ~crc;
+}
+
+static int64_t cactusDisk_getPartition(CactusDisk *cactusDisk, int64_t key) {
+    return cactusDisk->databaseNumber == 1 ? 0 : crc32OfKey(key) % cactusDisk->databaseNumber;
+}
+
+static stKVDatabase *cactusDisk_getDatabase(CactusDisk *cactusDisk, int64_t key) {
+    return cactusDisk->databases[cactusDisk_getPartition(cactusDisk, key)];
+}
+
+static void cactusDisk_constructDatabases(CactusDisk *cactusDisk, stKVDatabaseConf *conf, bool create) {
+    cactusDisk->databaseConfs = stList_construct3(0, (void (*)(void *)) stKVDatabaseConf_destruct);
+    if (stKVDatabaseConf_getType(conf) == stKVDatabaseTypeKyotoTycoon && stKVDatabaseConf_getDir(conf) != NULL) {
+        char *partitionsFile = stString_print("%s/%s", stKVDatabaseConf_getDir(conf), CACTUS_DISK_PARTITIONS_FILE);
+        FILE *fileHandle = fopen(partitionsFile, "r");
+        if (fileHandle != NULL) {
+            char *line;
+            while ((line = stFile_getLineFromFile(fileHandle)) != NULL) {
+                char *host = st_malloc(sizeof(char) * (strlen(line) + 1));
+                int64_t port;
+                if (sscanf(line, "%s %" PRIi64 "", host, &port) == 2) {
+                    stList_append(cactusDisk->databaseConfs,
+                            stKVDatabaseConf_constructKyotoTycoon(host, port, stKVDatabaseConf_getTimeout(conf),
+                                    stKVDatabaseConf_getMaxKTRecordSize(conf), stKVDatabaseConf_getMaxKTBulkSetSize(conf),
+                                    stKVDatabaseConf_getMaxKTBulkSetNumRecords(conf), stKVDatabaseConf_getDir(conf),
+                                    stKVDatabaseConf_getDatabaseName(conf)));
+                } else if (strlen(line) > 0) {
+                    stThrowNew(CACTUS_DISK_EXCEPTION_ID, "Got the malformed line '%s' in the partitions file %s", line,
+                            partitionsFile);
+                }
+                free(host);
+                free(line);
+            }
+            fclose(fileHandle);
+            if (stList_length(cactusDisk->databaseConfs) == 0) {
+                stThrowNew(CACTUS_DISK_EXCEPTION_ID, "The partitions file %s lists no servers", partitionsFile);
+            }
+        }
+        free(partitionsFile);
+    }
+    if (stList_length(cactusDisk->databaseConfs) == 0) {
+        cactusDisk->databaseNumber = 1;
+        cactusDisk->databases = st_malloc(sizeof(stKVDatabase *));
+        cactusDisk->databases[0] = stKVDatabase_construct(conf, create);
+    } else {
+        cactusDisk->databaseNumber = stList_length(cactusDisk->databaseConfs);
+        st_logDebug("The cactus disk is partitioned between %" PRIi64 " servers\n", cactusDisk->databaseNumber);
+        cactusDisk->databases = st_malloc(sizeof(stKVDatabase *) * cactusDisk->databaseNumber);
+        for (int64_t i = 0; i < cactusDisk->databaseNumber; i++) {
+            cactusDisk->databases[i] = stKVDatabase_construct(stList_get(cactusDisk->databaseConfs, i), create);
+        }
+    }
+}
+
+static void cactusDisk_destructDatabases(CactusDisk *cactusDisk) {
+    for (int64_t i = 0; i < cactusDisk->databaseNumber; i++) {
+        stKVDatabase_destruct(cactusDisk->databases[i]);
+    }
+    free(cactusDisk->databases);
+    stList_destruct(cactusDisk->databaseConfs);
+}
+
+/*
+ * Lists of requests for each database, to which a request is added by the key of its record.
+ */
+
+static stList **constructRequestLists(CactusDisk *cactusDisk, void (*destructElement)(void *)) {
+    stList **requestLists = st_malloc(sizeof(stList *) * cactusDisk->databaseNumber);
+    for (int64_t i = 0; i < cactusDisk->databaseNumber; i++) {
+        requestLists[i] = stList_construct3(0, destructElement);
+    }
+    return requestLists;
+}
+
+static void destructRequestLists(CactusDisk *cactusDisk, stList **requestLists) {
+    for (int64_t i = 0; i < cactusDisk->databaseNumber; i++) {
+        stList_destruct(requestLists[i]);
+    }
+    free(requestLists);
+}
+
+static void appendRequest(CactusDisk *cactusDisk, stList **requestLists, int64_t key, void *request) {
+    stList_append(requestLists[cactusDisk_getPartition(cactusDisk, key)], request);
+}
+
+static int64_t getRequestNumber(CactusDisk *cactusDisk, stList **requestLists) {
+    int64_t requestNumber = 0;
+    for (int64_t i = 0; i < cactusDisk->databaseNumber; i++) {
+        requestNumber += stList_length(requestLists[i]);
+    }
+    return requestNumber;
+}
+
+static void bulkSetRecords(CactusDisk *cactusDisk, stList **requestLists) {
+    for (int64_t i = 0; i < cactusDisk->databaseNumber; i++) {
+        if (stList_length(requestLists[i]) > 0) {
+            stKVDatabase_bulkSetRecords(cactusDisk->databases[i], requestLists[i]);
+        }
+    }
+}
+
+static void bulkRemoveRecords(CactusDisk *cactusDisk, stList **requestLists) {
+    for (int64_t i = 0; i < cactusDisk->databaseNumber; i++) {
+        if (stList_length(requestLists[i]) > 0) {
+            stKVDatabase_bulkRemoveRecords(cactusDisk->databases[i], requestLists[i]);
+        }
+    }
+}
+
+/*
+ * Gets the records of the given list of keys (pointers to int64_ts) from their databases, returning the
+ * results in the order of the keys.
+ */
+static stList *bulkGetRecords(CactusDisk *cactusDisk, stList *keys) {
+    if (cactusDisk->databaseNumber == 1) {
+        return stKVDatabase_bulkGetRecords(cactusDisk->databases[0], keys);
+    }
+    stList **keyLists = constructRequestLists(cactusDisk, NULL);
+    for (int64_t i = 0; i < stList_length(keys); i++) {
+        int64_t *key = stList_get(keys, i);
+        appendRequest(cactusDisk, keyLists, *key, key);
+    }
+    stList **resultLists = st_malloc(sizeof(stList *) * cactusDisk->databaseNumber);
+    for (int64_t i = 0; i < cactusDisk->databaseNumber; i++) {
+        resultLists[i] = stList_length(keyLists[i]) > 0 ?
+                stKVDatabase_bulkGetRecords(cactusDisk->databases[i], keyLists[i]) : stList_construct();
+        assert(stList_length(resultLists[i]) == stList_length(keyLists[i]));
+    }
+    stList *results = stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkResult_destruct);
+    int64_t *resultIndices = st_calloc(cactusDisk->databaseNumber, sizeof(int64_t));
+    for (int64_t i = 0; i < stList_length(keys); i++) {
+        int64_t partition = cactusDisk_getPartition(cactusDisk, *((int64_t *) stList_get(keys, i)));
+        stList_append(results, stList_get(resultLists[partition], resultIndices[partition]++));
+    }
+    for (int64_t i = 0; i < cactusDisk->databaseNumber; i++) {
+        stList_setDestructor(resultLists[i], NULL); //The results are now in the merged list
+        stList_destruct(resultLists[i]);
+    }
+    free(resultLists);
+    free(resultIndices);
+    destructRequestLists(cactusDisk, keyLists);
+    return results;
+}
 
 /*
  * Functions on meta sequences.
@@ -111,18 +279,19 @@ Name cactusDisk_addString(CactusDisk *cactusDisk, const char *string) {
         int64_t stringSize = strlen(string);
         int64_t intervalSize = ceil((double) stringSize / CACTUS_DISK_SEQUENCE_CHUNK_SIZE);
         Name name = cactusDisk_getUniqueIDInterval(cactusDisk, intervalSize);
-        stList *insertRequests = stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
+        stList **insertRequests = constructRequestLists(cactusDisk, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
         for (int64_t i = 0; i * CACTUS_DISK_SEQUENCE_CHUNK_SIZE < stringSize; i++) {
             int64_t j =
                     (i + 1) * CACTUS_DISK_SEQUENCE_CHUNK_SIZE < stringSize ?
                             CACTUS_DISK_SEQUENCE_CHUNK_SIZE : stringSize - i * CACTUS_DISK_SEQUENCE_CHUNK_SIZE;
             char *subString = stString_getSubString(string, i * CACTUS_DISK_SEQUENCE_CHUNK_SIZE, j);
-            stList_append(insertRequests, stKVDatabaseBulkRequest_constructInsertRequest(name + i, subString, j + 1));
+            appendRequest(cactusDisk, insertRequests, name + i,
+                    stKVDatabaseBulkRequest_constructInsertRequest(name + i, subString, j + 1));
             free(subString);
         }
         stTry
             {
-                stKVDatabase_bulkSetRecords(cactusDisk->database, insertRequests);
+                bulkSetRecords(cactusDisk, insertRequests);
             }
             stCatch(except)
                 {
@@ -130,7 +299,7 @@ Name cactusDisk_addString(CactusDisk *cactusDisk, const char *string) {
                             "An unknown database error occurred when we tried to add a string to the cactus disk");
                 }stTryEnd
         ;
-        stList_destruct(insertRequests);
+        destructRequestLists(cactusDisk, insertRequests);
         return name;
     }
 }
@@ -260,7 +429,7 @@ static void cacheSubstringsFromDB(CactusDisk *cactusDisk, stList *substrings) {
         stList *records = NULL;
         stTry
             {
-                records = stKVDatabase_bulkGetRecords(cactusDisk->database, getRequests);
+                records = bulkGetRecords(cactusDisk, getRequests);
             }
             stCatch(except)
                 {
@@ -520,7 +689,7 @@ static stList *getRecords(CactusDisk *cactusDisk, stList *objectNames, char *typ
     stList *records = NULL;
     stTry
         {
-            records = stKVDatabase_bulkGetRecords(cactusDisk->database, objectNames);
+            records = bulkGetRecords(cactusDisk, objectNames);
         }
         stCatch(except)
             {
@@ -562,7 +731,7 @@ static void *getRecord(CactusDisk *cactusDisk, Name objectName, char *type) {
     } else {
         stTry
             {
-                cA = stKVDatabase_getRecord2(cactusDisk->database, objectName, &recordSize);
+                cA = stKVDatabase_getRecord2(cactusDisk_getDatabase(cactusDisk, objectName), objectName, &recordSize);
             }
             stCatch(except)
                 {
@@ -583,7 +752,7 @@ static void *getRecord(CactusDisk *cactusDisk, Name objectName, char *type) {
 
 static bool containsRecord(CactusDisk *cactusDisk, Name objectName) {
     return stCache_containsRecord(cactusDisk->cache, objectName, 0, INT64_MAX)
-            || stKVDatabase_containsRecord(cactusDisk->database, objectName);
+            || stKVDatabase_containsRecord(cactusDisk_getDatabase(cactusDisk, objectName), objectName);
 }
 
 static CactusDisk *cactusDisk_constructPrivate(stKVDatabaseConf *conf, bool create, const char *sequencesFileName) {
@@ -595,10 +764,10 @@ static CactusDisk *cactusDisk_constructPrivate(stKVDatabaseConf *conf, bool crea
     cactusDisk->flowers = stSortedSet_construct3(cactusDisk_constructFlowersP, NULL);
     cactusDisk->flowerNamesMarkedForDeletion = stSortedSet_construct3((int (*)(const void *, const void *)) strcmp,
             free);
-    cactusDisk->updateRequests = stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
 
-    //Now open the database
-    cactusDisk->database = stKVDatabase_construct(conf, create);
+    //Now open the database, or the databases of its partitions
+    cactusDisk_constructDatabases(cactusDisk, conf, create);
+    cactusDisk->updateRequests = constructRequestLists(cactusDisk, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
     cactusDisk->cache = stCache_construct();
     cactusDisk->stringCache = stCache_construct();
 
@@ -676,7 +845,7 @@ void cactusDisk_destruct(CactusDisk *cactusDisk) {
     stSortedSet_destruct(cactusDisk->metaSequences);
 
     //close DB
-    stKVDatabase_destruct(cactusDisk->database);
+    cactusDisk_destructDatabases(cactusDisk);
 
     //Close the sequences files.
     if (cactusDisk->storeSequencesInAFile) {
@@ -698,7 +867,7 @@ void cactusDisk_destruct(CactusDisk *cactusDisk) {
     stCache_destruct(cactusDisk->cache); //Get rid of the cache
     stCache_destruct(cactusDisk->stringCache);
 
-    stList_destruct(cactusDisk->updateRequests);
+    destructRequestLists(cactusDisk, cactusDisk->updateRequests);
 
     free(cactusDisk);
 }
@@ -714,22 +883,71 @@ void cactusDisk_addUpdateRequest(CactusDisk *cactusDisk, Flower *flower) {
         int64_t recordSize2;
         void *vA2 = stCache_getRecord(cactusDisk->cache, flower_getName(flower), 0, INT64_MAX, &recordSize2);
         if (!stCache_recordsIdentical(vA, recordSize, vA2, recordSize2)) { //Only rewrite if we actually did something
-            stList_append(cactusDisk->updateRequests,
+            appendRequest(cactusDisk, cactusDisk->updateRequests, flower_getName(flower),
                     stKVDatabaseBulkRequest_constructUpdateRequest(flower_getName(flower), vA, recordSize));
         }
         free(vA2);
     } else {
-        stList_append(cactusDisk->updateRequests,
+        appendRequest(cactusDisk, cactusDisk->updateRequests, flower_getName(flower),
                 stKVDatabaseBulkRequest_constructInsertRequest(flower_getName(flower), vA, recordSize));
     }
     free(vA);
 }
 
+/*
+ * If the environment variable CACTUS_COMMIT_TOKEN is set the process only writes to the database
+ * if the file it names is created holding CACTUS_COMMIT_TOKEN_OWNER, which identifies the job. The first
+ * program of the job to write creates it, and the programs the job runs after it find it holds the job's
+ * owner and write too. The workflow takes the token itself, leaving it empty, when it gives up on a job that
+ * is taking too long, so that the job can be killed and run again without the risk that the first run also
+ * writes its results.
+ */
+bool cactusDisk_takeCommitToken(void) {
+    const char *commitToken = getenv("CACTUS_COMMIT_TOKEN");
+    if (commitToken == NULL) {
+        return 1;
+    }
+    const char *owner = getenv("CACTUS_COMMIT_TOKEN_OWNER");
+    if (owner == NULL || strlen(owner) == 0) {
+        st_errAbort("The commit token %s is set without CACTUS_COMMIT_TOKEN_OWNER", commitToken);
+    }
+    //The token is written under another name then linked, so it is never seen without its owner
+    char *tempFile = stString_print("%s.%" PRIi64 "", commitToken, (int64_t) getpid());
+    FILE *fileHandle = fopen(tempFile, "w");
+    if (fileHandle == NULL) {
+        st_errAbort("Could not create the commit token %s", tempFile);
+    }
+    fprintf(fileHandle, "%s", owner);
+    fclose(fileHandle);
+    bool taken = 1;
+    if (link(tempFile, commitToken) == -1) {
+        if (errno != EEXIST) {
+            st_errAbort("Could not create the commit token %s", commitToken);
+        }
+        fileHandle = fopen(commitToken, "r");
+        if (fileHandle == NULL) {
+            st_errAbort("Could not read the commit token %s", commitToken);
+        }
+        char *tokenOwner = stFile_getLineFromFile(fileHandle);
+        fclose(fileHandle);
+        taken = tokenOwner != NULL && strcmp(tokenOwner, owner) == 0;
+        free(tokenOwner);
+    }
+    unlink(tempFile);
+    free(tempFile);
+    return taken;
+}
+
 void cactusDisk_write(CactusDisk *cactusDisk) {
     Flower *flower;
     int64_t recordSize;
 
-    stList *removeRequests = stList_construct3(0, (void (*)(void *)) stIntTuple_destruct);
+    if (!cactusDisk_takeCommitToken()) {
+        st_logCritical("The commit token has been taken, so this job has been given up on, not writing to the database\n");
+        return;
+    }
+
+    stList **removeRequests = constructRequestLists(cactusDisk, (void (*)(void *)) stIntTuple_destruct);
 
     st_logDebug("Starting to write the cactus to disk\n");
 
@@ -748,8 +966,8 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
     while ((nameString = stSortedSet_getNext(it)) != NULL) {
         Name name = cactusMisc_stringToName(nameString);
         if (containsRecord(cactusDisk, name)) {
-            stList_append(cactusDisk->updateRequests, stKVDatabaseBulkRequest_constructUpdateRequest(name, &name, 0)); //We set it to null in the first atomic operation.
-            stList_append(removeRequests, stIntTuple_construct1(name));
+            appendRequest(cactusDisk, cactusDisk->updateRequests, name, stKVDatabaseBulkRequest_constructUpdateRequest(name, &name, 0)); //We set it to null in the first atomic operation.
+            appendRequest(cactusDisk, removeRequests, name, stIntTuple_construct1(name));
         }
     }
     stSortedSet_destructIterator(it);
@@ -767,10 +985,10 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
         //Compression
         vA = compress(vA, &recordSize);
         if (!containsRecord(cactusDisk, metaSequence_getName(metaSequence))) {
-            stList_append(cactusDisk->updateRequests,
+            appendRequest(cactusDisk, cactusDisk->updateRequests, metaSequence_getName(metaSequence),
                     stKVDatabaseBulkRequest_constructInsertRequest(metaSequence_getName(metaSequence), vA, recordSize));
         } else {
-            stList_append(cactusDisk->updateRequests,
+            appendRequest(cactusDisk, cactusDisk->updateRequests, metaSequence_getName(metaSequence),
                     stKVDatabaseBulkRequest_constructUpdateRequest(metaSequence_getName(metaSequence), vA, recordSize));
         }
         free(vA);
@@ -787,7 +1005,7 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
                         &recordSize);
         //Compression
         cactusDiskParameters = compress(cactusDiskParameters, &recordSize);
-        stList_append(cactusDisk->updateRequests,
+        appendRequest(cactusDisk, cactusDisk->updateRequests, CACTUS_DISK_PARAMETER_KEY,
                 stKVDatabaseBulkRequest_constructInsertRequest(CACTUS_DISK_PARAMETER_KEY, cactusDiskParameters,
                         recordSize));
         free(cactusDiskParameters);
@@ -795,13 +1013,13 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
 
     st_logDebug("Checked if need to write the initial parameters\n");
 
-    if (stList_length(cactusDisk->updateRequests) > 0) {
-        st_logDebug("Going to write %" PRIi64 " updates\n", stList_length(cactusDisk->updateRequests));
+    if (getRequestNumber(cactusDisk, cactusDisk->updateRequests) > 0) {
+        st_logDebug("Going to write %" PRIi64 " updates\n", getRequestNumber(cactusDisk, cactusDisk->updateRequests));
         stTry
             {
-                st_logDebug("Writing %" PRIi64 " updates\n", stList_length(cactusDisk->updateRequests));
-                assert(stList_length(cactusDisk->updateRequests) > 0);
-                stKVDatabase_bulkSetRecords(cactusDisk->database, cactusDisk->updateRequests);
+                st_logDebug("Writing %" PRIi64 " updates\n", getRequestNumber(cactusDisk, cactusDisk->updateRequests));
+                assert(getRequestNumber(cactusDisk, cactusDisk->updateRequests) > 0);
+                bulkSetRecords(cactusDisk, cactusDisk->updateRequests);
             }
             stCatch(except)
                 {
@@ -813,10 +1031,10 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
 
     st_logDebug("Updated the database with inserts\n");
 
-    if (stList_length(removeRequests) > 0) {
+    if (getRequestNumber(cactusDisk, removeRequests) > 0) {
         stTry
             {
-                stKVDatabase_bulkRemoveRecords(cactusDisk->database, removeRequests);
+                bulkRemoveRecords(cactusDisk, removeRequests);
             }
             stCatch(except)
                 {
@@ -828,9 +1046,9 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
 
     st_logDebug("Now removed flowers we don't need\n");
 
-    stList_destruct(cactusDisk->updateRequests);
-    cactusDisk->updateRequests = stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
-    stList_destruct(removeRequests);
+    destructRequestLists(cactusDisk, cactusDisk->updateRequests);
+    cactusDisk->updateRequests = constructRequestLists(cactusDisk, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
+    destructRequestLists(cactusDisk, removeRequests);
 
     st_logDebug("Finished writing to the database\n");
 }
@@ -941,8 +1159,8 @@ void cactusDisk_getBlockOfUniqueIDs(CactusDisk *cactusDisk, int64_t intervalSize
                 assert(minimumValue >= 1);
                 assert(maximumValue <= INT64_MAX);
                 assert(minimumValue < maximumValue);
-                if (stKVDatabase_containsRecord(cactusDisk->database, keyName)) {
-                    cactusDisk->maxUniqueNumber = stKVDatabase_incrementInt64(cactusDisk->database, keyName,
+                if (stKVDatabase_containsRecord(cactusDisk_getDatabase(cactusDisk, keyName), keyName)) {
+                    cactusDisk->maxUniqueNumber = stKVDatabase_incrementInt64(cactusDisk_getDatabase(cactusDisk, keyName), keyName,
                             intervalSize);
                     cactusDisk->uniqueNumber = cactusDisk->maxUniqueNumber - intervalSize;
                     if (cactusDisk->uniqueNumber <= 0 || cactusDisk->uniqueNumber < minimumValue
@@ -956,7 +1174,7 @@ void cactusDisk_getBlockOfUniqueIDs(CactusDisk *cactusDisk, int64_t intervalSize
                 } else {
                     stTry
                         {
-                            stKVDatabase_insertInt64(cactusDisk->database, keyName, minimumValue);
+                            stKVDatabase_insertInt64(cactusDisk_getDatabase(cactusDisk, keyName), keyName, minimumValue);
                         }
                         stCatch(except)
                             {
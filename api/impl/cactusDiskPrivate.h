@@ -10,11 +10,13 @@
 #include "cactusGlobals.h"
 
 struct _cactusDisk {
-    stKVDatabase *database;
+    stKVDatabase **databases; //One for each server of a partitioned database, see cactusDisk_getDatabase
+    stList *databaseConfs;
+    int64_t databaseNumber;
     stSortedSet *metaSequences;
     stSortedSet *flowers;
     stSortedSet *flowerNamesMarkedForDeletion;
-    stList *updateRequests;
+    stList **updateRequests; //The requests for each database
     stCache *cache;
     stCache *stringCache;
     Name uniqueNumber;
@@ -45,6 +45,26 @@ static void printName(FILE *fileHandle, Name name) {
     fprintf(fileHandle, "%" PRIi64 " ", name);
 }
 
+/*
+ * Prints the marker of the secondary group starting with the given flower: 'b' if it is overlarge,
+ * else 'a', followed by the total size of the flowers in the group, which is read by cactus_workflow
+ * rather than getting the size of each flower from the database. The readers of the names skip the
+ * markers by their first character.
+ */
+static void printSecondaryGroupMarker(stList *flowerNamesAndSizes, int64_t start, FILE *fileHandle,
+        int64_t maxFlowerSecondaryGroupSize) {
+    FlowerNameAndSize *flowerNameAndSize = stList_get(flowerNamesAndSizes, start);
+    int64_t totalSize = flowerNameAndSize->flowerSize;
+    for (int64_t i = start + 1; i < stList_length(flowerNamesAndSizes); i++) {
+        int64_t flowerSize = ((FlowerNameAndSize *)stList_get(flowerNamesAndSizes, i))->flowerSize;
+        if(totalSize + flowerSize > maxFlowerSecondaryGroupSize) {
+            break;
+        }
+        totalSize += flowerSize;
+    }
+    fprintf(fileHandle, "%c%" PRIi64 " ", flowerNameAndSize->flowerSize > maxFlowerSecondaryGroupSize ? 'b' : 'a', totalSize);
+}
+
 static void flowerWriter_writeFlowersString(stList *flowerNamesAndSizes, FILE *fileHandle,
         int64_t maxFlowerSecondaryGroupSize) {
     fprintf(fileHandle, "%" PRIi64 " ", stList_length(flowerNamesAndSizes));
@@ -52,20 +72,13 @@ static void flowerWriter_writeFlowersString(stList *flowerNamesAndSizes, FILE *f
         FlowerNameAndSize *flowerNameAndSize = stList_get(flowerNamesAndSizes, 0);
         Name name = flowerNameAndSize->flowerName;
         int64_t totalSize = flowerNameAndSize->flowerSize;
-        if(flowerNameAndSize->flowerSize > maxFlowerSecondaryGroupSize) {
-            fprintf(fileHandle, "b ");
-        }
+        printSecondaryGroupMarker(flowerNamesAndSizes, 0, fileHandle, maxFlowerSecondaryGroupSize);
         printName(fileHandle, name);
         for (int64_t i = 1; i < stList_length(flowerNamesAndSizes); i++) {
             flowerNameAndSize = stList_get(flowerNamesAndSizes, i);
             if(totalSize + flowerNameAndSize->flowerSize > maxFlowerSecondaryGroupSize) {
                 totalSize = 0;
-                if(flowerNameAndSize->flowerSize > maxFlowerSecondaryGroupSize) {
-                    fprintf(fileHandle, "b ");
-                }
-                else {
-                    fprintf(fileHandle, "a ");
-                }
+                printSecondaryGroupMarker(flowerNamesAndSizes, i, fileHandle, maxFlowerSecondaryGroupSize);
             }
             printName(fileHandle, flowerNameAndSize->flowerName - name);
             name = flowerNameAndSize->flowerName;
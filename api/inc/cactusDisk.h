@@ -51,9 +51,19 @@ int64_t cactusDisk_getUniqueIDInterval(CactusDisk *cactusDisk, int64_t intervalS
 /*
  * Writes the updated state of the parts of the cactus disk in memory to disk.
  *
+ * If the environment variable CACTUS_COMMIT_TOKEN names a file, nothing is written unless
+ * cactusDisk_takeCommitToken succeeds.
  */
 void cactusDisk_write(CactusDisk *cactusDisk);
 
+/*
+ * Returns non-zero if the process may write to the databases: if the environment variable
+ * CACTUS_COMMIT_TOKEN is not set, or the file it names is created by this call or was created by
+ * a program of the same job (see runWithCommitDeadline in cactus/shared/common.py). Anything
+ * that writes to a database other than by cactusDisk_write must take the token first.
+ */
+bool cactusDisk_takeCommitToken(void);
+
 /*
  * This is used to serialise a flower before a call to a cactusDisk_write, it is exposed for use in the cactus_caf code.
  */
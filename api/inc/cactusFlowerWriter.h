@@ -3,7 +3,8 @@
 
 /*
  * Functions for organising the communication of lists of flower as strings. Used to communicate
- * between getFlowers/extendFlowers and cactus_workflow.
+ * between getFlowers/extendFlowers and cactus_workflow. Each secondary group of flowers in a list
+ * starts with a marker giving the total size of its flowers.
  */
 
 #include "sonLib.h"
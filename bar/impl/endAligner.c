@@ -186,53 +186,102 @@ stSortedSet *makeEndAlignment(End *end, int64_t spanningTrees, int64_t maxSequen
     return sortedAlignment;
 }
 
+/*
+ * End alignments are written as binary records of native byte order integers. Each record is the number of
+ * bytes in the rest of the record, the name of the end, the number of aligned pairs and then the pairs.
+ */
+
+#define END_ALIGNMENT_PAIR_SIZE (4 * sizeof(int64_t) + 2 * sizeof(int32_t) + 1)
+
+static void writeInt64(char **buffer, int64_t i) {
+    memcpy(*buffer, &i, sizeof(int64_t));
+    *buffer += sizeof(int64_t);
+}
+
+static void writeInt32(char **buffer, int64_t i) {
+    assert(i >= INT32_MIN && i <= INT32_MAX);
+    int32_t j = i;
+    memcpy(*buffer, &j, sizeof(int32_t));
+    *buffer += sizeof(int32_t);
+}
+
+static int64_t readInt64(char **buffer) {
+    int64_t i;
+    memcpy(&i, *buffer, sizeof(int64_t));
+    *buffer += sizeof(int64_t);
+    return i;
+}
+
+static int64_t readInt32(char **buffer) {
+    int32_t i;
+    memcpy(&i, *buffer, sizeof(int32_t));
+    *buffer += sizeof(int32_t);
+    return i;
+}
+
 void writeEndAlignmentToDisk(End *end, stSortedSet *endAlignment, FILE *fileHandle) {
-    fprintf(fileHandle, "%s %" PRIi64 "\n", cactusMisc_nameToStringStatic(end_getName(end)), stSortedSet_size(endAlignment));
+    int64_t recordLength = 2 * sizeof(int64_t) + stSortedSet_size(endAlignment) * END_ALIGNMENT_PAIR_SIZE;
+    char *record = st_malloc(sizeof(int64_t) + recordLength);
+    char *buffer = record;
+    writeInt64(&buffer, recordLength);
+    writeInt64(&buffer, end_getName(end));
+    writeInt64(&buffer, stSortedSet_size(endAlignment));
     stSortedSetIterator *it = stSortedSet_getIterator(endAlignment);
     AlignedPair *aP;
     while((aP = stSortedSet_getNext(it)) != NULL) {
-        fprintf(fileHandle, "%" PRIi64 " %" PRIi64 " %i %" PRIi64 " ", aP->subsequenceIdentifier, aP->position, aP->strand, aP->score);
-        aP = aP->reverse;
-        fprintf(fileHandle, "%" PRIi64 " %" PRIi64 " %i %" PRIi64 "\n", aP->subsequenceIdentifier, aP->position, aP->strand, aP->score);
+        writeInt64(&buffer, aP->subsequenceIdentifier);
+        writeInt64(&buffer, aP->position);
+        writeInt64(&buffer, aP->reverse->subsequenceIdentifier);
+        writeInt64(&buffer, aP->reverse->position);
+        writeInt32(&buffer, aP->score);
+        writeInt32(&buffer, aP->reverse->score);
+        *buffer++ = (aP->strand ? 1 : 0) | (aP->reverse->strand ? 2 : 0);
     }
     stSortedSet_destructIterator(it);
+    assert(buffer - record == (int64_t)sizeof(int64_t) + recordLength);
+    if((int64_t)fwrite(record, 1, sizeof(int64_t) + recordLength, fileHandle) != (int64_t)sizeof(int64_t) + recordLength) {
+        st_errAbort("Failed to write an end alignment to the disk\n");
+    }
+    free(record);
 }
 
 stSortedSet *loadEndAlignmentFromDisk(Flower *flower, FILE *fileHandle, End **end) {
-    stSortedSet *endAlignment =
-                stSortedSet_construct3((int (*)(const void *, const void *))alignedPair_cmpFn,
-                (void (*)(void *))alignedPair_destruct);
-    char *line = stFile_getLineFromFile(fileHandle);
-    if(line == NULL) {
+    int64_t recordLength;
+    if(fread(&recordLength, sizeof(int64_t), 1, fileHandle) != 1) {
         *end = NULL;
         return NULL;
     }
-    Name flowerName;
-    int64_t lineNumber;
-    int64_t i = sscanf(line, "%" PRIi64 " %" PRIi64 "", &flowerName, &lineNumber);
-    if(i != 2 || lineNumber < 0) {
-        st_errAbort("We encountered a mis-specified name in loading the first line of an end alignment from the disk: '%s'\n", line);
+    if(recordLength < 2 * (int64_t)sizeof(int64_t)) {
+        st_errAbort("We encountered an end alignment with a mis-specified length: %" PRIi64 "\n", recordLength);
+    }
+    char *record = st_malloc(recordLength);
+    if((int64_t)fread(record, 1, recordLength, fileHandle) != recordLength) {
+        st_errAbort("Got a truncated end alignment when loading end alignments from the disk\n");
     }
-    free(line);
-    *end = flower_getEnd(flower, flowerName);
+    char *buffer = record;
+    Name endName = readInt64(&buffer);
+    int64_t pairNumber = readInt64(&buffer);
+    if(pairNumber < 0 || recordLength != (int64_t)(2 * sizeof(int64_t) + pairNumber * END_ALIGNMENT_PAIR_SIZE)) {
+        st_errAbort("We encountered a mis-specified number of aligned pairs in loading an end alignment from the disk: %" PRIi64 "\n", pairNumber);
+    }
+    *end = flower_getEnd(flower, endName);
     if(*end == NULL) {
-        st_errAbort("We encountered an end name that is not in the database: '%s'\n", line);
+        st_errAbort("We encountered an end name that is not in the database: %" PRIi64 "\n", endName);
     }
-    for(int64_t i=0; i<lineNumber; i++) {
-        line = stFile_getLineFromFile(fileHandle);
-        if(line == NULL) {
-            st_errAbort("Got a null line when parsing an end alignment\n");
-        }
-        int64_t sI1, sI2;
-        int64_t p1, st1, p2, st2, score1, score2;
-        int64_t i = sscanf(line, "%" PRIi64 " %" PRIi64 " %" PRIi64 " %" PRIi64 " %" PRIi64 " %" PRIi64 " %" PRIi64 " %" PRIi64 "", &sI1, &p1, &st1, &score1, &sI2, &p2, &st2, &score2);
-        (void)i;
-        if(i != 8) {
-            st_errAbort("We encountered a mis-specified name in loading an end alignment from the disk: '%s'\n", line);
-        }
-        stSortedSet_insert(endAlignment, alignedPair_construct(sI1, p1, st1, sI2, p2, st2, score1, score2));
-        free(line);
+    stSortedSet *endAlignment =
+                stSortedSet_construct3((int (*)(const void *, const void *))alignedPair_cmpFn,
+                (void (*)(void *))alignedPair_destruct);
+    for(int64_t i=0; i<pairNumber; i++) {
+        int64_t sI1 = readInt64(&buffer);
+        int64_t p1 = readInt64(&buffer);
+        int64_t sI2 = readInt64(&buffer);
+        int64_t p2 = readInt64(&buffer);
+        int64_t score1 = readInt32(&buffer);
+        int64_t score2 = readInt32(&buffer);
+        char strands = *buffer++;
+        stSortedSet_insert(endAlignment, alignedPair_construct(sI1, p1, strands & 1, sI2, p2, (strands & 2) != 0, score1, score2));
     }
+    free(record);
     return endAlignment;
 }
 
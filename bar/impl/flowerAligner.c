@@ -567,6 +567,9 @@ static void loadEndAlignments(Flower *flower, stHash *endAlignments, stList *lis
     for (int64_t i = 0; i < stList_length(listOfEndAlignments); i++) {
         End *end;
         FILE *fileHandle = fopen(stList_get(listOfEndAlignments, i), "r");
+        if (fileHandle == NULL) {
+            st_errAbort("Could not open the end alignment file %s\n", stList_get(listOfEndAlignments, i));
+        }
         stSortedSet *alignment;
         while((alignment = loadEndAlignmentFromDisk(flower, fileHandle, &end)) != NULL) {
             assert(stHash_search(endAlignments, end) == NULL);
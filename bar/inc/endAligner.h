@@ -52,14 +52,14 @@ stSortedSet *makeEndAlignment(End *end, int64_t spanningTrees, int64_t maxSequen
         PairwiseAlignmentParameters *pairwiseAlignmentBandingParameters);
 
 /*
- * Writes an end alignment to the given file.
+ * Writes an end alignment to the given file, as a binary record prefixed by its length.
  */
 void writeEndAlignmentToDisk(End *end, stSortedSet *endAlignment, FILE *fileHandle);
 
 /*
- * Loads an end alignment from the given file.
+ * Loads the next end alignment from the given file, setting end to its end. Returns NULL
+ * (and sets end to NULL) at the end of the file.
  */
 stSortedSet *loadEndAlignmentFromDisk(Flower *flower, FILE *fileHandle, End **end);
 
-
 #endif /* ENDALIGNER_H_ */
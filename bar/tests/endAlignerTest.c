@@ -4,6 +4,7 @@
  * Released under the MIT license, see LICENSE.txt
  */
 
+#include <time.h>
 #include "flowersShared.h"
 #include "endAligner.h"
 #include "adjacencySequences.h"
@@ -149,10 +150,108 @@ static void testReadAndWriteEndAlignments(CuTest *testCase) {
     teardown();
 }
 
+/*
+ * Writes an end alignment in the text format used before the binary format, for comparison.
+ */
+static void writeEndAlignmentToDiskAsText(End *end, stSortedSet *endAlignment, FILE *fileHandle) {
+    fprintf(fileHandle, "%s %" PRIi64 "\n", cactusMisc_nameToStringStatic(end_getName(end)), stSortedSet_size(endAlignment));
+    stSortedSetIterator *it = stSortedSet_getIterator(endAlignment);
+    AlignedPair *aP;
+    while((aP = stSortedSet_getNext(it)) != NULL) {
+        fprintf(fileHandle, "%" PRIi64 " %" PRIi64 " %i %" PRIi64 " ", aP->subsequenceIdentifier, aP->position, aP->strand, aP->score);
+        aP = aP->reverse;
+        fprintf(fileHandle, "%" PRIi64 " %" PRIi64 " %i %" PRIi64 "\n", aP->subsequenceIdentifier, aP->position, aP->strand, aP->score);
+    }
+    stSortedSet_destructIterator(it);
+}
+
+static int64_t loadEndAlignmentFromDiskAsText(FILE *fileHandle) {
+    char *line = stFile_getLineFromFile(fileHandle);
+    if(line == NULL) {
+        return -1;
+    }
+    int64_t flowerName, lineNumber;
+    sscanf(line, "%" PRIi64 " %" PRIi64 "", &flowerName, &lineNumber);
+    free(line);
+    for(int64_t i=0; i<lineNumber; i++) {
+        line = stFile_getLineFromFile(fileHandle);
+        int64_t sI1, sI2, p1, st1, p2, st2, score1, score2;
+        sscanf(line, "%" PRIi64 " %" PRIi64 " %" PRIi64 " %" PRIi64 " %" PRIi64 " %" PRIi64 " %" PRIi64 " %" PRIi64 "", &sI1, &p1, &st1, &score1, &sI2, &p2, &st2, &score2);
+        alignedPair_destruct(alignedPair_construct(sI1, p1, st1, sI2, p2, st2, score1, score2));
+        free(line);
+    }
+    return lineNumber;
+}
+
+static int64_t getFileSize(const char *file) {
+    FILE *fileHandle = fopen(file, "r");
+    fseek(fileHandle, 0, SEEK_END);
+    int64_t size = ftell(fileHandle);
+    fclose(fileHandle);
+    return size;
+}
+
+static void testEndAlignmentFileBenchmark(CuTest *testCase) {
+    /*
+     * Compares the size of the binary and text end alignment files, and the time to parse them.
+     */
+    setup();
+    End *ends[3] = { end1, end2, end3 };
+    stSortedSet *endAlignments[3];
+    for (int64_t endIndex = 0; endIndex < 3; endIndex++) {
+        endAlignments[endIndex] = makeEndAlignment(ends[endIndex], 5, 4, 50, 0.5, pairwiseParameters);
+    }
+    int64_t repeats = 3000;
+    FILE *fileHandle = fopen("temporaryEndAlignmentFile.bin", "w");
+    FILE *textFileHandle = fopen("temporaryEndAlignmentFile.txt", "w");
+    for (int64_t i = 0; i < repeats; i++) {
+        writeEndAlignmentToDisk(ends[i % 3], endAlignments[i % 3], fileHandle);
+        writeEndAlignmentToDiskAsText(ends[i % 3], endAlignments[i % 3], textFileHandle);
+    }
+    fclose(fileHandle);
+    fclose(textFileHandle);
+
+    clock_t startTime = clock();
+    fileHandle = fopen("temporaryEndAlignmentFile.bin", "r");
+    End *end;
+    stSortedSet *endAlignment;
+    int64_t alignmentNumber = 0;
+    while((endAlignment = loadEndAlignmentFromDisk(flower, fileHandle, &end)) != NULL) {
+        CuAssertTrue(testCase, stSortedSet_equals(endAlignment, endAlignments[alignmentNumber++ % 3]));
+        stSortedSet_destruct(endAlignment);
+    }
+    CuAssertIntEquals(testCase, repeats, alignmentNumber);
+    fclose(fileHandle);
+    double binaryTime = ((double)(clock() - startTime)) / CLOCKS_PER_SEC;
+
+    startTime = clock();
+    textFileHandle = fopen("temporaryEndAlignmentFile.txt", "r");
+    alignmentNumber = 0;
+    while(loadEndAlignmentFromDiskAsText(textFileHandle) >= 0) {
+        alignmentNumber++;
+    }
+    fclose(textFileHandle);
+    CuAssertIntEquals(testCase, repeats, alignmentNumber);
+    double textTime = ((double)(clock() - startTime)) / CLOCKS_PER_SEC;
+
+    st_logCritical("For %" PRIi64 " end alignments the binary file has %" PRIi64 " bytes and took %f seconds to parse, "
+            "the text file has %" PRIi64 " bytes and took %f seconds to parse\n",
+            repeats, getFileSize("temporaryEndAlignmentFile.bin"), binaryTime,
+            getFileSize("temporaryEndAlignmentFile.txt"), textTime);
+    CuAssertTrue(testCase, getFileSize("temporaryEndAlignmentFile.bin") < getFileSize("temporaryEndAlignmentFile.txt"));
+    for (int64_t endIndex = 0; endIndex < 3; endIndex++) {
+        stSortedSet_destruct(endAlignments[endIndex]);
+    }
+    stFile_rmrf("temporaryEndAlignmentFile.bin");
+    stFile_rmrf("temporaryEndAlignmentFile.txt");
+    teardown();
+}
+
 CuSuite* endAlignerTestSuite(void) {
     CuSuite* suite = CuSuiteNew();
     SUITE_ADD_TEST(suite, testMakeEndAlignments);
     SUITE_ADD_TEST(suite, testReadAndWriteEndAlignments);
+    SUITE_ADD_TEST(suite, testEndAlignmentFileBenchmark);
     SUITE_ADD_TEST(suite, test_alignedPair_cmpFn);
     return suite;
 }
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+
+#Copyright (C) 2026 by the cactus contributors
+#
+#Released under the MIT license, see LICENSE.txt
+
+"""Benchmarks a local ktserver, launched with the same code the workflow uses, by
+replaying workloads like those of cactus at different numbers of concurrent clients.
+The throughput and the latency percentiles of each workload are written as JSON, so
+that tuning and server options can be compared offline, e.g.:
+
+ktserverBenchmark.py --databaseDir ./benchDb --tuningOptions "#opts=ls#bnum=1m#msiz=1g#ktopts=p" \
+    --workloads bulkSet,randomGet,batchGetByFlower --concurrency 1,4,16 --outputFile bench.json
+
+The workloads are:
+
+bulkSet : sets batchSize records at a time, as cactus writes back the flowers of a job
+set : sets one record at a time
+randomGet : gets one record at a time, with a random key
+batchGetByFlower : gets batchSize records with consecutive keys at a time, as cactus loads
+                   the child flowers of a flower, whose names are consecutive
+
+The keys are 64 bit integers, as cactus uses. The sizes of the records are either fixed,
+uniform in a range, or drawn from a file of sizes, one per line, which can be sampled from a
+cactus database with --sampleRecordSizes.
+
+With --partitions the benchmarks are repeated with the records partitioned between each given
+number of servers, launched with ktserverControl.runKtserverSet, and the clients routing each
+key to its server, to show how the throughput scales with the number of servers.
+"""
+
+import os
+import sys
+import time
+import math
+import json
+import base64
+import random
+import struct
+import shutil
+import httplib
+import socket
+import threading
+import multiprocessing
+import xml.etree.ElementTree as ET
+from optparse import OptionParser
+
+from sonLib.bioio import getTempFile
+from sonLib.bioio import logger
+from sonLib.bioio import setLoggingFromOptions
+from cactus.shared.experimentWrapper import DbElemWrapper
+from cactus.pipeline.ktserverControl import runKtserverSet
+from cactus.pipeline.ktserverControl import blockUntilKtserverSetIsRunning
+from cactus.pipeline.ktserverControl import killKtServerSet
+from cactus.pipeline.ktserverControl import KtServerProbe
+
+workloadNames = ("bulkSet", "set", "randomGet", "batchGetByFlower")
+
+class KtRpcClient:
+    """Calls the procedures of the HTTP RPC interface of a ktserver over one kept-alive
+    connection. The names and values are base64 encoded, so they can be binary.
+    """
+    def __init__(self, host, port, timeout=60.0):
+        self.connection = httplib.HTTPConnection(host, port, timeout=timeout)
+        self.connection.connect()
+        #Small requests are sent at once rather than batched, so they are timed fairly
+        self.connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def call(self, procedure, fields):
+        body = "".join([ "%s\t%s\n" % (base64.b64encode(name), base64.b64encode(value)) for name, value in fields ])
+        self.connection.request("POST", "/rpc/%s" % procedure, body,
+                                { "Content-Type":"text/tab-separated-values; colenc=B" })
+        response = self.connection.getresponse()
+        responseBody = response.read()
+        if response.status != 200:
+            raise RuntimeError("The ktserver answered %s with status %i: %s" % (procedure, response.status, responseBody))
+        decode = lambda x : x
+        if response.getheader("Content-Type", "").find("colenc=B") >= 0:
+            decode = base64.b64decode
+        return [ tuple([ decode(i) for i in line.split("\t", 1) ]) for line in responseBody.split("\n") if line.find("\t") >= 0 ]
+
+    def close(self):
+        self.connection.close()
+
+class PartitionedKtRpcClient:
+    """A KtRpcClient for each server of a (possibly partitioned) database, routing the
+    records of each call to the servers holding their keys.
+    """
+    def __init__(self, dbElem):
+        self.dbElem = dbElem
+        self.clients = [ KtRpcClient(partition.getDbHost(), partition.getDbPort()) for partition in dbElem.getDbPartitions() ]
+
+    def call(self, procedure, fields):
+        if procedure in ("set_bulk", "get_bulk"):
+            #The names of the records are their keys prefixed with "_"
+            partitionFields = [ [] for client in self.clients ]
+            for name, value in fields:
+                partitionFields[self.dbElem.getDbPartitionIndex(name[1:])].append((name, value))
+            output = []
+            for client, clientFields in zip(self.clients, partitionFields):
+                if len(clientFields) > 0:
+                    output += client.call(procedure, clientFields)
+            return output
+        return self.clients[self.dbElem.getDbPartitionIndex(dict(fields)["key"])].call(procedure, fields)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+
+def encodeKey(key):
+    """Keys are stored as cactus stores them, as 64 bit integers.
+    """
+    return struct.pack("<q", key)
+
+def parseRecordSizes(recordSizes):
+    """Returns a function that returns a random record size from a spec that is one of
+    fixed:size, uniform:minSize:maxSize or file:path (one size per line).
+    """
+    fields = recordSizes.split(":", 1)
+    if fields[0] == "fixed":
+        size = int(fields[1])
+        return lambda : size
+    if fields[0] == "uniform":
+        minSize, maxSize = [ int(i) for i in fields[1].split(":") ]
+        return lambda : random.randint(minSize, maxSize)
+    if fields[0] == "file":
+        sizes = [ int(line) for line in open(fields[1]) if line.strip() != "" ]
+        if len(sizes) == 0:
+            raise RuntimeError("No record sizes in %s" % fields[1])
+        return lambda : random.choice(sizes)
+    raise RuntimeError("Unrecognised record sizes: %s" % recordSizes)
+
+def sampleRecordSizes(host, port, sampleNumber):
+    """Returns the sizes of the first sampleNumber records of a running server, in the
+    order of its database (which for a hash database is random).
+    """
+    client = KtRpcClient(host, port)
+    sizes = []
+    try:
+        client.call("cur_jump", [ ("CUR", "1") ])
+        while len(sizes) < sampleNumber:
+            record = dict(client.call("cur_get", [ ("CUR", "1"), ("step", "") ]))
+            sizes.append(len(record["value"]))
+    except RuntimeError:
+        pass #The cursor ran off the end of the database
+    client.close()
+    return sizes
+
+def getPercentile(sortedValues, percentile):
+    """The nearest rank percentile of a sorted list.
+    """
+    if len(sortedValues) == 0:
+        return None
+    return sortedValues[max(0, int(math.ceil(percentile / 100.0 * len(sortedValues))) - 1)]
+
+def runWorkload(args):
+    """Runs operationNumber operations of a workload as one client, returning the latency of
+    each operation and the number of records read or written.
+    """
+    confString, workload, operationNumber, recordNumber, batchSize, recordSizes, seed = args
+    random.seed(seed)
+    getRecordSize = parseRecordSizes(recordSizes)
+    client = PartitionedKtRpcClient(DbElemWrapper(ET.fromstring(confString)))
+    latencies = []
+    records = 0
+    for i in xrange(operationNumber):
+        if workload == "bulkSet":
+            firstKey = random.randint(0, max(0, recordNumber - batchSize))
+            fields = [ ("_" + encodeKey(key), os.urandom(getRecordSize())) for key in xrange(firstKey, firstKey + batchSize) ]
+            startTime = time.time()
+            client.call("set_bulk", fields)
+        elif workload == "set":
+            fields = [ ("key", encodeKey(random.randint(0, recordNumber - 1))), ("value", os.urandom(getRecordSize())) ]
+            startTime = time.time()
+            client.call("set", fields)
+        elif workload == "randomGet":
+            fields = [ ("key", encodeKey(random.randint(0, recordNumber - 1))) ]
+            startTime = time.time()
+            try:
+                client.call("get", fields)
+            except RuntimeError:
+                pass #A missing record is answered with an error status
+        elif workload == "batchGetByFlower":
+            firstKey = random.randint(0, max(0, recordNumber - batchSize))
+            fields = [ ("_" + encodeKey(key), "") for key in xrange(firstKey, firstKey + batchSize) ]
+            startTime = time.time()
+            client.call("get_bulk", fields)
+        else:
+            raise RuntimeError("Unrecognised workload: %s" % workload)
+        latencies.append(time.time() - startTime)
+        records += len(fields) if workload in ("bulkSet", "batchGetByFlower") else 1
+    client.close()
+    return latencies, records
+
+def runBenchmark(dbElem, workload, concurrency, operationNumber, recordNumber, batchSize, recordSizes):
+    """Runs the workload with concurrency clients, each in its own process, sharing
+    operationNumber operations, and returns the stats of the run.
+    """
+    operationsPerClient = max(1, operationNumber / concurrency)
+    pool = multiprocessing.Pool(concurrency)
+    startTime = time.time()
+    results = pool.map(runWorkload, [ (dbElem.getConfString(), workload, operationsPerClient, recordNumber, batchSize,
+                                       recordSizes, random.random()) for i in xrange(concurrency) ])
+    seconds = time.time() - startTime
+    pool.close()
+    pool.join()
+    latencies = sorted(reduce(lambda x, y : x + y, [ result[0] for result in results ]))
+    records = sum([ result[1] for result in results ])
+    toMs = lambda x : round(x * 1000, 3)
+    return { "workload":workload, "partitions":dbElem.getDbPartitionNumber(), "concurrency":concurrency,
+             "operations":len(latencies), "records":records,
+             "seconds":round(seconds, 3), "operationsPerSecond":round(len(latencies) / seconds, 1),
+             "recordsPerSecond":round(records / seconds, 1),
+             "latencyMs": { "mean":toMs(sum(latencies) / len(latencies)), "p50":toMs(getPercentile(latencies, 50)),
+                            "p95":toMs(getPercentile(latencies, 95)), "p99":toMs(getPercentile(latencies, 99)),
+                            "max":toMs(latencies[-1]) } }
+
+def getBenchmarkDbElem(options, partitionNumber):
+    dbElem = DbElemWrapper(ET.fromstring("<st_kv_database_conf type=\"kyoto_tycoon\"><kyoto_tycoon host=\"%s\" port=\"%s\" database_dir=\"%s\" database_name=\"benchmark.kch\"/></st_kv_database_conf>" % \
+                                         (options.host, options.port, os.path.abspath(options.databaseDir))))
+    dbElem.setDbInMemory(options.inMemory)
+    if options.serverOptions is not None:
+        dbElem.setDbServerOptions(options.serverOptions)
+    if options.tuningOptions is not None:
+        dbElem.setDbCreateTuningOptions(options.tuningOptions)
+    if partitionNumber > 1:
+        dbElem.setDbPartitionNumber(partitionNumber)
+    return dbElem
+
+def runBenchmarks(options, partitionNumber, workloads, concurrencies):
+    """Launches the (partitioned) database, loads it and runs each workload at each concurrency,
+    returning the stats of the runs and the health of the servers at the end.
+    """
+    if os.path.exists(options.databaseDir):
+        shutil.rmtree(options.databaseDir)
+    os.makedirs(options.databaseDir)
+    dbElem = getBenchmarkDbElem(options, partitionNumber)
+    killSwitchPath = getTempFile(suffix="_kill.txt")
+    open(killSwitchPath, "w").write("init")
+    serverErrors = []
+    def launch():
+        try:
+            runKtserverSet(dbElem, killSwitchPath)
+        except Exception, e:
+            serverErrors.append(e)
+    serverThread = threading.Thread(target=launch)
+    serverThread.daemon = True
+    serverThread.start()
+    try:
+        blockUntilKtserverSetIsRunning(dbElem, killSwitchPath, timeout=600)
+        logger.info("Loading %i records into the ktservers %s" % (options.recordNumber, ", ".join(
+                    [ "%s:%i" % (partition.getDbHost(), partition.getDbPort()) for partition in dbElem.getDbPartitions() ])))
+        loadClient = PartitionedKtRpcClient(dbElem)
+        getRecordSize = parseRecordSizes(options.recordSizes)
+        for firstKey in xrange(0, options.recordNumber, 1000):
+            loadClient.call("set_bulk", [ ("_" + encodeKey(key), os.urandom(getRecordSize()))
+                                          for key in xrange(firstKey, min(options.recordNumber, firstKey + 1000)) ])
+        loadClient.close()
+
+        results = []
+        for workload in workloads:
+            for concurrency in concurrencies:
+                result = runBenchmark(dbElem, workload, concurrency, options.operations,
+                                      options.recordNumber, options.batchSize, options.recordSizes)
+                logger.info("%s with %i servers and %i clients: %s operations/s, latency p50 %s ms, p95 %s ms, p99 %s ms" % \
+                            (workload, partitionNumber, concurrency, result["operationsPerSecond"], result["latencyMs"]["p50"],
+                             result["latencyMs"]["p95"], result["latencyMs"]["p99"]))
+                results.append(result)
+        health = []
+        for partition in dbElem.getDbPartitions():
+            probe = KtServerProbe(partition)
+            health.append(probe.getHealth())
+            probe.close()
+    finally:
+        if os.path.isfile(killSwitchPath):
+            killKtServerSet(dbElem, killSwitchPath)
+        serverThread.join(60)
+        shutil.rmtree(options.databaseDir)
+    if len(serverErrors) > 0:
+        raise serverErrors[0]
+    return results, health
+
+def main():
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage=usage)
+    parser.add_option("--host", dest="host", default="localhost")
+    parser.add_option("--port", dest="port", type="int", default=1978,
+                      help="The first port to try to launch the server on")
+    parser.add_option("--databaseDir", dest="databaseDir", default="./ktserverBenchmarkDb",
+                      help="The directory of the database, which is removed before and after the benchmark")
+    parser.add_option("--inMemory", dest="inMemory", action="store_true", default=False,
+                      help="Use an in memory database")
+    parser.add_option("--serverOptions", dest="serverOptions",
+                      help="The ktserver options, by default those of the workflow")
+    parser.add_option("--tuningOptions", dest="tuningOptions",
+                      help="The tuning options of the database, by default those of the workflow")
+    parser.add_option("--workloads", dest="workloads", default=",".join(workloadNames),
+                      help="Comma separated workloads to run, of %s" % ", ".join(workloadNames))
+    parser.add_option("--partitions", dest="partitions", default="1",
+                      help="Comma separated numbers of servers to partition the records between")
+    parser.add_option("--concurrency", dest="concurrency", default="1,4,16",
+                      help="Comma separated numbers of concurrent clients to run each workload with")
+    parser.add_option("--operations", dest="operations", type="int", default=10000,
+                      help="The number of operations of each run, shared between the clients")
+    parser.add_option("--recordNumber", dest="recordNumber", type="int", default=100000,
+                      help="The number of records loaded before the workloads, and the range of their keys")
+    parser.add_option("--batchSize", dest="batchSize", type="int", default=100,
+                      help="The number of records of each bulkSet and batchGetByFlower operation")
+    parser.add_option("--recordSizes", dest="recordSizes", default="uniform:0:1000",
+                      help="The sizes of the records, as fixed:size, uniform:minSize:maxSize or file:path")
+    parser.add_option("--sampleRecordSizes", dest="sampleRecordSizes",
+                      help="Rather than benchmark, write the sizes of records of the (cactus) database served " \
+                      "at --host and --port to this file, for use with --recordSizes file:path")
+    parser.add_option("--sampleNumber", dest="sampleNumber", type="int", default=100000,
+                      help="The number of record sizes to sample")
+    parser.add_option("--outputFile", dest="outputFile", help="The file to write the JSON results to, by default stdout")
+    parser.add_option("--logLevel", dest="logLevel", default="INFO")
+    options, args = parser.parse_args()
+    setLoggingFromOptions(options)
+    if len(args) != 0:
+        raise RuntimeError("Unrecognised input arguments: %s" % " ".join(args))
+
+    if options.sampleRecordSizes is not None:
+        sizes = sampleRecordSizes(options.host, options.port, options.sampleNumber)
+        fileHandle = open(options.sampleRecordSizes, "w")
+        fileHandle.write("".join([ "%i\n" % size for size in sizes ]))
+        fileHandle.close()
+        logger.info("Wrote %i record sizes with mean %f to %s" % (len(sizes), float(sum(sizes)) / max(1, len(sizes)),
+                                                                   options.sampleRecordSizes))
+        return 0
+
+    workloads = options.workloads.split(",")
+    for workload in workloads:
+        if workload not in workloadNames:
+            raise RuntimeError("Unrecognised workload: %s" % workload)
+    concurrencies = [ int(i) for i in options.concurrency.split(",") ]
+    partitionNumbers = [ int(i) for i in options.partitions.split(",") ]
+    parseRecordSizes(options.recordSizes)
+
+    results = []
+    health = {}
+    for partitionNumber in partitionNumbers:
+        partitionResults, partitionHealth = runBenchmarks(options, partitionNumber, workloads, concurrencies)
+        results += partitionResults
+        health[partitionNumber] = partitionHealth
+
+    output = { "server": { "serverOptions":options.serverOptions, "tuningOptions":options.tuningOptions,
+                           "inMemory":options.inMemory, "health":health },
+               "recordNumber":options.recordNumber, "batchSize":options.batchSize, "recordSizes":options.recordSizes,
+               "results":results }
+    outputString = json.dumps(output, indent=2, sort_keys=True)
+    if options.outputFile is not None:
+        fileHandle = open(options.outputFile, "w")
+        fileHandle.write(outputString + "\n")
+        fileHandle.close()
+    else:
+        print outputString
+    return 0
+
+if __name__ == '__main__':
+    from cactus.dbTest.ktserverBenchmark import *
+    sys.exit(main())
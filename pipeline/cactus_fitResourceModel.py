@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+#Copyright (C) 2026 by the cactus contributors
+#
+#Released under the MIT license, see LICENSE.txt
+
+"""Fits a model of the memory and cpu the cactus_workflow.py wrapper jobs need from
+the resource usage they recorded in a previous run (made with recordResourceUsage="1"
+in the constants of the config) and the jobTree stats of the run (made with --stats).
+The model is used by setting resourceModel in the constants of the config to the model file.
+
+The resource usage is recorded next to the experiment file, in the file named after it
+followed by "_wrapperResourceUsage.txt". Each run on the experiment adds to the records
+of the previous runs.
+"""
+
+import sys
+from optparse import OptionParser
+
+from cactus.shared.common import readWrapperResourceUsage
+from cactus.shared.common import readJobTreeStats
+from cactus.shared.common import fitWrapperResourceModel
+from cactus.shared.common import writeWrapperResourceModel
+
+def main():
+    usage = "usage: %prog [options] <resourceUsageFile> <modelFile>"
+    parser = OptionParser(usage=usage)
+    parser.add_option("--jobTreeStats", dest="jobTreeStats", action="append", default=[],
+                      help="The stats.xml of a jobTree made with --stats, may be given more than once")
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.print_help()
+        return 1
+    resourceUsage = readWrapperResourceUsage(args[0])
+    jobTreeStats = {}
+    for statsFile in options.jobTreeStats:
+        for targetClass, records in readJobTreeStats(statsFile).items():
+            jobTreeStats.setdefault(targetClass, []).extend(records)
+    #Only the classes of wrappers are modelled
+    jobTreeStats = dict([ (targetClass, records) for targetClass, records in jobTreeStats.items() if targetClass.endswith("Wrapper") ])
+    model = fitWrapperResourceModel(resourceUsage, jobTreeStats)
+    writeWrapperResourceModel(model, args[1])
+    for wrapperName in sorted(model.keys()):
+        sys.stderr.write("%s: memory %i + %f per base, %i cpus\n" % (wrapperName, model[wrapperName]["memory"],
+                                                                     model[wrapperName]["memoryPerBase"], model[wrapperName]["cpu"]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
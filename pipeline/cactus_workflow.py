@@ -19,6 +19,12 @@ import bz2
 import random
 import copy
 import shutil
+import weakref
+import zlib
+import cPickle
+import heapq
+import json
+import hashlib
 from optparse import OptionParser
 
 from sonLib.bioio import getTempFile
@@ -36,6 +42,7 @@ from jobTree.scriptTree.stack import Stack
 from jobTree.src.bioio import getLogLevelString
 
 from cactus.shared.common import getOptionalAttrib
+from cactus.shared.common import convertAttrib
 from cactus.shared.common import runCactusSetup
 from cactus.shared.common import runCactusCaf
 from cactus.shared.common import runCactusGetFlowers
@@ -53,6 +60,19 @@ from cactus.shared.common import runCactusAddReferenceCoordinates
 from cactus.shared.common import runCactusCheck
 from cactus.shared.common import runCactusHalGenerator
 from cactus.shared.common import runCactusFlowerStats
+from cactus.shared.common import runCactusFlowerStatsBatch
+from cactus.shared.common import parseFlowerStats
+from cactus.shared.common import decodeFlowerNames
+from cactus.shared.common import getFlowerNamesSize
+from cactus.shared.common import runWithCommitDeadline
+from cactus.shared.common import getWrapperResourceUsageFile
+from cactus.shared.common import appendWrapperResourceUsage
+from cactus.shared.common import readWrapperRuntimes
+from cactus.shared.common import predictWrapperRuntime
+from cactus.shared.common import getWrapperResourceModel
+from cactus.shared.common import predictWrapperResources
+from cactus.shared.common import runCactusFlowerTree
+from cactus.shared.common import getFlowerTreeIndex
 from cactus.shared.common import runCactusSecondaryDatabase
 from cactus.shared.common import runCactusFastaGenerator
 from cactus.shared.common import findRequiredNode
@@ -70,6 +90,11 @@ from cactus.shared.experimentWrapper import ExperimentWrapper
 from cactus.shared.experimentWrapper import DbElemWrapper
 from cactus.shared.configWrapper import ConfigWrapper
 from cactus.pipeline.ktserverJobTree import addKtserverDependentChild
+from cactus.pipeline.ktserverJobTree import addReusedKtserverDependentChild
+from cactus.pipeline.ktserverJobTree import areReusedKtserversRunning
+from cactus.pipeline.ktserverJobTree import logShutdownStats
+from cactus.pipeline.ktserverControl import setKtTuningOptionsForWorkload
+from cactus.pipeline.ktserverControl import killKtServerSet
 
 ############################################################
 ############################################################
@@ -84,6 +109,112 @@ def extractNode(node):
     """
     return ET.fromstring(ET.tostring(node))
 
+class _ReadOnlyAttrib(dict):
+    """The attributes of a PhaseParameters, a dict that can't be changed.
+    """
+    def __readOnly(self, *args, **kwargs):
+        raise TypeError("Phase parameters are immutable, use withAttrib to make a changed copy")
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __readOnly
+
+class PhaseParameters(object):
+    """An immutable copy of a phase node (or the constants node) and of its target nodes, which 
+    recursion targets hold and pass to their children in place of XML. It can be read like an XML 
+    node by getOptionalAttrib and getTargetNode. Copies with the same content are the same object, 
+    and are pickled by value as compressed tuples of strings rather than as element trees, so they 
+    take much less space in each target's pickle.
+    """
+    __slots__ = ("tag", "attrib", "children", "_key", "_packed", "_typedAttribs", "__weakref__")
+    _interned = weakref.WeakValueDictionary()
+    
+    def __new__(cls, tag, attrib=(), children=()):
+        attrib = tuple(sorted(dict(attrib).items()))
+        children = tuple(children)
+        key = (tag, attrib, children) #The children are interned, so they are compared by identity
+        parameters = PhaseParameters._interned.get(key)
+        if parameters == None:
+            parameters = object.__new__(cls)
+            object.__setattr__(parameters, "tag", tag)
+            object.__setattr__(parameters, "attrib", _ReadOnlyAttrib(attrib))
+            object.__setattr__(parameters, "children", children)
+            object.__setattr__(parameters, "_key", key)
+            object.__setattr__(parameters, "_packed", None)
+            object.__setattr__(parameters, "_typedAttribs", {})
+            PhaseParameters._interned[key] = parameters
+        return parameters
+    
+    @staticmethod
+    def fromNode(node):
+        """Makes the parameters of an XML node, or returns them if given parameters already.
+        """
+        if isinstance(node, PhaseParameters):
+            return node
+        return PhaseParameters(node.tag, node.attrib, [ PhaseParameters.fromNode(child) for child in node ])
+    
+    def __setattr__(self, name, value):
+        raise TypeError("Phase parameters are immutable, use withAttrib to make a changed copy")
+    
+    def _toTuple(self):
+        return (self.tag, self._key[1], tuple([ child._toTuple() for child in self.children ]))
+    
+    @staticmethod
+    def _fromTuple(parametersTuple):
+        tag, attrib, children = parametersTuple
+        return PhaseParameters(tag, attrib, [ PhaseParameters._fromTuple(child) for child in children ])
+    
+    def __reduce__(self):
+        if self._packed == None: #Compressed once, however many targets are pickled with the parameters
+            object.__setattr__(self, "_packed", zlib.compress(cPickle.dumps(self._toTuple(), cPickle.HIGHEST_PROTOCOL)))
+        return (unpackPhaseParameters, (self._packed,))
+    
+    def __repr__(self):
+        return "PhaseParameters(%r, %r, %r)" % self._key
+    
+    def find(self, tag):
+        for child in self.children:
+            if child.tag == tag:
+                return child
+        return None
+    
+    def findall(self, tag):
+        return [ child for child in self.children if child.tag == tag ]
+    
+    def get(self, attribName, default=None):
+        return self.attrib.get(attribName, default)
+    
+    def getOptionalAttrib(self, attribName, typeFn=None, default=None):
+        """Like getOptionalAttrib, but each attribute is converted to a given type only once.
+        """
+        if attribName not in self.attrib:
+            return default
+        try:
+            return self._typedAttribs[(attribName, typeFn)]
+        except KeyError:
+            value = self.attrib[attribName] if typeFn == None else convertAttrib(self.attrib[attribName], typeFn)
+            self._typedAttribs[(attribName, typeFn)] = value
+            return value
+    
+    def withAttrib(self, attribName, value):
+        """Returns a copy of the parameters with the given attribute set, or removed if value is None.
+        """
+        attrib = dict(self.attrib)
+        if value == None:
+            attrib.pop(attribName, None)
+        else:
+            attrib[attribName] = value
+        return PhaseParameters(self.tag, attrib, self.children)
+
+def unpackPhaseParameters(packed):
+    """Unpickles a PhaseParameters.
+    """
+    return PhaseParameters._fromTuple(cPickle.loads(zlib.decompress(packed)))
+
+def getOptionalParameter(node, attribName, typeFn=None, default=None):
+    """Gets an optional attribute of an XML node or of PhaseParameters.
+    """
+    if isinstance(node, PhaseParameters):
+        return node.getOptionalAttrib(attribName, typeFn=typeFn, default=default)
+    return getOptionalAttrib(node=node, attribName=attribName, typeFn=typeFn, default=default)
+
 def getTargetNode(phaseNode, targetClass):
     """Gets a target node for a given target.
     """
@@ -95,31 +226,39 @@ def getTargetNode(phaseNode, targetClass):
 class CactusTarget(Target):
     """Base target for all cactus workflow targets.
     """
-    def __init__(self, phaseNode, constantsNode, overlarge=False):
+    def __init__(self, phaseNode, constantsNode, overlarge=False, predictedResources=None):
+        """If given, predictedResources is a (memory, cpu) pair used in place of the static memory 
+        and cpu of the target's class, where they are smaller.
+        """
         self.phaseNode = phaseNode
         self.constantsNode = constantsNode
         self.overlarge = overlarge
         self.targetNode = getTargetNode(self.phaseNode, self.__class__)
         if overlarge:
-            Target.__init__(self, memory=self.getOptionalTargetAttrib("overlargeMemory", typeFn=int, 
-                                                                      default=getOptionalAttrib(self.constantsNode, "defaultOverlargeMemory", int, default=sys.maxint)),
-                                  cpu=self.getOptionalTargetAttrib("overlargeCpu", typeFn=int, 
-                                                                      default=getOptionalAttrib(self.constantsNode, "defaultOverlargeCpu", int, default=sys.maxint)))
+            memory = self.getOptionalTargetAttrib("overlargeMemory", typeFn=int, 
+                                                  default=getOptionalParameter(self.constantsNode, "defaultOverlargeMemory", int, default=sys.maxint))
+            cpu = self.getOptionalTargetAttrib("overlargeCpu", typeFn=int, 
+                                               default=getOptionalParameter(self.constantsNode, "defaultOverlargeCpu", int, default=sys.maxint))
         else:
-            Target.__init__(self, memory=self.getOptionalTargetAttrib("memory", typeFn=int, 
-                                                                      default=getOptionalAttrib(self.constantsNode, "defaultMemory", int, default=sys.maxint)),
-                                  cpu=self.getOptionalTargetAttrib("cpu", typeFn=int, 
-                                                                      default=getOptionalAttrib(self.constantsNode, "defaultCpu", int, default=sys.maxint)))
+            memory = self.getOptionalTargetAttrib("memory", typeFn=int, 
+                                                  default=getOptionalParameter(self.constantsNode, "defaultMemory", int, default=sys.maxint))
+            cpu = self.getOptionalTargetAttrib("cpu", typeFn=int, 
+                                               default=getOptionalParameter(self.constantsNode, "defaultCpu", int, default=sys.maxint))
+        self.predictedResources = predictedResources != None
+        if predictedResources != None:
+            memory = min(memory, predictedResources[0])
+            cpu = min(cpu, predictedResources[1])
+        Target.__init__(self, memory=memory, cpu=cpu)
     
     def getOptionalPhaseAttrib(self, attribName, typeFn=None, default=None):
         """Gets an optional attribute of the phase node.
         """
-        return getOptionalAttrib(node=self.phaseNode, attribName=attribName, typeFn=typeFn, default=default)
+        return getOptionalParameter(self.phaseNode, attribName, typeFn=typeFn, default=default)
     
     def getOptionalTargetAttrib(self, attribName, typeFn=None, default=None):
         """Gets an optional attribute of the target node.
         """
-        return getOptionalAttrib(node=self.targetNode, attribName=attribName, typeFn=typeFn, default=default)
+        return getOptionalParameter(self.targetNode, attribName, typeFn=typeFn, default=default)
 
 class CactusPhasesTarget(CactusTarget):
     """Base target for each workflow phase target.
@@ -133,8 +272,8 @@ class CactusPhasesTarget(CactusTarget):
         self.topFlowerName = topFlowerName
     
     def makeRecursiveChildTarget(self, target, launchSecondaryKtForRecursiveTarget=False):
-        newChild = target(phaseNode=extractNode(self.phaseNode), 
-                          constantsNode=extractNode(self.constantsNode),
+        newChild = target(phaseNode=PhaseParameters.fromNode(self.phaseNode), 
+                          constantsNode=PhaseParameters.fromNode(self.constantsNode),
                           cactusDiskDatabaseString=self.cactusWorkflowArguments.cactusDiskDatabaseString, 
                           flowerNames=encodeFlowerNames((self.topFlowerName,)), overlarge=True)
         
@@ -144,13 +283,30 @@ class CactusPhasesTarget(CactusTarget):
                     self.constantsNode, "defaultMemory", int, default=sys.maxint))
             cpu = cw.getKtserverCpu(default=getOptionalAttrib(
                     self.constantsNode, "defaultCpu", int, default=sys.maxint))
-            addKtserverDependentChild(self, newChild, maxMemory=memory, maxCpu=cpu, isSecondary = True)
+            reuseDir = None
+            if cw.getKtserverReuseSecondary():
+                reuseDir = ExperimentWrapper(self.cactusWorkflowArguments.experimentNode).getKtserverReuseDir()
+            addKtserverDependentChild(self, newChild, maxMemory=memory, maxCpu=cpu, isSecondary = True, reuseDir=reuseDir,
+                                      metricsInterval=cw.getKtserverMetricsInterval())
         else:
             self.addChildTarget(newChild)
     
+    def usesSecondaryDatabase(self):
+        """Whether the phase runs targets that use the secondary database.
+        """
+        return False
+    
+    def usesPrimaryDatabase(self):
+        """Whether the phase needs the server of the primary database running, if it has one.
+        """
+        return True
+    
     def makeFollowOnPhaseTarget(self, target, phaseName, index=0):
-        self.setFollowOnTarget(target(cactusWorkflowArguments=self.cactusWorkflowArguments, phaseName=phaseName, 
-                                      topFlowerName=self.topFlowerName, index=index))
+        #The next phase is run by a checkpoint target, which records that this one has completed
+        self.setFollowOnTarget(CactusPhaseCheckpoint(cactusWorkflowArguments=self.cactusWorkflowArguments, 
+                                                     completedPhase=self.__class__.__name__,
+                                                     nextPhaseTarget=target, nextPhaseName=phaseName, 
+                                                     topFlowerName=self.topFlowerName, index=index))
         
     def runPhase(self, recursiveTarget, nextPhaseTarget, nextPhaseName, doRecursion=True, index=0, launchSecondaryKtForRecursiveTarget=False):
         self.logToMaster("Starting %s phase target with index %i at %s seconds (recursing = %i)" % (self.phaseNode.tag, self.getPhaseIndex(), time.time(), doRecursion))
@@ -184,8 +340,9 @@ class CactusRecursionTarget(CactusTarget):
     """Base recursive target for traversals up and down the cactus tree.
     """
     maxSequenceSizeOfFlowerGroupingDefault = 1000000
-    def __init__(self, phaseNode, constantsNode, cactusDiskDatabaseString, flowerNames, overlarge=False):
-        CactusTarget.__init__(self, phaseNode=phaseNode, constantsNode=constantsNode, overlarge=overlarge)
+    def __init__(self, phaseNode, constantsNode, cactusDiskDatabaseString, flowerNames, overlarge=False, predictedResources=None):
+        CactusTarget.__init__(self, phaseNode=phaseNode, constantsNode=constantsNode, overlarge=overlarge, 
+                              predictedResources=predictedResources)
         self.cactusDiskDatabaseString = cactusDiskDatabaseString
         self.flowerNames = flowerNames  
         
@@ -206,12 +363,20 @@ class CactusRecursionTarget(CactusTarget):
             overlargeTarget = target
         if phaseNode == None:
             phaseNode = self.phaseNode
+        if runFlowerStats: #Get the stats of all the overlarge flowers with one call
+            overlargeFlowerNames = [ decodeFirstFlowerName(flowerNames) for overlarge, flowerNames in flowersAndSizes if overlarge ]
+            startTime = time.time()
+            flowerStatsStrings = dict(zip(overlargeFlowerNames, runCactusFlowerStatsBatch(cactusDiskDatabaseString=self.cactusDiskDatabaseString, 
+                                                                                          flowerNames=overlargeFlowerNames)))
+            if len(overlargeFlowerNames) > 0:
+                self.logToMaster("Got the stats of %i oversize flowers for target class %s with 1 database connection in %s seconds" \
+                                 % (len(overlargeFlowerNames), overlargeTarget, time.time() - startTime))
+        predictedResources = self.predictWrapperResources(flowersAndSizes, target)
         for overlarge, flowerNames in flowersAndSizes:
             if overlarge: #Make sure large flowers are on there own, in their own job
                 if runFlowerStats:
-                    flowerStatsString = runCactusFlowerStats(cactusDiskDatabaseString=self.cactusDiskDatabaseString, flowerName=decodeFirstFlowerName(flowerNames))
                     self.logToMaster("Adding an oversize flower for target class %s and stats %s" \
-                                             % (overlargeTarget, flowerStatsString))
+                                             % (overlargeTarget, flowerStatsStrings[decodeFirstFlowerName(flowerNames)]))
                 else:
                     self.logToMaster("Adding an oversize flower %s for target class %s" \
                                              % (decodeFirstFlowerName(flowerNames), overlargeTarget))
@@ -220,7 +385,34 @@ class CactusRecursionTarget(CactusTarget):
                                                     flowerNames=flowerNames, overlarge=True)) #This ensures overlarge flowers, 
             else:
                 self.addChildTarget(target(cactusDiskDatabaseString=self.cactusDiskDatabaseString, 
-                                           phaseNode=phaseNode, constantsNode=self.constantsNode, flowerNames=flowerNames, overlarge=False))
+                                           phaseNode=phaseNode, constantsNode=self.constantsNode, flowerNames=flowerNames, overlarge=False,
+                                           predictedResources=predictedResources.get(flowerNames)))
+    
+    def predictWrapperResources(self, flowersAndSizes, target):
+        """Returns a map of the encoded flower names of each group of flowers that is not overlarge to the 
+        (memory, cpu) the resource model in the constants predicts the target class needs for them. The map 
+        is empty if there is no model, or it has no entry for the class.
+        """
+        modelFile = getOptionalParameter(self.constantsNode, "resourceModel", default="")
+        if modelFile == "" or target.__name__ not in getWrapperResourceModel(modelFile):
+            return {}
+        #The sizes of the groups are given with their names by cactus_workflow_getFlowers and cactus_workflow_extendFlowers
+        groupBases = dict([ (flowerNames, getFlowerNamesSize(flowerNames)) for overlarge, flowerNames in flowersAndSizes if not overlarge ])
+        if len(groupBases) == 0:
+            return {}
+        #Get the stats of the flowers of any groups without sizes with one call
+        unsizedFlowerNames = [ flowerName for flowerNames, bases in groupBases.items() if bases == None 
+                               for flowerName in decodeFlowerNames(flowerNames) ]
+        flowerBases = dict(zip(unsizedFlowerNames, [ parseFlowerStats(flowerStats)["total bases"] for flowerStats in 
+                                                     runCactusFlowerStatsBatch(cactusDiskDatabaseString=self.cactusDiskDatabaseString, 
+                                                                               flowerNames=unsizedFlowerNames) ]))
+        for flowerNames, bases in groupBases.items():
+            if bases == None:
+                groupBases[flowerNames] = sum([ flowerBases[flowerName] for flowerName in decodeFlowerNames(flowerNames) ])
+        model = getWrapperResourceModel(modelFile)
+        safetyMargin = getOptionalParameter(self.constantsNode, "resourceModelSafetyMargin", float, 1.5)
+        return dict([ (flowerNames, predictWrapperResources(model, target.__name__, bases, safetyMargin=safetyMargin)) 
+                      for flowerNames, bases in groupBases.items() ])
         
     def makeRecursiveTargets(self, target=None, phaseNode=None, runFlowerStats=False):
         """Make a set of child targets for a given set of parent flowers.
@@ -228,12 +420,25 @@ class CactusRecursionTarget(CactusTarget):
         if target == None:
             target = self.__class__
         targetNode = getTargetNode(self.phaseNode, target)
-        flowersAndSizes=runCactusGetFlowers(cactusDiskDatabaseString=self.cactusDiskDatabaseString, flowerNames=self.flowerNames, 
-                                            minSequenceSizeOfFlower=getOptionalAttrib(targetNode, "minFlowerSize", int, 0), 
-                                            maxSequenceSizeOfFlowerGrouping=getOptionalAttrib(targetNode, "maxFlowerGroupSize", int, 
-                                            default=CactusRecursionTarget.maxSequenceSizeOfFlowerGroupingDefault),
-                                            maxSequenceSizeOfSecondaryFlowerGrouping=getOptionalAttrib(targetNode, "maxFlowerWrapperGroupSize", int, 
-                                            default=CactusRecursionTarget.maxSequenceSizeOfFlowerGroupingDefault))
+        minSequenceSizeOfFlower = getOptionalParameter(targetNode, "minFlowerSize", int, 0)
+        maxSequenceSizeOfFlowerGrouping = getOptionalParameter(targetNode, "maxFlowerGroupSize", int, 
+                                                               default=CactusRecursionTarget.maxSequenceSizeOfFlowerGroupingDefault)
+        maxSequenceSizeOfSecondaryFlowerGrouping = getOptionalParameter(targetNode, "maxFlowerWrapperGroupSize", int, 
+                                                                        default=CactusRecursionTarget.maxSequenceSizeOfFlowerGroupingDefault)
+        flowerTreeIndex = self.getOptionalPhaseAttrib("flowerTreeIndex")
+        if flowerTreeIndex != None and os.path.exists(flowerTreeIndex): #Get the flowers without querying the database
+            startTime = time.time()
+            flowersAndSizes=getFlowerTreeIndex(flowerTreeIndex).getFlowers(flowerNames=self.flowerNames, 
+                                                                          minSequenceSizeOfFlower=minSequenceSizeOfFlower, 
+                                                                          maxSequenceSizeOfFlowerGrouping=maxSequenceSizeOfFlowerGrouping,
+                                                                          maxSequenceSizeOfSecondaryFlowerGrouping=maxSequenceSizeOfSecondaryFlowerGrouping)
+            logger.info("Got flowers from the flower tree index in %s seconds" % (time.time() - startTime))
+        else:
+            flowersAndSizes=runCactusGetFlowers(cactusDiskDatabaseString=self.cactusDiskDatabaseString, flowerNames=self.flowerNames, 
+                                                minSequenceSizeOfFlower=minSequenceSizeOfFlower, 
+                                                maxSequenceSizeOfFlowerGrouping=maxSequenceSizeOfFlowerGrouping,
+                                                maxSequenceSizeOfSecondaryFlowerGrouping=maxSequenceSizeOfSecondaryFlowerGrouping,
+                                                flowerServiceIdleTimeout=getOptionalParameter(self.constantsNode, "flowerServiceIdleTimeout", int, 0))
         self.makeChildTargets(flowersAndSizes=flowersAndSizes, 
                               target=target, phaseNode=phaseNode,
                               runFlowerStats=runFlowerStats)
@@ -243,14 +448,70 @@ class CactusRecursionTarget(CactusTarget):
         """
         targetNode = getTargetNode(self.phaseNode, target)
         flowersAndSizes=runCactusExtendFlowers(cactusDiskDatabaseString=self.cactusDiskDatabaseString, flowerNames=self.flowerNames, 
-                                              minSequenceSizeOfFlower=getOptionalAttrib(targetNode, "minFlowerSize", int, 1), 
-                                              maxSequenceSizeOfFlowerGrouping=getOptionalAttrib(targetNode, "maxFlowerGroupSize", int, 
+                                              minSequenceSizeOfFlower=getOptionalParameter(targetNode, "minFlowerSize", int, 1), 
+                                              maxSequenceSizeOfFlowerGrouping=getOptionalParameter(targetNode, "maxFlowerGroupSize", int, 
                                               default=CactusRecursionTarget.maxSequenceSizeOfFlowerGroupingDefault))
         self.makeChildTargets(flowersAndSizes=flowersAndSizes, 
                               target=target, overlargeTarget=overlargeTarget, 
                               phaseNode=phaseNode,
                               runFlowerStats=runFlowerStats)
     
+    def runWrapperProgram(self, fn):
+        """Runs fn(), which runs a cactus program on the target's flowers, returning its value. 
+        
+        If the target was given memory and cpu predicted by the resource model (see makeChildTargets) 
+        and this is a retry, perhaps because the prediction was too small, the program is instead run 
+        by a copy of the target with the static memory and cpu of its class, and an empty list is returned.
+        
+        If recordResourceUsage or stragglerRuntimeMultiple is set in the constants, the runtime, peak 
+        memory and cpu time of the program are recorded next to the experiment file (see 
+        getWrapperResourceUsageFile), for cactus_fitResourceModel.py.
+        
+        If stragglerRuntimeMultiple is set, the runtime of the target is predicted from the number of 
+        bases in its flowers and the runtimes of the completed targets of the same class. If it takes more 
+        than the multiple of this it is given up on and the target fails, so that jobTree runs it again, 
+        usually on another node. A target given up on never writes to the database, see 
+        runWithCommitDeadline. The rerun has no time limit.
+        """
+        if self.predictedResources:
+            attemptedFile = os.path.join(self.getGlobalTempDir(), "attempted")
+            if os.path.exists(attemptedFile):
+                self.logToMaster("Rerunning the %s target for the flowers %s with the static memory and cpu of its class" % \
+                                 (self.__class__.__name__, self.flowerNames))
+                self.addChildTarget(self.__class__(phaseNode=self.phaseNode, constantsNode=self.constantsNode, 
+                                                   cactusDiskDatabaseString=self.cactusDiskDatabaseString, 
+                                                   flowerNames=self.flowerNames, overlarge=self.overlarge))
+                return []
+            open(attemptedFile, "w").close()
+        runtimeMultiple = getOptionalParameter(self.constantsNode, "stragglerRuntimeMultiple", float, 0.0)
+        resourceUsageFile = getOptionalParameter(self.constantsNode, "resourceUsageFile") #Set by CactusWorkflowArguments
+        if resourceUsageFile == None or \
+                (runtimeMultiple <= 0.0 and not getOptionalParameter(self.constantsNode, "recordResourceUsage", bool, False)):
+            return fn()
+        bases = getFlowerNamesSize(self.flowerNames)
+        if bases == None:
+            bases = sum([ parseFlowerStats(flowerStats)["total bases"] for flowerStats in 
+                          runCactusFlowerStatsBatch(self.cactusDiskDatabaseString, decodeFlowerNames(self.flowerNames)) ])
+        predictedRuntime = None
+        if runtimeMultiple > 0.0:
+            predictedRuntime = predictWrapperRuntime(readWrapperRuntimes(resourceUsageFile, self.__class__.__name__), bases)
+        givenUpOnFile = os.path.join(self.getGlobalTempDir(), "givenUpOn")
+        timeLimit = None
+        if predictedRuntime != None and not os.path.exists(givenUpOnFile):
+            timeLimit = max(runtimeMultiple * predictedRuntime, 
+                            getOptionalParameter(self.constantsNode, "stragglerMinimumRuntime", int, 600))
+        #The program is run in a child process even without a time limit, so that its own peak memory 
+        #and cpu time can be measured, rather than those of everything the worker has run
+        startTime = time.time()
+        finished, result, usage = runWithCommitDeadline(fn, timeLimit, os.path.join(self.getLocalTempDir(), "commitToken"))
+        if not finished:
+            open(givenUpOnFile, "w").close()
+            raise RuntimeError("Gave up on the %s target for the flowers %s after %s seconds, its predicted runtime was %s seconds" % \
+                               (self.__class__.__name__, self.flowerNames, timeLimit, predictedRuntime))
+        appendWrapperResourceUsage(resourceUsageFile, self.__class__.__name__, bases, runtime=time.time() - startTime, 
+                                   memory=usage.ru_maxrss*1024, clock=usage.ru_utime + usage.ru_stime)
+        return result
+    
     def makeWrapperTargets(self, target, overlargeTarget=None, phaseNode=None, runFlowerStats=False):
         """Takes the list of flowers for a recursive target and splits them up to fit the given wrapper target(s).
         """
@@ -310,6 +571,9 @@ class CactusTrimmingBlastPhase(CactusPhasesTarget):
     """Blast ingroups vs outgroups using the trimming strategy before
     running cactus setup.
     """
+    def usesPrimaryDatabase(self):
+        return False
+    
     def run(self):
         # Not worth doing extra work if there aren't any outgroups
         assert self.cactusWorkflowArguments.outgroupEventNames is not None
@@ -337,17 +601,18 @@ class CactusTrimmingBlastPhase(CactusPhasesTarget):
         setupFilteringByIdentity(self.cactusWorkflowArguments)
 
         alignmentsFile = getTempFile("unconvertedAlignments", rootDir=self.getGlobalTempDir())
-        findRequiredNode(self.cactusWorkflowArguments.configNode, "caf").attrib["alignments"] = alignmentsFile
+        cafNode = findRequiredNode(self.cactusWorkflowArguments.configNode, "caf")
+        cafNode.attrib["alignments"] = alignmentsFile
         # FIXME: this is really ugly and steals the options from the caf tag
         self.addChildTarget(BlastIngroupsAndOutgroups(
-                                          BlastOptions(chunkSize=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "chunkSize", int),
-                                                        overlapSize=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "overlapSize", int),
-                                                        lastzArguments=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "lastzArguments"),
-                                                        compressFiles=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "compressFiles", bool),
-                                                        realign=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "realign", bool), 
-                                                        realignArguments=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "realignArguments"),
-                                                        memory=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "lastzMemory", int, sys.maxint),
-                                                        minimumSequenceLength=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "minimumSequenceLengthForBlast", int, 1),
+                                          BlastOptions(chunkSize=getOptionalAttrib(cafNode, "chunkSize", int),
+                                                        overlapSize=getOptionalAttrib(cafNode, "overlapSize", int),
+                                                        lastzArguments=getOptionalAttrib(cafNode, "lastzArguments"),
+                                                        compressFiles=getOptionalAttrib(cafNode, "compressFiles", bool),
+                                                        realign=getOptionalAttrib(cafNode, "realign", bool), 
+                                                        realignArguments=getOptionalAttrib(cafNode, "realignArguments"),
+                                                        memory=getOptionalAttrib(cafNode, "lastzMemory", int, sys.maxint),
+                                                        minimumSequenceLength=getOptionalAttrib(cafNode, "minimumSequenceLengthForBlast", int, 1),
                                                        trimFlanking=self.getOptionalPhaseAttrib("trimFlanking", int, 10),
                                                        trimMinSize=self.getOptionalPhaseAttrib("trimMinSize", int, 0),
                                                        trimThreshold=self.getOptionalPhaseAttrib("trimThreshold", float, 0.8),
@@ -384,9 +649,11 @@ def getLongestPath(node, distance=0.0):
 class CactusSetupPhase(CactusPhasesTarget):  
     """Initialises the cactus database and adapts the config file for the run.
     """
+    def usesPrimaryDatabase(self):
+        #The server of the database is launched for the setup, which creates it
+        return False
+    
     def run(self):
-        cw = ConfigWrapper(self.cactusWorkflowArguments.configNode)
-
         if (not self.cactusWorkflowArguments.configWrapper.getDoTrimStrategy()) or (self.cactusWorkflowArguments.outgroupEventNames == None):
             setupDivergenceArgs(self.cactusWorkflowArguments)
 
@@ -399,11 +666,18 @@ class CactusSetupPhase(CactusPhasesTarget):
         exp = ExperimentWrapper(self.cactusWorkflowArguments.experimentNode)
         if exp.getDbType() == "kyoto_tycoon":
             logger.info("Created ktserver pattern target cactus_setup")
-            memory = cw.getKtserverMemory(default=getOptionalAttrib(
-                    self.constantsNode, "defaultMemory", int, default=sys.maxint))
-            cpu = cw.getKtserverCpu(default=getOptionalAttrib(
-                    self.constantsNode, "defaultCpu", int, default=sys.maxint))
-            addKtserverDependentChild(self, setupTarget, maxMemory=memory, maxCpu=cpu, isSecondary = False)
+            tuning = setKtTuningOptionsForWorkload(exp, exp.getSequences())
+            if tuning is not None:
+                self.logToMaster("Set the tuning options of the ktserver to %s from the input sequences" % tuning)
+            secondaryElem = DbElemWrapper(ET.fromstring(self.cactusWorkflowArguments.secondaryDatabaseString))
+            if secondaryElem.getDbType() == "kyoto_tycoon" and secondaryElem.getDbInMemory():
+                tuning = setKtTuningOptionsForWorkload(secondaryElem, exp.getSequences())
+                if tuning is not None:
+                    self.logToMaster("Set the tuning options of the in memory secondary ktserver to %s from the input sequences" % tuning)
+                    self.cactusWorkflowArguments.secondaryDatabaseString = secondaryElem.getConfString()
+            #Any reused secondary servers are launched by the first phase that uses them, see runPhaseTarget
+            system("rm -rf %s" % exp.getKtserverReuseDir())
+            addPrimaryKtserverDependentChild(self, setupTarget)
         else:
             logger.info("Created follow-on target cactus_setup")
             self.setFollowOnTarget(setupTarget)   
@@ -480,7 +754,7 @@ class CactusCafWrapper(CactusRecursionTarget):
     """Runs cactus_core upon a set of flowers and no alignment file.
     """
     def runCactusCafInWorkflow(self, alignmentFile):
-        messages = runCactusCaf(cactusDiskDatabaseString=self.cactusDiskDatabaseString,
+        messages = self.runWrapperProgram(lambda : runCactusCaf(cactusDiskDatabaseString=self.cactusDiskDatabaseString,
                           alignments=alignmentFile, 
                           flowerNames=self.flowerNames,
                           constraints=self.getOptionalPhaseAttrib("constraints"),  
@@ -501,7 +775,7 @@ class CactusCafWrapper(CactusRecursionTarget):
                           proportionOfUnalignedBasesForNewChromosome=self.getOptionalPhaseAttrib("proportionOfUnalignedBasesForNewChromosome", float),
                           maximumMedianSequenceLengthBetweenLinkedEnds=self.getOptionalPhaseAttrib("maximumMedianSequenceLengthBetweenLinkedEnds", int),
                           realign=self.getOptionalPhaseAttrib("realign", bool),
-                          realignArguments=self.getOptionalPhaseAttrib("realignArguments"))
+                          realignArguments=self.getOptionalPhaseAttrib("realignArguments")))
         for message in messages:
             self.logToMaster(message)
     
@@ -528,8 +802,7 @@ class CactusCafWrapperLarge(CactusRecursionTarget):
                                                         memory=self.getOptionalPhaseAttrib("lastzMemory", int, sys.maxint),
                                                         minimumSequenceLength=self.getOptionalPhaseAttrib("minimumSequenceLengthForBlast", int, 1))))
         #Now setup a call to cactus core wrapper as a follow on
-        self.phaseNode.attrib["alignments"] = alignmentFile
-        self.makeFollowOnRecursiveTarget(CactusCafWrapperLarge2)
+        self.makeFollowOnRecursiveTarget(CactusCafWrapperLarge2, phaseNode=self.phaseNode.withAttrib("alignments", alignmentFile))
         
 class CactusCafWrapperLarge2(CactusCafWrapper):
     """Runs cactus_core upon a one flower and one alignment file.
@@ -586,67 +859,108 @@ class CactusBarWrapper(CactusRecursionTarget):
     """Runs the BAR algorithm implementation.
     """
     def run(self):
-        messages = runBarForTarget(self)
+        messages = self.runWrapperProgram(lambda : runBarForTarget(self))
         for message in messages:
             self.logToMaster(message)       
         
+def estimateEndAlignmentCost(sequencesInEndAlignment, basesInEndAlignment):
+    """Estimates the relative cost of an end alignment. Each cap is aligned to a few 
+    others with a quadratic cost, so the cost is the number of caps times the square 
+    of their mean length.
+    """
+    return float(basesInEndAlignment) * basesInEndAlignment / max(1, sequencesInEndAlignment)
+
+def packEndsIntoGroups(endsAndCosts, groupNumber, endBases=None, maxGroupBases=sys.maxint):
+    """Packs the given (end, cost) pairs into groupNumber groups of similar total cost, taking the 
+    ends in order of decreasing cost and adding each to the group with the least total cost so far. 
+    If the bases of the ends are given (as a map of the ends to their bases) each end is added to the 
+    group with the least total cost whose total bases it keeps within maxGroupBases, opening a new 
+    group if there is none, so that the memory of the job of a group stays bounded. Returns a list of 
+    (total cost, ends) pairs, one per non-empty group.
+    """
+    groups = [ (0.0, i, 0, []) for i in xrange(max(1, groupNumber)) ] #The index breaks ties between groups
+    for end, cost in sorted(endsAndCosts, key=lambda x : x[1], reverse=True):
+        bases = endBases[end] if endBases != None else 0
+        fullGroups = []
+        while len(groups) > 0 and len(groups[0][3]) > 0 and groups[0][2] + bases > maxGroupBases:
+            fullGroups.append(heapq.heappop(groups))
+        if len(groups) > 0:
+            totalCost, i, totalBases, ends = heapq.heappop(groups)
+        else:
+            totalCost, i, totalBases, ends = 0.0, len(fullGroups), 0, []
+        ends.append(end)
+        heapq.heappush(groups, (totalCost + cost, i, totalBases + bases, ends))
+        for group in fullGroups:
+            heapq.heappush(groups, group)
+    return [ (totalCost, ends) for totalCost, i, totalBases, ends in sorted(groups, key=lambda x : x[1]) if len(ends) > 0 ]
+
 class CactusBarWrapperLarge(CactusRecursionTarget):
     """Breaks up the bar into a series of smaller bars, then 
     """
     def run(self):
         logger.info("Starting the cactus bar preprocessor target to breakup the bar alignment")
-        precomputedAlignmentFiles = []
         veryLargeEndSize=self.getOptionalPhaseAttrib("veryLargeEndSize", int, default=1000000)
         maxFlowerGroupSize = self.getOptionalTargetAttrib("maxFlowerGroupSize", int, 
                                             default=CactusRecursionTarget.maxSequenceSizeOfFlowerGroupingDefault)
-        endsToAlign = []
+        endsAndCosts = []
+        endBases = {}
         totalSize = 0
         alignmentFileCount = 0
         for line in runBarForTarget(self, calculateWhichEndsToComputeSeparately=True):
             endToAlign, sequencesInEndAlignment, basesInEndAlignment = line.split()
             sequencesInEndAlignment = int(sequencesInEndAlignment)
             basesInEndAlignment = int(basesInEndAlignment)
+            cost = estimateEndAlignmentCost(sequencesInEndAlignment, basesInEndAlignment)
             #If we have a really big end align separately
             if basesInEndAlignment >= veryLargeEndSize:
                 self.addChildTarget(CactusBarEndAlignerWrapper(self.phaseNode, self.constantsNode, self.cactusDiskDatabaseString, self.flowerNames, 
-                                                           True, [ endToAlign ], os.path.join(self.getGlobalTempDir(), "endAlignments.%i" % alignmentFileCount)))
-                self.logToMaster("Precomputing very large end alignment for %s with %i caps and %i bases" % \
-                             (endToAlign, sequencesInEndAlignment, basesInEndAlignment))
+                                                           True, [ endToAlign ], os.path.join(self.getGlobalTempDir(), "endAlignments.%i" % alignmentFileCount), 
+                                                           predictedCost=cost))
+                self.logToMaster("Precomputing very large end alignment for %s with %i caps and %i bases and predicted cost %s" % \
+                             (endToAlign, sequencesInEndAlignment, basesInEndAlignment, cost))
                 alignmentFileCount += 1
             else:
-                endsToAlign.append(endToAlign)
+                endsAndCosts.append((endToAlign, cost))
+                endBases[endToAlign] = basesInEndAlignment
                 totalSize += basesInEndAlignment
-                if totalSize >= maxFlowerGroupSize:
-                    self.addChildTarget(CactusBarEndAlignerWrapper(self.phaseNode, self.constantsNode, self.cactusDiskDatabaseString, self.flowerNames, 
-                                                           False, endsToAlign, os.path.join(self.getGlobalTempDir(), "endAlignments.%i" % alignmentFileCount)))
-                    endsToAlign = []
-                    totalSize = 0
-                    alignmentFileCount += 1
-        if len(endsToAlign) > 0:
+        #Balance the cost of the remaining ends between about as many jobs as there would be if they were cut up by size, 
+        #without letting the bases of a job exceed the group size
+        groups = packEndsIntoGroups(endsAndCosts, int(math.ceil(float(totalSize) / maxFlowerGroupSize)), 
+                                    endBases=endBases, maxGroupBases=maxFlowerGroupSize)
+        for cost, endsToAlign in groups:
             self.addChildTarget(CactusBarEndAlignerWrapper(self.phaseNode, self.constantsNode, self.cactusDiskDatabaseString, self.flowerNames, 
-                                                           False, endsToAlign, os.path.join(self.getGlobalTempDir(), "endAlignments.%i" % alignmentFileCount)))
+                                                           False, endsToAlign, os.path.join(self.getGlobalTempDir(), "endAlignments.%i" % alignmentFileCount), 
+                                                           predictedCost=cost))
             alignmentFileCount += 1
-        self.phaseNode.attrib["precomputedAlignmentFiles"] = " ".join([ os.path.join(self.getGlobalTempDir(), ("endAlignments.%i") % i) for i in range(alignmentFileCount) ]) 
-        self.makeFollowOnRecursiveTarget(CactusBarWrapperWithPrecomputedEndAlignments)
+        if len(groups) > 0:
+            self.logToMaster("Packed %i ends into %i groups with predicted costs from %s to %s" % \
+                             (len(endsAndCosts), len(groups), min([ cost for cost, ends in groups ]), max([ cost for cost, ends in groups ])))
+        precomputedAlignmentFiles = " ".join([ os.path.join(self.getGlobalTempDir(), ("endAlignments.%i") % i) for i in range(alignmentFileCount) ]) 
+        self.makeFollowOnRecursiveTarget(CactusBarWrapperWithPrecomputedEndAlignments, 
+                                         phaseNode=self.phaseNode.withAttrib("precomputedAlignmentFiles", precomputedAlignmentFiles))
         self.logToMaster("Breaking bar job into %i separate jobs" % \
                              (alignmentFileCount))
         
 class CactusBarEndAlignerWrapper(CactusRecursionTarget):
     """Computes an end alignment.
     """
-    def __init__(self, phaseNode, constantsNode, cactusDiskDatabaseString, flowerNames, overlarge, endsToAlign, alignmentFile):
+    def __init__(self, phaseNode, constantsNode, cactusDiskDatabaseString, flowerNames, overlarge, endsToAlign, alignmentFile, predictedCost=None):
         CactusRecursionTarget.__init__(self, phaseNode, constantsNode, cactusDiskDatabaseString, flowerNames, overlarge)
         self.endsToAlign = endsToAlign
         self.alignmentFile = alignmentFile
+        self.predictedCost = predictedCost
     
     def run(self):
         self.endsToAlign = [ int(i) for i in self.endsToAlign ]
         self.endsToAlign.sort()
         self.flowerNames = encodeFlowerNames((decodeFirstFlowerName(self.flowerNames),) + tuple(self.endsToAlign)) #The ends to align become like extra flower names
+        startTime = time.time()
         messages = runBarForTarget(self, 
                                    endAlignmentsToPrecomputeOutputFile=self.alignmentFile)
         for message in messages:
             self.logToMaster(message)
+        #To compare with the estimated cost, for tuning estimateEndAlignmentCost
+        self.logToMaster("Aligned %i ends with predicted cost %s in %s seconds" % (len(self.endsToAlign), self.predictedCost, time.time() - startTime))
         
 class CactusBarWrapperWithPrecomputedEndAlignments(CactusRecursionTarget):
     """Runs the BAR algorithm implementation with some precomputed end alignments.
@@ -677,7 +991,21 @@ class CactusNormalPhase(CactusPhasesTarget):
             self.phaseNode.attrib["iterations"] = str(normalisationIterations-1)
             self.runPhase(CactusNormalRecursion, CactusNormalPhase, "normal")
         else:
+            if self.getOptionalPhaseAttrib("buildFlowerTreeIndex", bool, False):
+                self.makeFlowerTreeIndex()
             self.makeFollowOnPhaseTarget(CactusAVGPhase, "avg")
+    
+    def makeFlowerTreeIndex(self):
+        """Records the cactus tree, which is not changed after normalisation, in an index from 
+        which the recursion targets of the later phases get their child flowers.
+        """
+        indexFile = os.path.join(self.getGlobalTempDir(), "flowerTree.index")
+        startTime = time.time()
+        flowerNumber = runCactusFlowerTree(self.cactusWorkflowArguments.cactusDiskDatabaseString, indexFile)
+        self.logToMaster("Wrote an index of the %i flowers of the cactus tree in %s seconds" % (flowerNumber, time.time() - startTime))
+        for phaseName in ("avg", "reference", "check", "hal"):
+            for phaseNode in self.cactusWorkflowArguments.configNode.findall(phaseName):
+                phaseNode.attrib["flowerTreeIndex"] = indexFile
      
 class CactusNormalRecursion(CactusRecursionTarget):
     """This target does the down pass for the normal phase.
@@ -696,8 +1024,8 @@ class CactusNormalWrapper(CactusRecursionTarget):
     """This targets run the normalisation script.
     """ 
     def run(self):
-        runCactusMakeNormal(self.cactusDiskDatabaseString, flowerNames=self.flowerNames, 
-                            maxNumberOfChains=self.getOptionalPhaseAttrib("maxNumberOfChains", int, default=30))
+        self.runWrapperProgram(lambda : runCactusMakeNormal(self.cactusDiskDatabaseString, flowerNames=self.flowerNames, 
+                            maxNumberOfChains=self.getOptionalPhaseAttrib("maxNumberOfChains", int, default=30)))
 
 ############################################################
 ############################################################
@@ -730,7 +1058,7 @@ class CactusAVGWrapper(CactusRecursionTarget):
     """This target runs tree building
     """
     def run(self):
-        runCactusPhylogeny(self.cactusDiskDatabaseString, flowerNames=self.flowerNames)
+        self.runWrapperProgram(lambda : runCactusPhylogeny(self.cactusDiskDatabaseString, flowerNames=self.flowerNames))
 
 ############################################################
 ############################################################
@@ -741,6 +1069,9 @@ class CactusAVGWrapper(CactusRecursionTarget):
 ############################################################
     
 class CactusReferencePhase(CactusPhasesTarget):     
+    def usesSecondaryDatabase(self):
+        return self.getOptionalPhaseAttrib("buildReference", bool, False)
+    
     def run(self):
         """Runs the reference problem algorithm
         """
@@ -762,7 +1093,7 @@ class CactusReferenceWrapper(CactusRecursionTarget):
     """Actually run the reference code.
     """
     def run(self):
-        runCactusReference(cactusDiskDatabaseString=self.cactusDiskDatabaseString, 
+        self.runWrapperProgram(lambda : runCactusReference(cactusDiskDatabaseString=self.cactusDiskDatabaseString, 
                        flowerNames=self.flowerNames, 
                        matchingAlgorithm=self.getOptionalPhaseAttrib("matchingAlgorithm"), 
                        permutations=self.getOptionalPhaseAttrib("permutations", int),
@@ -774,7 +1105,7 @@ class CactusReferenceWrapper(CactusRecursionTarget):
                        wiggle=self.getOptionalPhaseAttrib("wiggle", float),
                        numberOfNs=self.getOptionalPhaseAttrib("numberOfNs", int),
                        minNumberOfSequencesToSupportAdjacency=self.getOptionalPhaseAttrib("minNumberOfSequencesToSupportAdjacency", int),
-                       makeScaffolds=self.getOptionalPhaseAttrib("makeScaffolds", bool))
+                       makeScaffolds=self.getOptionalPhaseAttrib("makeScaffolds", bool)))
 
 class CactusReferenceRecursion2(CactusRecursionTarget):
     def run(self):
@@ -791,12 +1122,12 @@ class CactusSetReferenceCoordinatesUpWrapper(CactusRecursionTarget):
     """Does the up pass for filling in the reference sequence coordinates, once a reference has been established.
     """ 
     def run(self):
-        runCactusAddReferenceCoordinates(cactusDiskDatabaseString=self.cactusDiskDatabaseString, 
+        self.runWrapperProgram(lambda : runCactusAddReferenceCoordinates(cactusDiskDatabaseString=self.cactusDiskDatabaseString, 
                                          secondaryDatabaseString=self.getOptionalPhaseAttrib("secondaryDatabaseString"),
                                          flowerNames=self.flowerNames,
                                          referenceEventString=self.getOptionalPhaseAttrib("reference"), 
                                          outgroupEventString=self.getOptionalPhaseAttrib("outgroup"), 
-                                         bottomUpPhase=True)
+                                         bottomUpPhase=True))
         
 class CactusSetReferenceCoordinatesDownPhase(CactusPhasesTarget):
     """This is the second part of the reference coordinate setting, the down pass.
@@ -820,11 +1151,11 @@ class CactusSetReferenceCoordinatesDownWrapper(CactusRecursionTarget):
     """Does the down pass for filling Fills in the coordinates, once a reference is added.
     """        
     def run(self):
-        runCactusAddReferenceCoordinates(cactusDiskDatabaseString=self.cactusDiskDatabaseString, 
+        self.runWrapperProgram(lambda : runCactusAddReferenceCoordinates(cactusDiskDatabaseString=self.cactusDiskDatabaseString, 
                                          flowerNames=self.flowerNames,
                                          referenceEventString=self.getOptionalPhaseAttrib("reference"),
                                          outgroupEventString=self.getOptionalPhaseAttrib("outgroup"), 
-                                         bottomUpPhase=False)
+                                         bottomUpPhase=False))
 
 class CactusExtractReferencePhase(CactusPhasesTarget):
     def run(self):
@@ -869,7 +1200,8 @@ class CactusCheckWrapper(CactusRecursionTarget):
     """Runs the actual check wrapper
     """
     def run(self):
-        runCactusCheck(self.cactusDiskDatabaseString, self.flowerNames, checkNormalised=self.getOptionalPhaseAttrib("checkNormalised", bool, False))
+        self.runWrapperProgram(lambda : runCactusCheck(self.cactusDiskDatabaseString, self.flowerNames, 
+                                                      checkNormalised=self.getOptionalPhaseAttrib("checkNormalised", bool, False)))
 
 ############################################################
 ############################################################
@@ -880,6 +1212,9 @@ class CactusCheckWrapper(CactusRecursionTarget):
 ############################################################
 
 class CactusHalGeneratorPhase(CactusPhasesTarget):
+    def usesSecondaryDatabase(self):
+        return self.getOptionalPhaseAttrib("buildHal", bool, default=False)
+    
     def run(self):
         referenceNode = findRequiredNode(self.cactusWorkflowArguments.configNode, "reference")
         if referenceNode.attrib.has_key("reference"):
@@ -903,6 +1238,9 @@ class CactusFastaGenerator(CactusRecursionTarget):
                                     referenceEventString=self.getOptionalPhaseAttrib("reference"))
             
 class CactusHalGeneratorPhase2(CactusHalGeneratorPhase):
+    def usesSecondaryDatabase(self):
+        return False
+    
     def run(self): 
         self.cleanupSecondaryDatabase()
 
@@ -910,10 +1248,7 @@ class CactusHalGeneratorRecursion(CactusRecursionTarget):
     """Generate the hal file by merging indexed hal files from the children.
     """ 
     def run(self):
-        i = extractNode(self.phaseNode)
-        if "outputFile" in i.attrib:
-            i.attrib.pop("outputFile")
-        self.makeRecursiveTargets(phaseNode=i)
+        self.makeRecursiveTargets(phaseNode=self.phaseNode.withAttrib("outputFile", None))
         self.makeFollowOnRecursiveTarget(CactusHalGeneratorUpWrapper)
 
 class CactusHalGeneratorUpWrapper(CactusRecursionTarget):
@@ -934,6 +1269,279 @@ class CactusHalGeneratorPhaseCleanup(CactusPhasesTarget):
     def run(self):
         self.cleanupSecondaryDatabase()
 
+############################################################
+############################################################
+############################################################
+#Phase checkpoints
+#
+#Once a phase has completed a manifest is written to the 
+#phase checkpoint dir of the database, so that a run can be 
+#restarted with a fresh jobTree from the next phase.
+#
+#The ktserver of a kyoto tycoon database only writes the 
+#database when it is shut down, so it is restarted at each 
+#checkpoint, and what it wrote is kept with the manifest.
+############################################################
+############################################################
+############################################################
+
+def getFilesSnapshotId(path):
+    """Returns an id for the contents of a file or directory, made from the names, sizes and
+    modification times of its files. A path that does not exist has the id of an empty directory.
+    """
+    if os.path.isfile(path):
+        filePaths = [ path ]
+    else:
+        filePaths = [ os.path.join(dirPath, fileName) for dirPath, dirNames, fileNames in os.walk(path) for fileName in fileNames ]
+    files = []
+    for filePath in filePaths:
+        stat = os.stat(filePath)
+        files.append((os.path.relpath(filePath, path), stat.st_size, int(stat.st_mtime)))
+    return hashlib.md5(repr(sorted(files))).hexdigest()
+
+def getWorkflowConfigHash(configNode, experimentNode):
+    """Hashes the config, the experiment and the input sequence files, which determine the 
+    output of a run.
+    """
+    md5 = hashlib.md5()
+    md5.update(ET.tostring(configNode))
+    md5.update(ET.tostring(experimentNode))
+    for sequenceFile in ExperimentWrapper(experimentNode).getSequences():
+        md5.update(getFilesSnapshotId(sequenceFile))
+    return md5.hexdigest()
+
+def getPhaseInputFiles(cactusWorkflowArguments, phaseName):
+    """Returns the files other than the database that the phases from the given one on read.
+    """
+    inputFiles = []
+    if phaseName in ("trimBlast", "setup"):
+        inputFiles += ExperimentWrapper(cactusWorkflowArguments.experimentNode).getSequences()
+    if phaseName in ("trimBlast", "setup", "caf"):
+        if cactusWorkflowArguments.constraintsFile != None:
+            inputFiles.append(cactusWorkflowArguments.constraintsFile)
+        for cafNode in cactusWorkflowArguments.configNode.findall("caf"):
+            for attribName in ("alignments", "constraints"):
+                if getOptionalAttrib(cafNode, attribName, default="") != "":
+                    inputFiles.append(cafNode.attrib[attribName])
+    return inputFiles
+
+def readPhaseCheckpoints(checkpointDir):
+    """Returns the manifests in the checkpoint dir, in the order they were written.
+    """
+    manifests = []
+    if os.path.isdir(checkpointDir):
+        for fileName in sorted(os.listdir(checkpointDir)):
+            if fileName.endswith(".json"):
+                fileHandle = open(os.path.join(checkpointDir, fileName), "r")
+                manifests.append(json.load(fileHandle))
+                fileHandle.close()
+    return manifests
+
+def writePhaseCheckpoint(checkpointDir, manifest):
+    """Writes a manifest after those already in the checkpoint dir and returns its path. The
+    manifest is written to a temporary file which is then renamed, so it is complete or absent.
+    """
+    if not os.path.isdir(checkpointDir):
+        os.makedirs(checkpointDir)
+    manifestFile = os.path.join(checkpointDir, "%05i.%s.json" % (len(readPhaseCheckpoints(checkpointDir)), 
+                                                                 manifest["completedPhase"]))
+    fileHandle = open(manifestFile + ".tmp", "w")
+    json.dump(manifest, fileHandle, indent=1)
+    fileHandle.close()
+    os.rename(manifestFile + ".tmp", manifestFile)
+    return manifestFile
+
+def clearPhaseCheckpoints(checkpointDir):
+    if os.path.isdir(checkpointDir):
+        shutil.rmtree(checkpointDir)
+
+def keepPhaseCheckpointDatabase(checkpointDir, databaseDir):
+    """Replaces the copy of the database kept in the checkpoint dir with a copy of the database 
+    as it is now, so that a run that dies in the next phase can be resumed.
+    """
+    copyDir = os.path.join(checkpointDir, "database")
+    if os.path.exists(copyDir + ".tmp"):
+        shutil.rmtree(copyDir + ".tmp")
+    if os.path.isdir(databaseDir):
+        shutil.copytree(databaseDir, copyDir + ".tmp") #Keeps the modification times, so the ids match
+    if os.path.exists(copyDir):
+        shutil.rmtree(copyDir)
+    if os.path.exists(copyDir + ".tmp"):
+        os.rename(copyDir + ".tmp", copyDir)
+
+def keepPhaseCheckpointKtserverFiles(checkpointDir, databaseDir, shutdownStats, link):
+    """Replaces the copy of the database kept in the checkpoint dir with the files a ktserver wrote to the 
+    database dir when it was shut down, as listed in the statistics of its shutdown (see killKtServerSet). 
+    If link is True the files are hard linked rather than copied, which is only safe for snapshots, as the 
+    server writes a new snapshot to a temporary file that replaces the old one, rather than writing to it.
+    """
+    if not isinstance(shutdownStats, list):
+        shutdownStats = [ shutdownStats ]
+    copyDir = os.path.join(checkpointDir, "database")
+    if os.path.exists(copyDir + ".tmp"):
+        shutil.rmtree(copyDir + ".tmp")
+    os.makedirs(copyDir + ".tmp")
+    for filePath in sorted(sum([ stats["files"].keys() for stats in shutdownStats ], [])):
+        copyPath = os.path.join(copyDir + ".tmp", os.path.relpath(filePath, databaseDir))
+        if not os.path.isdir(os.path.dirname(copyPath)):
+            os.makedirs(os.path.dirname(copyPath))
+        if link:
+            os.link(filePath, copyPath)
+        else:
+            shutil.copy2(filePath, copyPath) #Keeps the modification time, so the ids match
+    if os.path.exists(copyDir):
+        shutil.rmtree(copyDir)
+    os.rename(copyDir + ".tmp", copyDir)
+
+def isKtserverRestartedAtPhaseCheckpoints(dbElem, checkpointDatabase):
+    """Whether the ktserver of the database is restarted at each phase checkpoint, so that what it writes 
+    can be kept to resume from. The snapshots of a database with snapshots are always kept, as they are 
+    linked, but a database file must be copied, so is only kept if checkpointDatabase is set. An in memory 
+    database without snapshots is never written, so is never kept.
+    """
+    return dbElem.getDbSnapshot() or (not dbElem.getDbInMemory() and checkpointDatabase)
+
+def getResumablePhaseCheckpoint(checkpointDir, configHash, databaseDir):
+    """Returns the last manifest in the checkpoint dir if the run can be resumed from it, else None. 
+    It can be if it was written by a run with the same config hash, the files the next phase reads are 
+    unchanged and either the database or the copy of it kept in the checkpoint dir is as it was when the 
+    manifest was written. A kyoto tycoon database is only compared with the copy, as the files of its 
+    server need not reflect what has been written, and is not compared at all (so the run is not resumed) 
+    if no copy was kept, which the manifest records as a database snapshot of None.
+    """
+    manifests = readPhaseCheckpoints(checkpointDir)
+    if len(manifests) == 0:
+        return None
+    manifest = manifests[-1]
+    if manifest["configHash"] != configHash:
+        logger.info("The phase checkpoints in %s were written with a different config" % checkpointDir)
+        return None
+    if manifest["databaseSnapshot"] == None:
+        logger.info("The database was not kept when the %s phase completed" % manifest["completedPhase"])
+        return None
+    for inputFile, snapshotId in manifest["inputFiles"]:
+        if not os.path.exists(inputFile) or getFilesSnapshotId(inputFile) != snapshotId:
+            logger.info("The input file %s of the %s phase has changed" % (inputFile, manifest["nextPhase"]))
+            return None
+    if manifest["databaseSnapshot"] not in (getFilesSnapshotId(databaseDir), 
+                                            getFilesSnapshotId(os.path.join(checkpointDir, "database"))):
+        logger.info("The database has changed since the %s phase completed, and no copy was kept" % manifest["completedPhase"])
+        return None
+    return manifest
+
+def restorePhaseCheckpointDatabase(checkpointDir, manifest, databaseDir):
+    """Replaces the database with the copy kept in the checkpoint dir, if it has changed since 
+    the manifest was written.
+    """
+    if getFilesSnapshotId(databaseDir) != manifest["databaseSnapshot"]:
+        logger.info("Restoring the database %s as it was when the %s phase completed" % (databaseDir, manifest["completedPhase"]))
+        if os.path.exists(databaseDir):
+            shutil.rmtree(databaseDir)
+        copyDir = os.path.join(checkpointDir, "database")
+        if os.path.isdir(copyDir):
+            shutil.copytree(copyDir, databaseDir)
+        assert getFilesSnapshotId(databaseDir) == manifest["databaseSnapshot"]
+
+class CactusPhaseCheckpoint(Target):
+    """Runs once a phase and all its children have completed. Writes a manifest recording the 
+    completion, from which the run can be resumed, then runs the next phase.
+    """
+    def __init__(self, cactusWorkflowArguments, completedPhase, nextPhaseTarget, nextPhaseName, topFlowerName=0, index=0):
+        Target.__init__(self)
+        self.cactusWorkflowArguments = cactusWorkflowArguments
+        self.completedPhase = completedPhase
+        self.nextPhaseTarget = nextPhaseTarget
+        self.nextPhaseName = nextPhaseName
+        self.topFlowerName = topFlowerName
+        self.index = index
+        
+    def run(self):
+        exp = ExperimentWrapper(self.cactusWorkflowArguments.experimentNode)
+        checkpointDir = exp.getPhaseCheckpointDir()
+        checkpointDatabase = getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "constants"), 
+                                               "checkpointDatabase", bool, False)
+        if exp.getDbType() != "kyoto_tycoon":
+            if checkpointDatabase:
+                keepPhaseCheckpointDatabase(checkpointDir, exp.getDbDir())
+            databaseSnapshot = getFilesSnapshotId(exp.getDbDir())
+        elif isKtserverRestartedAtPhaseCheckpoints(exp, checkpointDatabase):
+            shutdownStats = []
+            if self.cactusWorkflowArguments.ktserverKillSwitchPath != None:
+                #The server writes the database when it is killed, runPhaseTarget launches it again on what it wrote
+                shutdownStats = killKtServerSet(exp, self.cactusWorkflowArguments.ktserverKillSwitchPath, waitForExit=False)
+                logShutdownStats(self, shutdownStats)
+                self.cactusWorkflowArguments.ktserverKillSwitchPath = None
+            keepPhaseCheckpointKtserverFiles(checkpointDir, exp.getDbDir(), shutdownStats, link=exp.getDbSnapshot())
+            databaseSnapshot = getFilesSnapshotId(os.path.join(checkpointDir, "database"))
+        else:
+            databaseSnapshot = None
+        manifest = { "completedPhase":self.completedPhase, "nextPhase":self.nextPhaseTarget.__name__, 
+                     "nextPhaseName":self.nextPhaseName, "topFlowerName":self.topFlowerName, "index":self.index,
+                     "configHash":self.cactusWorkflowArguments.configHash,
+                     "databaseSnapshot":databaseSnapshot,
+                     "inputFiles":[ (inputFile, getFilesSnapshotId(inputFile)) for inputFile in 
+                                    getPhaseInputFiles(self.cactusWorkflowArguments, self.nextPhaseName) ],
+                     "outputs":[ path for path in (exp.getDbDir(), exp.getReferencePath(), exp.getHALPath(), exp.getHALFastaPath()) 
+                                 if path != None and os.path.exists(path) ],
+                     "config":ET.tostring(self.cactusWorkflowArguments.configNode),
+                     "experiment":ET.tostring(self.cactusWorkflowArguments.experimentNode),
+                     "secondaryDatabaseString":self.cactusWorkflowArguments.secondaryDatabaseString,
+                     "time":time.time() }
+        manifestFile = writePhaseCheckpoint(checkpointDir, manifest)
+        self.logToMaster("The %s phase completed at %s seconds, wrote the checkpoint %s" % (self.completedPhase, time.time(), manifestFile))
+        runPhaseTarget(self, self.cactusWorkflowArguments, 
+                       self.nextPhaseTarget(cactusWorkflowArguments=self.cactusWorkflowArguments, phaseName=self.nextPhaseName,
+                                            topFlowerName=self.topFlowerName, index=self.index))
+
+def runPhaseTarget(target, cactusWorkflowArguments, phaseTarget):
+    """Runs the phase target as the follow on of the given target. If the server of the primary database is not 
+    running, as it was restarted at a checkpoint or the run was resumed, and the phase uses it, it is launched for 
+    the phase and the phases that follow it, which are run as its dependent child instead. Likewise, if the servers 
+    of the secondary databases are reused, and are not running, and the phase uses them, they are launched for it 
+    (see addReusedKtserverDependentChild).
+    """
+    exp = ExperimentWrapper(cactusWorkflowArguments.experimentNode)
+    if exp.getDbType() == "kyoto_tycoon" and cactusWorkflowArguments.ktserverKillSwitchPath == None and phaseTarget.usesPrimaryDatabase():
+        target.logToMaster("Launching the ktserver for the %s phase and the phases that follow it" % phaseTarget.__class__.__name__)
+        addPrimaryKtserverDependentChild(target, CactusPhaseRunner(phaseTarget))
+        return
+    secondaryElem = DbElemWrapper(ET.fromstring(cactusWorkflowArguments.secondaryDatabaseString))
+    cw = cactusWorkflowArguments.configWrapper
+    if exp.getDbType() == "kyoto_tycoon" and secondaryElem.getDbType() == "kyoto_tycoon" and cw.getKtserverReuseSecondary() and \
+            phaseTarget.usesSecondaryDatabase() and not areReusedKtserversRunning(exp.getKtserverReuseDir()):
+        target.logToMaster("Launching the reused secondary ktserver for the %s phase and the phases that follow it" % 
+                           phaseTarget.__class__.__name__)
+        constantsNode = findRequiredNode(cactusWorkflowArguments.configNode, "constants")
+        addReusedKtserverDependentChild(target, phaseTarget, [ secondaryElem ], exp.getKtserverReuseDir(), 
+                                        cactusWorkflowArguments.experimentFile,
+                                        maxMemory=cw.getKtserverMemory(default=getOptionalAttrib(constantsNode, "defaultMemory", int, default=sys.maxint)),
+                                        maxCpu=cw.getKtserverCpu(default=getOptionalAttrib(constantsNode, "defaultCpu", int, default=sys.maxint)),
+                                        metricsInterval=cw.getKtserverMetricsInterval())
+    else:
+        target.setFollowOnTarget(phaseTarget)
+
+def addPrimaryKtserverDependentChild(target, phaseTarget):
+    """Launches the server of the primary database as a child of the given target, for the lifespan of the phase 
+    target and the phases that follow it (see addKtserverDependentChild).
+    """
+    cw = phaseTarget.cactusWorkflowArguments.configWrapper
+    addKtserverDependentChild(target, phaseTarget, 
+                              maxMemory=cw.getKtserverMemory(default=getOptionalAttrib(phaseTarget.constantsNode, "defaultMemory", int, default=sys.maxint)),
+                              maxCpu=cw.getKtserverCpu(default=getOptionalAttrib(phaseTarget.constantsNode, "defaultCpu", int, default=sys.maxint)),
+                              isSecondary=False, metricsInterval=cw.getKtserverMetricsInterval())
+
+class CactusPhaseRunner(CactusPhasesTarget):
+    """Runs a phase target with runPhaseTarget, once the server of the primary database has been launched for it.
+    """
+    def __init__(self, phaseTarget):
+        CactusPhasesTarget.__init__(self, cactusWorkflowArguments=phaseTarget.cactusWorkflowArguments, 
+                                    phaseName=phaseTarget.phaseNode.tag, topFlowerName=phaseTarget.topFlowerName, 
+                                    index=phaseTarget.index)
+        self.phaseTarget = phaseTarget
+    
+    def run(self):
+        runPhaseTarget(self, self.cactusWorkflowArguments, self.phaseTarget)
+
 ############################################################
 ############################################################
 ############################################################
@@ -957,6 +1565,11 @@ class CactusWorkflowArguments:
         self.outgroupEventNames = getOptionalAttrib(self.experimentNode, "outgroup_events")
         #Constraints
         self.constraintsFile = getOptionalAttrib(self.experimentNode, "constraints")
+        #The kill switch file of the server of a kyoto tycoon database, while it is running (see runPhaseTarget)
+        self.ktserverKillSwitchPath = None
+        #The config node
+        self.configNode = ET.parse(self.experimentWrapper.getConfigPath()).getroot()
+        self.configWrapper = ConfigWrapper(self.configNode)
         #Secondary, scratch DB
         secondaryConf = copy.deepcopy(self.experimentNode.find("cactus_disk").find("st_kv_database_conf"))
         secondaryElem = DbElemWrapper(secondaryConf)
@@ -966,12 +1579,20 @@ class CactusWorkflowArguments:
             os.path.basename(dbPath), random.random()))
         secondaryElem.setDbDir(secondaryDbPath)
         if secondaryElem.getDbType() == "kyoto_tycoon":
+            #Only the cactus disk routes keys between the servers of a partitioned database, and the scratch database
+            #is not read through it
+            secondaryElem.setDbPartitionNumber(1)
             secondaryElem.setDbPort(secondaryElem.getDbPort() + 100)
+            if self.configWrapper.getKtserverSecondaryInMemory():
+                #The scratch database is thrown away once used, so it is kept in memory, with no snapshots, in a
+                #cache hash database (as its buckets can be tuned, and it does not evict records unless limited)
+                secondaryElem.setDbInMemory(True)
+                secondaryElem.setDbName("*")
+                secondaryElem.setDbSnapshot(False)
+                for tuningAttrib in ("tuning_options", "create_tuning_options", "read_tuning_options"):
+                    secondaryElem.getDbElem().attrib.pop(tuningAttrib, None)
         self.secondaryDatabaseString = secondaryElem.getConfString()
             
-        #The config node
-        self.configNode = ET.parse(self.experimentWrapper.getConfigPath()).getroot()
-        self.configWrapper = ConfigWrapper(self.configNode)
         #Now deal with the constants that ned to be added here
         self.configWrapper.substituteAllPredefinedConstantsWithLiterals()
         self.configWrapper.setBuildHal(options.buildHal)
@@ -982,6 +1603,21 @@ class CactusWorkflowArguments:
             findRequiredNode(self.configNode, "avg").attrib["buildAvgs"] = "1"
         if options.buildReference:
             findRequiredNode(self.configNode, "reference").attrib["buildReference"] = "1"
+        #Check the config now rather than when the phases that use it are run
+        self.configWrapper.validate()
+        #Used to check that any phase checkpoints were written by a run of the same alignment
+        self.configHash = getWorkflowConfigHash(self.configNode, self.experimentNode)
+        #Where the wrapper targets record their resource usage, see CactusRecursionTarget.runWrapperProgram
+        findRequiredNode(self.configNode, "constants").attrib["resourceUsageFile"] = getWrapperResourceUsageFile(options.experimentFile)
+    
+    def restorePhaseCheckpoint(self, manifest):
+        """Restores the config and experiment, as changed by the phases run, from a phase checkpoint manifest.
+        """
+        self.configNode = ET.fromstring(manifest["config"])
+        self.configWrapper = ConfigWrapper(self.configNode)
+        self.experimentNode = ET.fromstring(manifest["experiment"])
+        self.experimentWrapper = ExperimentWrapper(self.experimentNode)
+        self.secondaryDatabaseString = str(manifest["secondaryDatabaseString"])
             
 
 def addCactusWorkflowOptions(parser):
@@ -1012,6 +1648,22 @@ class RunCactusPreprocessorThenCactusSetup(Target):
     def run(self):
         cactusWorkflowArguments=CactusWorkflowArguments(self.options)
         eW = ExperimentWrapper(cactusWorkflowArguments.experimentNode)
+        #Resume from the last phase checkpoint, if there is one for this alignment
+        checkpointDir = eW.getPhaseCheckpointDir()
+        databaseDir = eW.getDbDir()
+        manifest = getResumablePhaseCheckpoint(checkpointDir, cactusWorkflowArguments.configHash, databaseDir)
+        if manifest != None:
+            restorePhaseCheckpointDatabase(checkpointDir, manifest, databaseDir)
+            cactusWorkflowArguments.restorePhaseCheckpoint(manifest)
+            nextPhaseTarget = globals()[str(manifest["nextPhase"])]
+            assert issubclass(nextPhaseTarget, CactusPhasesTarget)
+            self.logToMaster("Resuming from the checkpoint written when the %s phase completed, starting with the %s phase" % 
+                             (manifest["completedPhase"], manifest["nextPhase"]))
+            runPhaseTarget(self, cactusWorkflowArguments, 
+                           nextPhaseTarget(cactusWorkflowArguments=cactusWorkflowArguments, phaseName=str(manifest["nextPhaseName"]), 
+                                           topFlowerName=manifest["topFlowerName"], index=manifest["index"]))
+            return
+        clearPhaseCheckpoints(checkpointDir)
         outputSequenceFiles = CactusPreprocessor.getOutputSequenceFiles(eW.getSequences(), eW.getOutputSequenceDir())
         self.addChildTarget(CactusPreprocessor(eW.getSequences(), outputSequenceFiles, cactusWorkflowArguments.configNode))
         #Now make the setup, replacing the input sequences with the preprocessed sequences
@@ -1019,10 +1671,11 @@ class RunCactusPreprocessorThenCactusSetup(Target):
         self.logToMaster("doTrimStrategy() = %s, outgroupEventNames = %s" % (cactusWorkflowArguments.configWrapper.getDoTrimStrategy(), cactusWorkflowArguments.outgroupEventNames))
         if cactusWorkflowArguments.configWrapper.getDoTrimStrategy() and cactusWorkflowArguments.outgroupEventNames is not None:
             # Use the trimming strategy to blast ingroups vs outgroups.
-            self.setFollowOnTarget(CactusTrimmingBlastPhase(cactusWorkflowArguments=cactusWorkflowArguments, phaseName="trimBlast"))
+            nextPhaseTarget, nextPhaseName = CactusTrimmingBlastPhase, "trimBlast"
         else:
-            self.setFollowOnTarget(CactusSetupPhase(cactusWorkflowArguments=cactusWorkflowArguments,
-                                                    phaseName="setup"))
+            nextPhaseTarget, nextPhaseName = CactusSetupPhase, "setup"
+        self.setFollowOnTarget(CactusPhaseCheckpoint(cactusWorkflowArguments=cactusWorkflowArguments, completedPhase="CactusPreprocessor",
+                                                     nextPhaseTarget=nextPhaseTarget, nextPhaseName=nextPhaseName))
         
 def main():
     ##########################################
@@ -9,6 +9,11 @@
 import unittest
 import os
 import sys
+import random
+import itertools
+import cPickle
+import signal
+import subprocess
 
 from cactus.shared.test import parseCactusSuiteTestOptions
 from sonLib.bioio import TestStatus, newickTreeParser
@@ -20,10 +25,15 @@ from cactus.shared.test import getCactusInputs_encode
 from cactus.shared.test import getCactusInputs_chromosomeX
 
 from cactus.shared.test import runWorkflow_multipleExamples
+from cactus.shared.test import runWorkflow_TestScript
 
 from cactus.shared.test import getBatchSystem
+from cactus.shared.test import getCactusWorkflowExperimentForTest
 
 from cactus.shared.common import cactusRootPath
+from cactus.shared.common import decodeFlowerNames
+from sonLib.bioio import getTempDirectory
+from jobTree.src.common import runJobTreeStatusAndFailIfNotComplete
 
 from cactus.pipeline.cactus_workflow import *
 
@@ -106,6 +116,94 @@ class TestCase(unittest.TestCase):
         self.assertTrue(subNodeCopy != None)
         self.assertEquals("10", subNodeCopy.attrib["memory"])
         
+    def testPhaseParameters(self):
+        ET.SubElement(self.barNode, "CactusSetReferenceCoordinatesDownRecursion", { "memory":"10" })
+        parameters = PhaseParameters.fromNode(self.barNode)
+        self.assertTrue(parameters is PhaseParameters.fromNode(extractNode(self.barNode)))
+        self.assertTrue(parameters is PhaseParameters.fromNode(parameters))
+        self.assertEquals("bar", parameters.tag)
+        self.assertEquals(self.barNode.attrib, parameters.attrib)
+        self.assertEquals(0, getOptionalAttrib(parameters, "minimumBlockDegree", typeFn=int, default=1))
+        self.assertEquals(1, getOptionalAttrib(parameters, "doesntExist", typeFn=int, default=1))
+        self.assertEquals("10", parameters.find("CactusSetReferenceCoordinatesDownRecursion").attrib["memory"])
+        self.assertEquals(None, parameters.find("doesntExist"))
+        self.assertEquals(0, parameters.getOptionalAttrib("minimumBlockDegree", typeFn=int, default=1))
+        self.assertEquals(0, getOptionalParameter(parameters, "minimumBlockDegree", typeFn=int, default=1))
+        self.assertEquals("0", getOptionalParameter(parameters, "minimumBlockDegree"))
+        self.assertEquals(1, getOptionalParameter(parameters, "doesntExist", typeFn=int, default=1))
+        self.assertEquals(0, getOptionalParameter(self.barNode, "minimumBlockDegree", typeFn=int, default=1))
+        self.assertTrue(parameters is cPickle.loads(cPickle.dumps(parameters, cPickle.HIGHEST_PROTOCOL)))
+        #Changes make new parameters
+        try:
+            parameters.attrib["added"] = "1"
+            self.assertTrue(0)
+        except TypeError:
+            pass
+        changedParameters = parameters.withAttrib("added", "1")
+        self.assertFalse("added" in parameters.attrib)
+        self.assertEquals("1", changedParameters.attrib["added"])
+        self.assertTrue(changedParameters is parameters.withAttrib("added", "1"))
+        self.assertTrue(parameters is changedParameters.withAttrib("added", None))
+        self.assertTrue(changedParameters.find("CactusSetReferenceCoordinatesDownRecursion") is \
+                        parameters.find("CactusSetReferenceCoordinatesDownRecursion"))
+    
+    def testPhaseParametersPickledSize(self):
+        """Compares the bytes pickled for the recursion targets of each phase when they hold 
+        copies of the XML phase nodes and when they hold phase parameters.
+        """
+        constantsNode = self.configNode.find("constants")
+        flowerNames = encodeFlowerNames([ random.randint(0, 1000000000) for i in xrange(10) ])
+        for phaseName, target in (("caf", CactusCafWrapper), ("bar", CactusBarWrapper), ("normal", CactusNormalWrapper), 
+                                  ("reference", CactusReferenceWrapper), ("check", CactusCheckWrapper), ("hal", CactusHalGeneratorUpWrapper)):
+            phaseNode = self.configNode.find(phaseName)
+            pickledSizes = []
+            for makeCopy in (extractNode, PhaseParameters.fromNode):
+                pickledSize = 0
+                for i in xrange(1000): #Like the children of a recursion target
+                    pickledSize += len(cPickle.dumps(target(phaseNode=makeCopy(phaseNode), constantsNode=makeCopy(constantsNode), 
+                                                            cactusDiskDatabaseString=self.configFile, flowerNames=flowerNames), 
+                                                     cPickle.HIGHEST_PROTOCOL))
+                pickledSizes.append(pickledSize / 1000.0)
+            print "Pickled bytes per target for the %s phase, with XML nodes: %s, with phase parameters: %s" % (phaseName, pickledSizes[0], pickledSizes[1])
+            self.assertTrue(pickledSizes[1] < pickledSizes[0])
+        
+    def testPackEndsIntoGroups(self):
+        self.assertEquals([], packEndsIntoGroups([], 3))
+        self.assertEquals([ (3.0, [ "b", "a" ]) ], packEndsIntoGroups([ ("a", 1.0), ("b", 2.0) ], 0)) #Biggest first
+        self.assertEquals(estimateEndAlignmentCost(10, 1000), 10 * 100 * 100)
+        for test in xrange(100):
+            #Many small ends and a few pathological ones, in random order
+            endsAndCosts = [ (str(i), estimateEndAlignmentCost(random.randint(1, 50), random.randint(1, 10000))) for i in xrange(random.randint(1, 200)) ]
+            endsAndCosts += [ ("big%i" % i, estimateEndAlignmentCost(2, random.randint(10000, 100000))) for i in xrange(random.randint(0, 3)) ]
+            random.shuffle(endsAndCosts)
+            groupNumber = random.randint(1, 20)
+            groups = packEndsIntoGroups(endsAndCosts, groupNumber)
+            self.assertTrue(len(groups) <= groupNumber)
+            self.assertEquals(sorted([ end for end, cost in endsAndCosts ]), sorted(sum([ ends for cost, ends in groups ], [])))
+            costs = dict(endsAndCosts)
+            for cost, ends in groups:
+                self.assertAlmostEquals(cost, sum([ costs[end] for end in ends ]), delta=cost * 1e-9)
+        for test in xrange(200):
+            #Longest first packing is within 4/3 - 1/(3 * groupNumber) of the optimum, found by trying every packing of a few ends
+            endsAndCosts = [ (str(i), float(random.randint(1, 100))) for i in xrange(random.randint(1, 8)) ]
+            groupNumber = random.randint(1, 4)
+            optimum = min([ max([ sum([ cost for (end, cost), j in zip(endsAndCosts, packing) if j == i ]) for i in xrange(groupNumber) ])
+                            for packing in itertools.product(xrange(groupNumber), repeat=len(endsAndCosts)) ])
+            groups = packEndsIntoGroups(endsAndCosts, groupNumber)
+            self.assertTrue(max([ cost for cost, ends in groups ]) <= (4.0/3.0 - 1.0/(3 * groupNumber)) * optimum * (1 + 1e-9))
+        for test in xrange(100):
+            #Cheap but long ends are not packed together beyond the bases of a group
+            endsAndCosts = [ (str(i), float(random.randint(1, 100))) for i in xrange(random.randint(1, 200)) ]
+            endBases = dict([ (end, random.randint(1, 2000)) for end, cost in endsAndCosts ])
+            maxGroupBases = random.randint(500, 5000)
+            groupNumber = random.randint(1, 5)
+            groups = packEndsIntoGroups(endsAndCosts, groupNumber, endBases=endBases, maxGroupBases=maxGroupBases)
+            self.assertEquals(sorted([ end for end, cost in endsAndCosts ]), sorted(sum([ ends for cost, ends in groups ], [])))
+            for cost, ends in groups:
+                self.assertTrue(len(ends) == 1 or sum([ endBases[end] for end in ends ]) <= maxGroupBases)
+            if sum(endBases.values()) <= maxGroupBases:
+                self.assertTrue(len(groups) <= groupNumber)
+    
     def testGetTargetNode(self):
         class CactusTestTarget(CactusTarget):
             pass
@@ -140,6 +238,203 @@ class TestCase(unittest.TestCase):
         self.assertEquals(target.getMemory(), sys.maxint)
         self.assertEquals(target.getCpu(), sys.maxint)
     
+    def testFlowerStatsBatchBenchmark(self):
+        """Compares getting the stats of the flowers at each level of a cactus tree with one call
+        (and so one database connection) per flower against one batched call per level.
+        """
+        if TestStatus.getTestStatus() not in (TestStatus.TEST_MEDIUM, TestStatus.TEST_LONG, TestStatus.TEST_VERY_LONG):
+            return
+        tempDir = getTempDirectory(os.getcwd())
+        sequences, newickTreeString = getCactusInputs_random(tempDir=tempDir, sequenceNumber=50, avgSequenceLength=2000, treeLeafNumber=5)
+        experiment = runWorkflow_TestScript(sequences, newickTreeString, outputDir=tempDir, batchSystem=self.batchSystem)
+        if experiment.getDbType() != "tokyo_cabinet": #The database must still be readable after the workflow
+            experiment.cleanupDb()
+            system("rm -rf %s" % tempDir)
+            return
+        cactusDiskDatabaseString = experiment.getDiskDatabaseString()
+        flowerNames = [ 0 ]
+        level = 0
+        while len(flowerNames) > 0:
+            startTime = time.time()
+            singleStats = [ runCactusFlowerStats(cactusDiskDatabaseString, flowerName) for flowerName in flowerNames ]
+            singleTime = time.time() - startTime
+            startTime = time.time()
+            batchStats = runCactusFlowerStatsBatch(cactusDiskDatabaseString, flowerNames)
+            batchTime = time.time() - startTime
+            self.assertEquals(singleStats, batchStats)
+            print "Level %i: stats for %i flowers took %i database connections and %s seconds one at a time, and 1 database connection and %s seconds batched" % \
+                (level, len(flowerNames), len(flowerNames), singleTime, batchTime)
+            flowerNames = sum([ decodeFlowerNames(childFlowerNames) for overlarge, childFlowerNames in 
+                                runCactusGetFlowers(cactusDiskDatabaseString, encodeFlowerNames(flowerNames), minSequenceSizeOfFlower=0) ], [])
+            level += 1
+        experiment.cleanupDb()
+        system("rm -rf %s" % tempDir)
+    
+    def testFlowerTreeIndexBenchmark(self):
+        """Compares getting the child flowers at each level of a cactus tree from the database, with 
+        cactus_workflow_getFlowers, against getting them from a flower tree index.
+        """
+        if TestStatus.getTestStatus() not in (TestStatus.TEST_MEDIUM, TestStatus.TEST_LONG, TestStatus.TEST_VERY_LONG):
+            return
+        tempDir = getTempDirectory(os.getcwd())
+        sequences, newickTreeString = getCactusInputs_random(tempDir=tempDir, sequenceNumber=50, avgSequenceLength=2000, treeLeafNumber=5)
+        experiment = runWorkflow_TestScript(sequences, newickTreeString, outputDir=tempDir, batchSystem=self.batchSystem)
+        if experiment.getDbType() != "tokyo_cabinet": #The database must still be readable after the workflow
+            experiment.cleanupDb()
+            system("rm -rf %s" % tempDir)
+            return
+        cactusDiskDatabaseString = experiment.getDiskDatabaseString()
+        indexFile = os.path.join(tempDir, "flowerTree.index")
+        startTime = time.time()
+        flowerNumber = runCactusFlowerTree(cactusDiskDatabaseString, indexFile)
+        print "Indexing the %i flowers of the cactus tree took 1 database connection and %s seconds" % (flowerNumber, time.time() - startTime)
+        index = FlowerTreeIndex(indexFile)
+        flowerNames = [ 0 ]
+        level = 0
+        getFlowersInvocations = 0
+        totalDatabaseTime, totalIndexTime = 0.0, 0.0
+        while len(flowerNames) > 0:
+            startTime = time.time()
+            flowersAndSizes = [ runCactusGetFlowers(cactusDiskDatabaseString, encodeFlowerNames((flowerName,)), minSequenceSizeOfFlower=0) 
+                                for flowerName in flowerNames ]
+            getFlowersInvocations += len(flowerNames)
+            databaseTime = time.time() - startTime
+            startTime = time.time()
+            indexedFlowersAndSizes = [ index.getFlowers(encodeFlowerNames((flowerName,)), minSequenceSizeOfFlower=0) for flowerName in flowerNames ]
+            indexTime = time.time() - startTime
+            self.assertEquals(flowersAndSizes, indexedFlowersAndSizes)
+            print "Level %i: the child flowers of %i flowers took %i getFlowers invocations and %s seconds from the database, and %s seconds from the index" % \
+                (level, len(flowerNames), len(flowerNames), databaseTime, indexTime)
+            totalDatabaseTime += databaseTime
+            totalIndexTime += indexTime
+            flowerNames = sum([ decodeFlowerNames(childFlowerNames) for childFlowersAndSizes in flowersAndSizes
+                                for overlarge, childFlowerNames in childFlowersAndSizes ], [])
+            level += 1
+        self.assertEquals(flowerNumber + 1, getFlowersInvocations) #Every flower but the root is in the index
+        print "In total %i getFlowers invocations took %s seconds, the index took %s seconds" % (getFlowersInvocations, totalDatabaseTime, totalIndexTime)
+        experiment.cleanupDb()
+        system("rm -rf %s" % tempDir)
+    
+    def testPhaseCheckpoints(self):
+        tempDir = getTempDirectory(os.getcwd())
+        checkpointDir = os.path.join(tempDir, "checkpoints")
+        databaseDir = os.path.join(tempDir, "database")
+        inputFile = os.path.join(tempDir, "input.fa")
+        fileHandle = open(inputFile, "w")
+        fileHandle.write(">a\nACGT\n")
+        fileHandle.close()
+        self.assertEquals([], readPhaseCheckpoints(checkpointDir))
+        self.assertEquals(None, getResumablePhaseCheckpoint(checkpointDir, "hash", databaseDir))
+        self.assertEquals(getFilesSnapshotId(databaseDir), getFilesSnapshotId(os.path.join(tempDir, "doesntExist")))
+        #Write a checkpoint, keeping a copy of the database
+        os.mkdir(databaseDir)
+        fileHandle = open(os.path.join(databaseDir, "cactusDisk"), "w")
+        fileHandle.write("phase1")
+        fileHandle.close()
+        keepPhaseCheckpointDatabase(checkpointDir, databaseDir)
+        manifest = { "completedPhase":"CactusBarPhase", "nextPhase":"CactusNormalPhase", "configHash":"hash", 
+                     "databaseSnapshot":getFilesSnapshotId(databaseDir), "inputFiles":[ (inputFile, getFilesSnapshotId(inputFile)) ] }
+        self.assertTrue(writePhaseCheckpoint(checkpointDir, manifest).endswith("00000.CactusBarPhase.json"))
+        self.assertEquals([ manifest ], [ dict([ (key, value if key != "inputFiles" else [ tuple(i) for i in value ]) 
+                                                 for key, value in m.items() ]) for m in readPhaseCheckpoints(checkpointDir) ])
+        self.assertEquals("CactusNormalPhase", getResumablePhaseCheckpoint(checkpointDir, "hash", databaseDir)["nextPhase"])
+        self.assertEquals(None, getResumablePhaseCheckpoint(checkpointDir, "otherHash", databaseDir))
+        #Part of the next phase runs, the database is restored from the copy
+        fileHandle = open(os.path.join(databaseDir, "cactusDisk"), "a")
+        fileHandle.write("phase2")
+        fileHandle.close()
+        manifest = getResumablePhaseCheckpoint(checkpointDir, "hash", databaseDir)
+        self.assertTrue(manifest != None)
+        restorePhaseCheckpointDatabase(checkpointDir, manifest, databaseDir)
+        self.assertEquals("phase1", open(os.path.join(databaseDir, "cactusDisk"), "r").read())
+        #Without the copy the database can not be restored
+        shutil.rmtree(os.path.join(checkpointDir, "database"))
+        fileHandle = open(os.path.join(databaseDir, "cactusDisk"), "a")
+        fileHandle.write("phase2")
+        fileHandle.close()
+        self.assertEquals(None, getResumablePhaseCheckpoint(checkpointDir, "hash", databaseDir))
+        #Or if an input has changed
+        manifest["inputFiles"] = [ (os.path.join(tempDir, "doesntExist"), getFilesSnapshotId(inputFile)) ]
+        manifest["databaseSnapshot"] = getFilesSnapshotId(databaseDir)
+        self.assertTrue(writePhaseCheckpoint(checkpointDir, manifest).endswith("00001.CactusBarPhase.json"))
+        self.assertEquals(None, getResumablePhaseCheckpoint(checkpointDir, "hash", databaseDir))
+        #Or if the database was not kept, as for an in memory kyoto tycoon database without snapshots
+        manifest["inputFiles"] = []
+        manifest["databaseSnapshot"] = None
+        self.assertTrue(writePhaseCheckpoint(checkpointDir, manifest).endswith("00002.CactusBarPhase.json"))
+        self.assertEquals(None, getResumablePhaseCheckpoint(checkpointDir, "hash", databaseDir))
+        clearPhaseCheckpoints(checkpointDir)
+        self.assertEquals([], readPhaseCheckpoints(checkpointDir))
+        #The snapshots a ktserver wrote when it was killed are kept as links, which a new snapshot does not change
+        os.mkdir(os.path.join(databaseDir, "partition_1"))
+        snapshotFile = os.path.join(databaseDir, "partition_1", "00000000.ktss")
+        fileHandle = open(snapshotFile, "w")
+        fileHandle.write("phase1")
+        fileHandle.close()
+        shutdownStats = [ { "files":{} }, { "files":{ snapshotFile:{} } } ]
+        keepPhaseCheckpointKtserverFiles(checkpointDir, databaseDir, shutdownStats, link=True)
+        self.assertEquals([ "00000000.ktss" ], os.listdir(os.path.join(checkpointDir, "database", "partition_1")))
+        manifest["databaseSnapshot"] = getFilesSnapshotId(os.path.join(checkpointDir, "database"))
+        writePhaseCheckpoint(checkpointDir, manifest)
+        fileHandle = open(snapshotFile + ".tmp", "w")
+        fileHandle.write("phase2")
+        fileHandle.close()
+        os.rename(snapshotFile + ".tmp", snapshotFile)
+        manifest = getResumablePhaseCheckpoint(checkpointDir, "hash", databaseDir)
+        self.assertTrue(manifest != None)
+        restorePhaseCheckpointDatabase(checkpointDir, manifest, databaseDir)
+        self.assertEquals([ "partition_1" ], os.listdir(databaseDir))
+        self.assertEquals("phase1", open(snapshotFile, "r").read())
+        clearPhaseCheckpoints(checkpointDir)
+        system("rm -rf %s" % tempDir)
+    
+    def testResumeFromPhaseCheckpoint(self):
+        """Kills the workflow once a phase has completed, then restarts it with a fresh jobTree
+        and checks that it resumes from the next phase, giving the same output as a run that 
+        was not interrupted.
+        """
+        if TestStatus.getTestStatus() not in (TestStatus.TEST_MEDIUM, TestStatus.TEST_LONG, TestStatus.TEST_VERY_LONG):
+            return
+        tempDir = getTempDirectory(os.getcwd())
+        sequences, newickTreeString = getCactusInputs_random(tempDir=tempDir, sequenceNumber=20, avgSequenceLength=2000, treeLeafNumber=4)
+        findRequiredNode(self.configNode, "constants").attrib["checkpointDatabase"] = "1"
+        configFile = os.path.join(tempDir, "config.xml")
+        ET.ElementTree(self.configNode).write(configFile)
+        outputs = []
+        for killAfterPhase in (None, "CactusBarPhase"):
+            outputDir = os.path.join(tempDir, "killAfter%s" % killAfterPhase)
+            os.mkdir(outputDir)
+            experiment = getCactusWorkflowExperimentForTest(sequences, newickTreeString, outputDir=outputDir, configFile=configFile)
+            if experiment.getDbType() == "kyoto_tycoon" and experiment.getDbInMemory() and not experiment.getDbSnapshot():
+                system("rm -rf %s" % tempDir)
+                self.skipTest("Runs with an in memory kyoto tycoon database without snapshots are not resumed")
+            experiment.cleanupDb()
+            experimentFile = os.path.join(outputDir, "experiment.xml")
+            experiment.writeXML(experimentFile)
+            jobTreeDir = os.path.join(outputDir, "jobTree")
+            command = "cactus_workflow.py --experiment %s --jobTree %s --batchSystem %s --buildReference --buildFasta --logLevel CRITICAL" % \
+                (experimentFile, jobTreeDir, self.batchSystem)
+            checkpointDir = experiment.getPhaseCheckpointDir()
+            if killAfterPhase != None:
+                process = subprocess.Popen(command.split(), preexec_fn=os.setsid) #So the workers can be killed too
+                while process.poll() == None and killAfterPhase not in [ manifest["completedPhase"] for manifest in readPhaseCheckpoints(checkpointDir) ]:
+                    time.sleep(0.1)
+                self.assertEquals(None, process.poll()) #The run has not finished
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                system("rm -rf %s" % jobTreeDir)
+            system(command)
+            runJobTreeStatusAndFailIfNotComplete(jobTreeDir)
+            completedPhases = [ manifest["completedPhase"] for manifest in readPhaseCheckpoints(checkpointDir) ]
+            self.assertEquals(1, completedPhases.count("CactusPreprocessor"))
+            self.assertEquals(1, completedPhases.count("CactusSetupPhase2")) #The resumed run did not redo the setup
+            fileHandle = open(experiment.getHALFastaPath(), "r")
+            outputs.append(fileHandle.read())
+            fileHandle.close()
+            experiment.cleanupDb()
+        self.assertEquals(outputs[0], outputs[1])
+        system("rm -rf %s" % tempDir)
+    
     def testGetLongestPath(self):
         self.assertAlmostEquals(getLongestPath(newickTreeParser("(b(a:0.5):0.5,b(a:1.5):0.5)")), 2.0)
         self.assertAlmostEquals(getLongestPath(newickTreeParser("(b(a:0.5):0.5,b(a:1.5,c:10):0.5)")), 10.5)
@@ -0,0 +1,155 @@
+/*
+ * Copyright (C) 2026 by the cactus contributors
+ *
+ * Released under the MIT license, see LICENSE.txt
+ */
+
+#include <sys/types.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <sys/select.h>
+#include <sys/time.h>
+#include <unistd.h>
+#include <errno.h>
+#include <signal.h>
+#include <time.h>
+#include "cactus_workflow_shared.h"
+
+/*
+ * A long lived process that answers the same queries as cactus_workflow_getFlowers over a
+ * unix socket, so that the recursion targets running on a node share one database connection
+ * rather than each starting a process and connecting.
+ *
+ * Usage: cactus_workflow_flowerServer logLevel cactusDiskString socketPath idleTimeout
+ *
+ * Each connection sends one query:
+ *
+ * getFlowers minFlowerSize maxFlowerGroupSize maxFlowerSecondaryGroupSize encodedFlowerNames
+ *
+ * and is sent the output of cactus_workflow_getFlowers followed by a line "done". The flowers are
+ * unloaded after each query, as other jobs may change them. The server exits if there is no query
+ * for idleTimeout seconds.
+ */
+
+static double getTime() {
+    struct timeval t;
+    gettimeofday(&t, NULL);
+    return t.tv_sec + t.tv_usec / 1000000.0;
+}
+
+static int listenOnSocket(const char *socketPath) {
+    struct sockaddr_un address;
+    memset(&address, 0, sizeof(address));
+    address.sun_family = AF_UNIX;
+    if (strlen(socketPath) >= sizeof(address.sun_path)) {
+        st_errAbort("The socket path is too long: %s", socketPath);
+    }
+    strcpy(address.sun_path, socketPath);
+    //If another server is already answering on the socket leave the queries to it
+    int fd = socket(AF_UNIX, SOCK_STREAM, 0);
+    if (connect(fd, (struct sockaddr *) &address, sizeof(address)) == 0) {
+        close(fd);
+        return -1;
+    }
+    close(fd);
+    unlink(socketPath); //The socket, if it exists, is stale
+    fd = socket(AF_UNIX, SOCK_STREAM, 0);
+    if (bind(fd, (struct sockaddr *) &address, sizeof(address)) != 0 || listen(fd, 64) != 0) {
+        close(fd);
+        return -1;
+    }
+    return fd;
+}
+
+static bool answerQuery(FILE *in, FILE *out) {
+    char command[100];
+    int64_t maxSequenceSizeOfFlowerGrouping, maxSequenceSizeOfSecondaryFlowerGrouping;
+    if (fscanf(in, "%99s %" PRIi64 " %" PRIi64 " %" PRIi64 "", command, &minFlowerSize,
+            &maxSequenceSizeOfFlowerGrouping, &maxSequenceSizeOfSecondaryFlowerGrouping) != 4 || strcmp(command, "getFlowers") != 0) {
+        fprintf(out, "error\n");
+        return 0;
+    }
+    if (maxSequenceSizeOfFlowerGrouping == -1) {
+        maxSequenceSizeOfFlowerGrouping = INT64_MAX;
+    }
+    if (maxSequenceSizeOfSecondaryFlowerGrouping == -1) {
+        maxSequenceSizeOfSecondaryFlowerGrouping = INT64_MAX;
+    }
+    stList *flowerNames = flowerWriter_parseNames(in);
+    stList *flowers = cactusDisk_getFlowers(cactusDisk, flowerNames);
+    flowerWriter = flowerWriter_construct(out, maxSequenceSizeOfFlowerGrouping, maxSequenceSizeOfSecondaryFlowerGrouping);
+    writeChildFlowers(flowers);
+    flowerWriter_destruct(flowerWriter);
+    for (int64_t i = 0; i < stList_length(flowers); i++) {
+        flower_unload(stList_get(flowers, i));
+    }
+    stList_destruct(flowers);
+    stList_destruct(flowerNames);
+    fprintf(out, "done\n");
+    return 1;
+}
+
+int main(int argc, char *argv[]) {
+    assert(argc == 5);
+    st_setLogLevelFromString(argv[1]);
+    const char *socketPath = argv[3];
+    int64_t idleTimeout;
+    int64_t i = sscanf(argv[4], "%" PRIi64 "", &idleTimeout);
+    (void) i;
+    assert(i == 1);
+
+    signal(SIGPIPE, SIG_IGN); //A client going away should not kill the server
+
+    int listenFd = listenOnSocket(socketPath);
+    if (listenFd == -1) {
+        st_logInfo("A flower server is already listening on %s, or the socket could not be bound, exiting\n", socketPath);
+        return 0;
+    }
+
+    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(argv[2]);
+    cactusDisk = cactusDisk_construct(kvDatabaseConf, 0);
+    stKVDatabaseConf_destruct(kvDatabaseConf);
+    st_logInfo("Flower server connected to the database and listening on %s\n", socketPath);
+
+    int64_t queryNumber = 0;
+    double totalQueryTime = 0.0;
+    while (1) {
+        fd_set fds;
+        FD_ZERO(&fds);
+        FD_SET(listenFd, &fds);
+        struct timeval timeout;
+        timeout.tv_sec = idleTimeout;
+        timeout.tv_usec = 0;
+        int j = select(listenFd + 1, &fds, NULL, NULL, &timeout);
+        if (j == 0) {
+            break; //Idle for too long
+        }
+        if (j < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            break;
+        }
+        int connectionFd = accept(listenFd, NULL, NULL);
+        if (connectionFd < 0) {
+            continue;
+        }
+        double startTime = getTime();
+        FILE *in = fdopen(connectionFd, "r");
+        FILE *out = fdopen(dup(connectionFd), "w");
+        bool answered = answerQuery(in, out);
+        fclose(out);
+        fclose(in);
+        double queryTime = getTime() - startTime;
+        queryNumber++;
+        totalQueryTime += queryTime;
+        st_logInfo("Flower server answered query %" PRIi64 " (%s) in %f seconds\n", queryNumber, answered ? "ok" : "malformed", queryTime);
+    }
+
+    close(listenFd);
+    unlink(socketPath);
+    st_logInfo("Flower server exiting after answering %" PRIi64 " queries with 1 database connection in a total of %f seconds\n",
+            queryNumber, totalQueryTime);
+    cactusDisk_destruct(cactusDisk);
+    return 0;
+}
@@ -8,21 +8,15 @@
 #include "sonLib.h"
 
 /*
- * Prints info about a flower.
+ * Prints info about a flower, or a list of flowers.
+ *
+ * Usage: cactus_workflow_flowerStats logLevel cactusDiskString [flowerName]
+ *
+ * If no flower name is given an encoded list of flower names is read from stdin,
+ * the flowers are loaded together and a line of stats is printed for each, in the order given.
  */
 
-int main(int argc, char *argv[]) {
-    st_setLogLevelFromString(argv[1]);
-    st_logDebug("Set up logging\n");
-
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(argv[2]);
-    CactusDisk *cactusDisk = cactusDisk_construct(kvDatabaseConf, 0);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
-    st_logDebug("Set up the flower disk\n");
-
-    Name flowerName = cactusMisc_stringToName(argv[3]);
-    Flower *flower = cactusDisk_getFlower(cactusDisk, flowerName);
-
+static void printFlowerStats(Flower *flower) {
     int64_t totalBases = flower_getTotalBaseLength(flower);
     int64_t totalEnds = flower_getEndNumber(flower);
     int64_t totalFreeEnds = flower_getFreeStubEndNumber(flower);
@@ -83,6 +77,28 @@ int main(int argc, char *argv[]) {
 
     printf("flower name: %" PRIi64 " total bases: %" PRIi64 " total-ends: %" PRIi64 " total-caps: %" PRIi64 " max-end-degree: %" PRIi64 " max-adjacency-length: %" PRIi64 " total-blocks: %" PRIi64 " total-groups: %" PRIi64 " total-edges: %" PRIi64 " total-free-ends: %" PRIi64 " total-attached-ends: %" PRIi64 " total-chains: %" PRIi64 " total-link groups: %" PRIi64 "\n",
             flower_getName(flower), totalBases, totalEnds, totalCaps, maxEndDegree, maxAdjacencyLength, totalBlocks, totalGroups, totalEdges/2, totalFreeEnds, totalAttachedEnds, totalChains, totalLinkGroups);
+}
+
+int main(int argc, char *argv[]) {
+    st_setLogLevelFromString(argv[1]);
+    st_logDebug("Set up logging\n");
+
+    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(argv[2]);
+    CactusDisk *cactusDisk = cactusDisk_construct(kvDatabaseConf, 0);
+    stKVDatabaseConf_destruct(kvDatabaseConf);
+    st_logDebug("Set up the flower disk\n");
+
+    if (argc > 3) {
+        Name flowerName = cactusMisc_stringToName(argv[3]);
+        printFlowerStats(cactusDisk_getFlower(cactusDisk, flowerName));
+    } else {
+        stList *flowers = flowerWriter_parseFlowersFromStdin(cactusDisk);
+        st_logDebug("Loaded %" PRIi64 " flowers\n", stList_length(flowers));
+        for (int64_t i = 0; i < stList_length(flowers); i++) {
+            printFlowerStats(stList_get(flowers, i));
+        }
+        stList_destruct(flowers);
+    }
 
     return 0;
 }
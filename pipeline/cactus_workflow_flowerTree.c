@@ -0,0 +1,84 @@
+/*
+ * Copyright (C) 2026 by the cactus contributors
+ *
+ * Released under the MIT license, see LICENSE.txt
+ */
+
+#include "cactus.h"
+#include "sonLib.h"
+
+/*
+ * Walks the whole cactus tree from the root flower, one level at a time, and prints a line
+ * for each nested flower:
+ *
+ * flowerName parentFlowerName totalSequenceSize
+ *
+ * These are the flowers that cactus_workflow_getFlowers returns for each parent (before the
+ * minimum flower size filter), so the recursion targets can get their child flowers from an
+ * index of this output rather than the database.
+ *
+ * Usage: cactus_workflow_flowerTree logLevel cactusDiskString
+ */
+
+#define FLOWERS_LOADED_AT_ONCE 10000
+
+static void addName(stList *flowerNames, Name name) {
+    int64_t *iA = st_malloc(sizeof(int64_t));
+    iA[0] = name;
+    stList_append(flowerNames, iA);
+}
+
+int main(int argc, char *argv[]) {
+    assert(argc == 3);
+    st_setLogLevelFromString(argv[1]);
+    st_logDebug("Set up logging\n");
+
+    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(argv[2]);
+    CactusDisk *cactusDisk = cactusDisk_construct(kvDatabaseConf, 0);
+    stKVDatabaseConf_destruct(kvDatabaseConf);
+    st_logDebug("Set up the flower disk\n");
+
+    stList *flowerNames = stList_construct3(0, free);
+    addName(flowerNames, 0);
+    int64_t level = 0;
+    int64_t totalFlowers = 0;
+    while (stList_length(flowerNames) > 0) {
+        stList *childFlowerNames = stList_construct3(0, free);
+        //Load the flowers of the level in batches, so the memory used is bounded
+        for (int64_t i = 0; i < stList_length(flowerNames); i += FLOWERS_LOADED_AT_ONCE) {
+            stList *batch = stList_construct();
+            for (int64_t j = i; j < stList_length(flowerNames) && j < i + FLOWERS_LOADED_AT_ONCE; j++) {
+                stList_append(batch, stList_get(flowerNames, j));
+            }
+            stList *flowers = cactusDisk_getFlowers(cactusDisk, batch);
+            for (int64_t j = 0; j < stList_length(flowers); j++) {
+                Flower *flower = stList_get(flowers, j);
+                if (!flower_isLeaf(flower)) {
+                    Flower_GroupIterator *groupIterator = flower_getGroupIterator(flower);
+                    Group *group;
+                    while ((group = flower_getNextGroup(groupIterator)) != NULL) {
+                        if (!group_isLeaf(group)) {
+                            fprintf(stdout, "%" PRIi64 " %" PRIi64 " %" PRIi64 "\n", group_getName(group), flower_getName(flower),
+                                    group_getTotalBaseLength(group));
+                            addName(childFlowerNames, group_getName(group));
+                        }
+                    }
+                    flower_destructGroupIterator(groupIterator);
+                }
+                flower_unload(flower);
+            }
+            stList_destruct(flowers);
+            stList_destruct(batch);
+        }
+        st_logInfo("Level %" PRIi64 " of the cactus tree has %" PRIi64 " flowers\n", level, stList_length(flowerNames));
+        totalFlowers += stList_length(flowerNames);
+        stList_destruct(flowerNames);
+        flowerNames = childFlowerNames;
+        level++;
+    }
+    stList_destruct(flowerNames);
+    st_logInfo("The cactus tree has %" PRIi64 " flowers in %" PRIi64 " levels\n", totalFlowers, level);
+
+    cactusDisk_destruct(cactusDisk);
+    return 0;
+}
@@ -50,3 +50,26 @@ void parseArgs(int argc, char *argv[]) {
 
     flowerWriter = flowerWriter_construct(stdout, maxSequenceSizeOfFlowerGrouping, maxSequenceSizeOfSecondaryFlowerGrouping);
 }
+
+void writeChildFlowers(stList *flowers) {
+    /*
+     * Adds the nested flowers of the non-leaf groups of the given flowers to the flower writer.
+     */
+    for (int64_t i = 0; i < stList_length(flowers); i++) {
+        Flower *flower = stList_get(flowers, i);
+        if(!flower_isLeaf(flower)) {
+            assert(flower_builtBlocks(flower)); //This recursion depends on the block structure having been properly defined for all nodes.
+            Flower_GroupIterator *groupIterator = flower_getGroupIterator(flower);
+            Group *group;
+            while ((group = flower_getNextGroup(groupIterator)) != NULL) {
+                if (!group_isLeaf(group)) {
+                    int64_t flowerSize = group_getTotalBaseLength(group);
+                    if(flowerSize >= minFlowerSize) {
+                        flowerWriter_add(flowerWriter, group_getName(group), flowerSize);
+                    }
+                }
+            }
+            flower_destructGroupIterator(groupIterator);
+        }
+    }
+}
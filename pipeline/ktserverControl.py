@@ -22,6 +22,11 @@ intended to be used as follows:
 - After blockUntilKtserverIsRunnning() returns, subsequent proceseses can
   access the server.  Once these are done, the server can be killed
   using killKtServer().
+
+- If runKtserver() was called with waitForExit=False, killKtServer(...,
+  waitForExit=False) returns as soon as the server has written its database
+  and the files are synced and checksummed, rather than waiting for the
+  process to exit.  A detached watcher checks that the process exits.
 """
 
 import os
@@ -32,6 +37,13 @@ import subprocess
 import signal
 import psutil
 import socket
+import httplib
+import time
+import fcntl
+import errno
+import tempfile
+import hashlib
+import json
 from sonLib.bioio import logger
 from time import sleep
 from optparse import OptionParser
@@ -39,6 +51,8 @@ import threading
 import xml.etree.ElementTree as ET
 from cactus.shared.experimentWrapper import DbElemWrapper
 from cactus.shared.experimentWrapper import ExperimentWrapper
+from cactus.preprocessor.cactus_validateFasta import readCachedFastaStats
+from cactus.preprocessor.cactus_validateFasta import getSequenceFiles
 
 ###############################################################################
 # run a server until killSwitchPath gets deleted
@@ -46,16 +60,17 @@ from cactus.shared.experimentWrapper import ExperimentWrapper
 ###############################################################################
 def runKtserver(dbElem, killSwitchPath, maxPortsToTry=100, readOnly = False,
                 createTimeout=30, loadTimeout=10000, killTimeout=518400,
-                killPingInterval=5):
+                killPingInterval=0.5, metricsRecorder=None, waitForExit=True):
     if not os.path.isfile(killSwitchPath):
         raise RuntimeError("Kill switch file not found, can't " +
                            "launch without it %s" % killSwitchPath)
     dbPathExists = False
     if dbElem.getDbInMemory() == False:
-        if os.path.splitext(dbElem.getDbName())[1] == ".kch":
-            raise RuntimeError("Expected path to end in .kch" %
+        if os.path.splitext(dbElem.getDbName())[1] != ".kch":
+            raise RuntimeError("Expected path to end in .kch: %s" %
                                dbElem.getDbName())
-        dbPathExists = os.path.exists(dbPath)
+        dbPathExists = os.path.exists(os.path.join(dbElem.getDbDir(),
+                                                   dbElem.getDbName()))
 
     logPath = __getLogPath(dbElem)
     logDir = os.path.dirname(logPath)
@@ -72,20 +87,25 @@ def runKtserver(dbElem, killSwitchPath, maxPortsToTry=100, readOnly = False,
     success = False
     process = None
     procWaiter = None
+    portRegistry = KtserverPortRegistry()
     try:        
         for port in xrange(basePort, basePort + maxPortsToTry):
+            if not portRegistry.reserve(port, owner=killSwitchPath):
+                continue
             dbElem.setDbPort(port)
             if os.path.exists(logPath):
                 os.remove(logPath)
-            if __isKtServerOnTakenPort(dbElem, killSwitchPath, pretest=True):
-                continue
             cmd = __getKtserverCommand(dbElem, dbPathExists, readOnly)
-            process = subprocess.Popen(cmd.split(), shell=False, 
-                                       stdout=subprocess.PIPE,
-                                       stderr=sys.stderr, bufsize=-1)
-            procWaiter = ProcessWaiter(process)
+            process = portRegistry.launchHoldingLock(
+                port, lambda: subprocess.Popen(cmd.split(), shell=False, 
+                                               stdout=subprocess.PIPE,
+                                               stderr=sys.stderr, bufsize=-1))
+            # the waiter keeps this process alive until the server exits,
+            # unless the exit is left to the watcher
+            procWaiter = ProcessWaiter(process, daemon=not waitForExit)
             procWaiter.start()
-            __writeStatusToSwitchFile(dbElem, process.pid, killSwitchPath)
+            __writeStatusToSwitchFile(dbElem, process.pid, killSwitchPath,
+                                      writesShutdownStatus=not waitForExit)
             success = __validateKtserver(process, dbElem, killSwitchPath,
                                          createTimeout, loadTimeout)
             if success is True:
@@ -94,20 +114,27 @@ def runKtserver(dbElem, killSwitchPath, maxPortsToTry=100, readOnly = False,
                 if process.returncode is None:
                     process.kill()
                 process = None
+                portRegistry.release(port)
 
         if success is False:
             raise RuntimeError("Unable to launch ktserver.  "+
                                "Server log is: %s" % logPath)
         assert process is not None
 
-        for i in xrange(0, killTimeout, killPingInterval):
+        endTime = time.time() + killTimeout
+        while time.time() < endTime:
             if process.returncode is not None:
                 raise RuntimeError("ktserver finished before it could be " +
                                    "killed with the file. " +
                                    "  Server log is: %s" % logPath)
             if not os.path.isfile(killSwitchPath):
                 process.terminate()
-                return True
+                if waitForExit is True:
+                    return True
+                return __finishShutdown(process, dbElem, killSwitchPath,
+                                        loadTimeout)
+            if metricsRecorder is not None:
+                metricsRecorder.sample()
             sleep(killPingInterval)
 
         assert process.returncode is None
@@ -116,10 +143,12 @@ def runKtserver(dbElem, killSwitchPath, maxPortsToTry=100, readOnly = False,
     
     except Exception as e:
         # make an attempt to alert the world of the launch failure by
-        # writing some -1's to the switch file
-        switchFile = open(killSwitchPath, "w")
-        switchFile.write("-1\n-1\n-1\n")
-        switchFile.close()
+        # writing some -1's to the switch file, unless it has been deleted
+        # to kill the server
+        if os.path.isfile(killSwitchPath):
+            switchFile = open(killSwitchPath, "w")
+            switchFile.write("-1\n-1\n-1\n")
+            switchFile.close()
 
         # if we don't kill the spawned process, the waiter thread will keep
         # this process alive which we don't want in the case of an error
@@ -129,45 +158,274 @@ def runKtserver(dbElem, killSwitchPath, maxPortsToTry=100, readOnly = False,
         
         raise e
 
+    finally:
+        # the server inherits the lock on its port, so the port stays
+        # reserved until it has exited
+        portRegistry.releaseAll()
+
 ###############################################################################
-# Check status until it's successful, an error is found, or we timeout
+# The statistics of a server's shutdown are written by runKtserver to a file
+# named after its kill switch file, for killKtServer to read.
 ###############################################################################
-def __validateKtserver(process, dbElem, killSwitchPath,
-                       createTimeout, loadTimeout):
-    success = False
-    for i in xrange(createTimeout):
-        if process.returncode is not None:
+def getShutdownStatusPath(killSwitchPath):
+    return killSwitchPath + ".shutdown"
+
+###############################################################################
+# Once the server has been sent the signal to shut down, wait until it has
+# written its database (the log shows it finished, or it has exited) then
+# sync and checksum the database files, and write their statistics to the
+# shutdown status file.  If the process has yet to exit, a detached watcher
+# is left to check that it does.  If the database isn't written within the
+# timeout the server is killed and the error is written to the status, as is
+# any error syncing or checksumming the files, so the status is always
+# written for killKtServer to read.
+###############################################################################
+def __finishShutdown(process, dbElem, killSwitchPath, shutdownTimeout):
+    logPath = __getLogPath(dbElem)
+    logTailer = KtserverLogTailer(logPath)
+    startTime = time.time()
+    error = None
+    while process.returncode is None:
+        logTailer.update()
+        if logTailer.finished is True:
             break
-        if __isKtServerFailed(dbElem) or __isKtServerOnTakenPort(dbElem,
-                                                                 killSwitchPath):
-            success = False
+        if time.time() - startTime > shutdownTimeout:
+            process.kill()
+            error = ("ktserver did not write its database within %d seconds "
+                     "and was killed.  Server log is: %s" % (shutdownTimeout,
+                                                             logPath))
             break
-        if __isKtServerRunning(dbElem, killSwitchPath):
-            success = True
+        sleep(0.05)
+    if process.returncode is not None and process.returncode != 0:
+        error = ("ktserver exited with code %d during shutdown.  Server log "
+                 "is: %s" % (process.returncode, logPath))
+    writeSeconds = time.time() - startTime
+    files = dict()
+    if error is None:
+        try:
+            for path in __getDurableFiles(dbElem):
+                files[path] = __syncAndChecksum(path)
+        except Exception as e:
+            files = dict()
+            error = ("Unable to sync and checksum the files written by "
+                     "ktserver: %s.  Server log is: %s" % (str(e), logPath))
+    stats = { "host" : dbElem.getDbHost(), "port" : dbElem.getDbPort(),
+              "pid" : process.pid, "error" : error,
+              "seconds" : writeSeconds,
+              "bytes" : sum([ f["bytes"] for f in files.values() ]),
+              "files" : files }
+    if error is None:
+        logger.info("ktserver %s:%d wrote %d bytes to %d files in %.2f "
+                    "seconds" % (stats["host"], stats["port"], stats["bytes"],
+                                 len(files), writeSeconds))
+    else:
+        logger.critical(error)
+    statusPath = getShutdownStatusPath(killSwitchPath)
+    statusFile = open(statusPath + ".tmp", "w")
+    json.dump(stats, statusFile)
+    statusFile.flush()
+    os.fsync(statusFile.fileno())
+    statusFile.close()
+    os.rename(statusPath + ".tmp", statusPath)
+    if process.returncode is None:
+        __launchExitWatcher(process.pid, dbElem, shutdownTimeout)
+    return stats
+
+###############################################################################
+# The files a server leaves behind when it shuts down: the snapshots of a
+# database with snapshots, or the database file itself.  An in-memory
+# database without snapshots leaves nothing.
+###############################################################################
+def __getDurableFiles(dbElem):
+    dbDir = dbElem.getDbDir()
+    if dbElem.getDbSnapshot() == True:
+        return sorted([ os.path.join(dbDir, f) for f in os.listdir(dbDir)
+                        if f.endswith(".ktss") ])
+    if dbElem.getDbInMemory() == False:
+        dbPath = os.path.join(dbDir, dbElem.getDbName())
+        if os.path.isfile(dbPath):
+            return [dbPath]
+    return []
+
+def __syncAndChecksum(path, blockSize=1048576):
+    md5 = hashlib.md5()
+    size = 0
+    dbFile = open(path, "rb")
+    try:
+        os.fsync(dbFile.fileno())
+        block = dbFile.read(blockSize)
+        while len(block) > 0:
+            md5.update(block)
+            size += len(block)
+            block = dbFile.read(blockSize)
+    finally:
+        dbFile.close()
+    return { "bytes" : size, "md5" : md5.hexdigest() }
+
+###############################################################################
+# Check that the process of a server that has been shut down exits, in a
+# process of its own so that the one which ran the server can finish.  The
+# process is killed if it hasn't exited within the timeout.  The outcome is
+# appended to the exit log in the database directory.
+###############################################################################
+def __launchExitWatcher(pid, dbElem, timeout):
+    cmd = [sys.executable, "-m", "cactus.pipeline.ktserverControl",
+           "--watchPid", str(pid), "--watchTimeout", str(timeout),
+           "--watchLog", __getExitLogPath(dbElem)]
+    devNull = open(os.devnull, "r+")
+    subprocess.Popen(cmd, shell=False, stdin=devNull, stdout=devNull,
+                     stderr=devNull, close_fds=True, preexec_fn=os.setsid)
+    devNull.close()
+
+def watchKtserverExit(pid, timeout, exitLogPath, watchInterval=0.5):
+    startTime = time.time()
+    killed = False
+    while __isProcessRunning(pid):
+        if time.time() - startTime > timeout:
+            os.kill(pid, signal.SIGKILL)
+            killed = True
             break
-        if __isKtServerReorganizing(dbElem):
-            raiseTimeout = True
-            for j in xrange(loadTimeout):
-                if __isKtServerReorganizing(dbElem) is False:
-                    raiseTimeout = False
-                    break
-                sleep(1)
-            if raiseTimeout is True:
-                raise RuntimeError("Reorganization wait timeout failed. " +
-                                   "Server log is: %s" % logPath)
-        sleep(1)
-    return success
+        sleep(watchInterval)
+    exitLog = open(exitLogPath, "a")
+    if killed is True:
+        exitLog.write("ktserver pid=%d killed after failing to exit within "
+                      "%d seconds\n" % (pid, timeout))
+    else:
+        exitLog.write("ktserver pid=%d exited within %.2f seconds\n" % (
+            pid, time.time() - startTime))
+    exitLog.close()
+    return not killed
+
+# a zombie has exited, it just hasn't been reaped by its parent yet
+def __isProcessRunning(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    try:
+        for line in open("/proc/%d/status" % pid, "r"):
+            if line.startswith("State:"):
+                return line.split()[1] != "Z"
+    except IOError:
+        pass
+    return True
+
+###############################################################################
+# The servers of a partitioned database (see DbElemWrapper.getDbPartition)
+# each have their own kill switch file, named after that of the set.
+###############################################################################
+def getPartitionKillSwitchPath(killSwitchPath, index):
+    return "%s.partition_%i" % (killSwitchPath, index)
+
+###############################################################################
+# run the servers of a partitioned database until killSwitchPath gets
+# deleted (an unpartitioned database is just run with runKtserver).  each
+# server is run by a thread, as runKtserver runs it.  if any of them fails
+# the others are killed and an exception is thrown (the kill switch file of
+# the failed server is left with the error written to it by runKtserver, so
+# that blocking on it fails too).  metricsRecorder only samples an
+# unpartitioned server.
+###############################################################################
+def runKtserverSet(dbElem, killSwitchPath, maxPortsToTry=100, readOnly = False,
+                   createTimeout=30, loadTimeout=10000, killTimeout=518400,
+                   killPingInterval=0.5, metricsRecorder=None,
+                   waitForExit=True):
+    if dbElem.getDbPartitionNumber() == 1:
+        return runKtserver(dbElem, killSwitchPath, maxPortsToTry, readOnly,
+                           createTimeout, loadTimeout, killTimeout,
+                           killPingInterval, metricsRecorder=metricsRecorder,
+                           waitForExit=waitForExit)
+    if not os.path.isfile(killSwitchPath):
+        raise RuntimeError("Kill switch file not found, can't " +
+                           "launch without it %s" % killSwitchPath)
+    partitions = dbElem.getDbPartitions()
+    partitionKillSwitchPaths = [ getPartitionKillSwitchPath(killSwitchPath, i)
+                                 for i in xrange(len(partitions)) ]
+    errors = {}
+    def launch(index, partition, partitionKillSwitchPath):
+        try:
+            runKtserver(partition, partitionKillSwitchPath, maxPortsToTry,
+                        readOnly, createTimeout, loadTimeout, killTimeout,
+                        killPingInterval, waitForExit=waitForExit)
+        except Exception as e:
+            errors[index] = e
+    threads = []
+    for index, partition, partitionKillSwitchPath in zip(
+        xrange(len(partitions)), partitions, partitionKillSwitchPaths):
+        switchFile = open(partitionKillSwitchPath, "w")
+        switchFile.write("init")
+        switchFile.close()
+        thread = threading.Thread(target=launch, args=(index, partition,
+                                                       partitionKillSwitchPath))
+        thread.start()
+        threads.append(thread)
+    try:
+        endTime = time.time() + killTimeout
+        while time.time() < endTime:
+            if len(errors) > 0:
+                raise RuntimeError("A ktserver of the partitioned database " +
+                                   "failed: %s" % str(errors.values()[0]))
+            if not os.path.isfile(killSwitchPath):
+                return True
+            sleep(killPingInterval)
+        raise RuntimeError("Kill timeout %d reached." % killTimeout)
+    finally:
+        # deleting the kill switch files of the servers kills them
+        for index, partitionKillSwitchPath in enumerate(
+            partitionKillSwitchPaths):
+            if index not in errors and os.path.isfile(partitionKillSwitchPath):
+                os.remove(partitionKillSwitchPath)
+        for thread in threads:
+            thread.join()
+
+###############################################################################
+# Check status until it's successful, an error is found, or we timeout.
+# The log is read incrementally, so checking it often costs little and
+# we find out within pollInterval seconds that the server is ready
+###############################################################################
+def __validateKtserver(process, dbElem, killSwitchPath,
+                       createTimeout, loadTimeout, pollInterval=0.05):
+    logPath = __getLogPath(dbElem)
+    logTailer = KtserverLogTailer(logPath)
+    endTime = time.time() + createTimeout
+    while time.time() < endTime:
+        if process.returncode is not None:
+            return False
+        # the server can only have been killed once it was found running
+        if not os.path.isfile(killSwitchPath):
+            logTailer.update()
+            return logTailer.listening
+        if __isKtServerFailed(dbElem, logTailer) or \
+               __isKtServerOnTakenPort(dbElem, killSwitchPath,
+                                       logTailer=logTailer):
+            return False
+        if __isKtServerRunning(dbElem, killSwitchPath, logTailer):
+            return True
+        if __isKtServerReorganizing(dbElem, logTailer):
+            loadEndTime = time.time() + loadTimeout
+            while __isKtServerReorganizing(dbElem, logTailer):
+                if time.time() > loadEndTime:
+                    raise RuntimeError("Reorganization wait timeout failed. " +
+                                       "Server log is: %s" % logPath)
+                sleep(pollInterval)
+            endTime = max(endTime, time.time() + pollInterval)
+            continue
+        sleep(pollInterval)
+    return False
 
 ###############################################################################
 # We use the kill-switch file to store some vital information about the
 # kterver that's not always obvious to scrape from the log file
 ###############################################################################
-def __writeStatusToSwitchFile(dbElem, serverPid, killSwitchPath):
+def __writeStatusToSwitchFile(dbElem, serverPid, killSwitchPath,
+                              writesShutdownStatus=False):
     try:
         switchFile = open(killSwitchPath, "w")
         switchFile.write("%s\n%d\n%d\n" % (dbElem.getDbHost(), 
                                            int(dbElem.getDbPort()),
                                            int(serverPid)))
+        if writesShutdownStatus is True:
+            switchFile.write("shutdownStatus\n")
         switchFile.close()
         return True
     except:
@@ -218,16 +476,57 @@ def __readStatusFromSwitchFile(dbElem, serverPidAsList, killSwitchPath):
 # information of the server
 ###############################################################################
 def blockUntilKtserverIsRunnning(dbElem, killSwitchPath, timeout=518400,
-                                 timeStep=10):
+                                 timeStep=0.05):
     logPath = __getLogPath(dbElem)
-    for i in xrange(0, timeout, timeStep):
-        if os.path.isfile(logPath) and __isKtServerRunning(dbElem,
-                                                           killSwitchPath):
+    logTailer = KtserverLogTailer(logPath)
+    endTime = time.time() + timeout
+    while time.time() < endTime:
+        if __isKtServerRunning(dbElem, killSwitchPath, logTailer):
             return True
         sleep(timeStep)
-    raise RuntimeError("Timeout reached while waiting for ktserver" %
+    raise RuntimeError("Timeout reached while waiting for ktserver %s" %
                        logPath)
 
+###############################################################################
+# Wait until all the servers of a (possibly partitioned) database are
+# running.  The host and port of each server are recorded in dbElem, and
+# written to its partitions file, from which the cactus disk connects to
+# the servers of a partitioned database.
+###############################################################################
+def blockUntilKtserverSetIsRunning(dbElem, killSwitchPath, timeout=518400,
+                                   timeStep=0.05):
+    if dbElem.getDbPartitionNumber() == 1:
+        blockUntilKtserverIsRunnning(dbElem, killSwitchPath, timeout, timeStep)
+    else:
+        endTime = time.time() + timeout
+        for i, partition in enumerate(dbElem.getDbPartitions()):
+            blockUntilKtserverIsRunnning(partition,
+                                         getPartitionKillSwitchPath(
+                    killSwitchPath, i), max(0, endTime - time.time()),
+                                         timeStep)
+            dbElem.setDbPartition(i, partition)
+    dbElem.writeDbPartitionsFile()
+    return True
+
+###############################################################################
+# Kill all the servers of a (possibly partitioned) database, then delete
+# the kill switch file of the set.  For a partitioned database the list of
+# what killKtServer returned for each server is returned.
+###############################################################################
+def killKtServerSet(dbElem, killSwitchPath, killTimeout=10000,
+                    waitForExit=True):
+    if dbElem.getDbPartitionNumber() == 1:
+        return killKtServer(dbElem, killSwitchPath, killTimeout, waitForExit)
+    if not os.path.isfile(killSwitchPath):
+        raise RuntimeError("Can't kill server because file" +
+                           " not found %s" % killSwitchPath)
+    results = [ killKtServer(partition,
+                             getPartitionKillSwitchPath(killSwitchPath, i),
+                             killTimeout, waitForExit)
+                for i, partition in enumerate(dbElem.getDbPartitions()) ]
+    os.remove(killSwitchPath)
+    return results
+
 ###############################################################################
 # Kill a server by deleting the given kill switch file.  Check that it's
 # no longer running using the timeout.  If it's being saved to disk, it
@@ -235,29 +534,45 @@ def blockUntilKtserverIsRunnning(dbElem, killSwitchPath, timeout=518400,
 # wait.
 # Note that this function will update dbElem with the currnet host/port
 # information of the server
+# If waitForExit is False and the server was run with waitForExit=False,
+# this returns the shutdown statistics written by runKtserver as soon as the
+# database has been written, and the exit is left to runKtserver's watcher.
 ###############################################################################
-def killKtServer(dbElem, killSwitchPath, killTimeout=10000):
+def killKtServer(dbElem, killSwitchPath, killTimeout=10000, waitForExit=True):
     if not os.path.isfile(killSwitchPath):
         raise RuntimeError("Can't kill server because file" +
                            " not found %s" % killSwitchPath)
     logPath = __getLogPath(dbElem)
     isRunning =  __isKtServerRunning(dbElem, killSwitchPath)
+    writesShutdownStatus = __readShutdownStatusFlag(killSwitchPath)
+    statusPath = getShutdownStatusPath(killSwitchPath)
+    if os.path.exists(statusPath):
+        os.remove(statusPath)
     os.remove(killSwitchPath)
     logPath = __getLogPath(dbElem)
     if not isRunning:
         raise RuntimeError("Can't find running server to kill %s" % logPath)
 
+    if waitForExit is False and writesShutdownStatus is True:
+        stats = __waitForShutdownStatus(statusPath, killTimeout)
+        # the log is complete once the database is written, and a stale log
+        # would be read by the next server launched in the directory
+        if os.path.exists(logPath):
+            os.remove(logPath)
+        return stats
+
     success = False
+    probe = KtServerProbe(dbElem, timeout=1.0)
     for i in xrange(killTimeout):
-        try:
-            if pingKtServer(dbElem) or len(__scrapePids([logPath])) > 0:
-                logger.critical("Waiting for ktserver to die, but still running with logPath: %s, pingKtServer returned %s, dB port: %s, __scrapePids returned: %s" % (logPath, pingKtServer(dbElem), dbElem.getDbPort(), __scrapePids([logPath])))
-                sleep(1)
-            else:
-                success = True
-                break
-        except RuntimeError:
-            logger.critical("Got runtime error while trying to kill ktserver, putting it down to bad luck and carrying on")
+        healthy = probe.isHealthy()
+        pids = __scrapePids([logPath])
+        if healthy or len(pids) > 0:
+            logger.critical("Waiting for ktserver to die, but still running with logPath: %s, the probe returned %s, dB port: %s, __scrapePids returned: %s" % (logPath, healthy, dbElem.getDbPort(), pids))
+            sleep(1)
+        else:
+            success = True
+            break
+    probe.close()
     if not success:
         raise RuntimeError("Failed to kill server within timeout. " +
                            "Server log is %s" % logPath)
@@ -265,145 +580,335 @@ def killKtServer(dbElem, killSwitchPath, killTimeout=10000):
         os.remove(logPath)
     return True
 
+def __readShutdownStatusFlag(killSwitchPath):
+    switchFile = open(killSwitchPath, "r")
+    lines = [line.strip() for line in switchFile]
+    switchFile.close()
+    return "shutdownStatus" in lines[3:]
+
+def __waitForShutdownStatus(statusPath, killTimeout, pollInterval=0.1):
+    endTime = time.time() + killTimeout
+    while not os.path.isfile(statusPath):
+        if time.time() > endTime:
+            raise RuntimeError("Server did not write its database within " +
+                               "timeout. Status expected in %s" % statusPath)
+        sleep(pollInterval)
+    statusFile = open(statusPath, "r")
+    stats = json.load(statusFile)
+    statusFile.close()
+    os.remove(statusPath)
+    if stats["error"] is not None:
+        raise RuntimeError(stats["error"])
+    return stats
+
 ###############################################################################
 # Test if a server is running by looking at the log
-# if the log looks okay, verify by pinging the server
+# if the log looks okay, verify by connecting to the server's port
 # note that some information is duplicated across the log and killswitch
 # path.  if there are any inconsistencies we raise an exception.
 # Note that this function will update dbElem with the currnet host/port
 # information of the server
+# A KtserverLogTailer can be given so that repeated checks only read
+# the lines added to the log since the last one
 ###############################################################################
-def __isKtServerRunning(dbElem, killSwitchPath):
-    logPath = __getLogPath(dbElem)
-    success = False
+def __isKtServerRunning(dbElem, killSwitchPath, logTailer=None):
+    if logTailer is None:
+        logTailer = KtserverLogTailer(__getLogPath(dbElem))
+    logTailer.update()
+    if logTailer.listening is False or logTailer.error is True:
+        return False
     serverPidAsList = []
-    serverPidFromLog = None
-    serverPortFromLog = None
-    if os.path.isfile(logPath):
-        try:
-            outFile = open(logPath, "r")
-        except:
-            sleep(1)
-            outFile = open(logPath, "r")
-        for line in outFile.readlines():
-            if line.lower().find("listening") >= 0:
-                success = __readStatusFromSwitchFile(dbElem, serverPidAsList,
-                                                     killSwitchPath)
-            if serverPortFromLog is None and line.find("expr=") >= 0:
-                try:
-                    hostPort = line[line.find("expr="):].split()[0]                    
-                    serverPortFromLog = int(hostPort[hostPort.find(":")+1:])
-                    if serverPortFromLog < 0:
-                        serverPortFromLog = None
-                except:
-                    serverPortFromLog = None
-            if serverPidFromLog is None and line.find("pid=") >=0:
-                try:
-                    pidToken = line[line.find("pid=") + 4:].split()[0]
-                    serverPidFromLog = int(pidToken)
-                except:
-                    serverPidFromLog = None
-            if line.lower().find("error") >= 0:
-                success = False
-                break
-    if success is False:
+    if __readStatusFromSwitchFile(dbElem, serverPidAsList,
+                                  killSwitchPath) is False:
         return False
 
-    if serverPidFromLog != serverPidAsList[0]:
+    if logTailer.pid != serverPidAsList[0]:
         raise RuntimeError("Pid %s != %s (former from %s, lastter %s)" % (
-            str(serverPidFromLog), str(serverPidAsList[0]),
-            logPath, killSwitchPath))
-    if serverPortFromLog != dbElem.getDbPort():
+            str(logTailer.pid), str(serverPidAsList[0]),
+            logTailer.logPath, killSwitchPath))
+    if logTailer.port != dbElem.getDbPort():
         raise RuntimeError("Port %s != %s (former from %s, lastter %s)" % (
-            str(serverPortFromLog), str(dbElem.getDbPort()),
-            logPath, killSwitchPath))
+            str(logTailer.port), str(dbElem.getDbPort()),
+            logTailer.logPath, killSwitchPath))
     
-    return pingKtServer(dbElem)
+    return isKtServerAcceptingConnections(dbElem)
+
+###############################################################################
+# Test if the server's port accepts a TCP connection, which it does as soon
+# as it is ready to answer queries
+###############################################################################
+def isKtServerAcceptingConnections(dbElem, timeout=1.0):
+    try:
+        connection = socket.create_connection((dbElem.getDbHost(),
+                                               dbElem.getDbPort()), timeout)
+        connection.close()
+        return True
+    except socket.error:
+        return False
+
+###############################################################################
+# Reads the lines a ktserver appends to its log, starting from where the
+# last read stopped, and keeps track of what they show about the server.
+# This replaces reading the whole log each time it is checked.
+###############################################################################
+class KtserverLogTailer:
+    def __init__(self, logPath):
+        self.logPath = logPath
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.partialLine = ""
+        self.listening = False
+        self.failed = False # an error before the server was listening
+        self.error = False
+        self.reorganizing = False
+        self.finished = False
+        self.pid = None
+        self.port = None
+
+    # Read any lines added to the log, returns True if there were any
+    def update(self):
+        try:
+            size = os.path.getsize(self.logPath)
+        except OSError:
+            return False
+        if size < self.offset: # the log has been replaced
+            self.reset()
+        if size == self.offset:
+            return False
+        logFile = open(self.logPath, "r")
+        logFile.seek(self.offset)
+        text = self.partialLine + logFile.read()
+        self.offset = logFile.tell()
+        logFile.close()
+        lines = text.split("\n")
+        self.partialLine = lines.pop() # the last line may not be complete
+        for line in lines:
+            self.__parseLine(line)
+        return len(lines) > 0
+
+    def __parseLine(self, line):
+        if line.lower().find("listening") >= 0:
+            self.listening = True
+            self.reorganizing = False
+        if line.lower().find("error") >= 0:
+            self.failed = self.failed or not self.listening
+            self.error = True
+        if (line.lower().find("reorganizing") >= 0 or
+            line.find("applying a snapshot") >= 0) and not self.listening:
+            self.reorganizing = True
+        # logged once the databases have been written and closed
+        if line.find("[FINISH]") >= 0:
+            self.finished = True
+        if self.port is None and line.find("expr=") >= 0:
+            try:
+                hostPort = line[line.find("expr="):].split()[0]
+                self.port = int(hostPort[hostPort.find(":")+1:])
+                if self.port < 0:
+                    self.port = None
+            except:
+                self.port = None
+        if self.pid is None and line.find("pid=") >= 0:
+            try:
+                self.pid = int(line[line.find("pid=") + 4:].split()[0])
+            except:
+                self.pid = None
+
+###############################################################################
+# Checks the health of a ktserver by running the report command of its HTTP
+# RPC interface.  The connection is kept open between checks, so a loop that
+# monitors a server makes one connection rather than one process per check.
+# Every request has a strict timeout, so a server that has stopped answering
+# is reported as unhealthy rather than blocking the caller.
+###############################################################################
+class KtServerProbe:
+    def __init__(self, dbElem, timeout=5.0):
+        self.host = dbElem.getDbHost()
+        self.port = dbElem.getDbPort()
+        self.timeout = timeout
+        self.connection = None
+
+    # Runs an RPC procedure of the server and returns its output as a
+    # dictionary of its fields, or raises a RuntimeError if the server did
+    # not answer
+    def call(self, procedure):
+        for attempt in xrange(2):
+            if self.connection is None:
+                self.connection = httplib.HTTPConnection(self.host, self.port,
+                                                         timeout=self.timeout)
+            try:
+                self.connection.request("GET", "/rpc/%s" % procedure)
+                response = self.connection.getresponse()
+                body = response.read()
+                if response.status != 200:
+                    raise RuntimeError("ktserver %s:%d answered the %s " \
+                                       "with status %d" % (self.host, self.port,
+                                                           procedure,
+                                                           response.status))
+                return dict([ line.split("\t", 1) for line in body.split("\n")
+                              if line.find("\t") >= 0 ])
+            except (socket.error, httplib.HTTPException), e:
+                # the server may have closed a connection that was kept
+                # open too long, so try once more with a new one
+                self.close()
+                error = e
+        raise RuntimeError("ktserver %s:%d did not answer the %s: %s" % (
+            self.host, self.port, procedure, str(error)))
+
+    # Returns the report of the server as a dictionary of its fields
+    def report(self):
+        return self.call("report")
+
+    # Returns the number of records, the size of the databases in bytes and
+    # the number of open connections of the server, or None if it did not
+    # answer
+    def getHealth(self):
+        try:
+            report = self.report()
+        except RuntimeError:
+            return None
+        def getField(name):
+            try:
+                return int(report[name])
+            except (KeyError, ValueError):
+                return None
+        return { "records" : getField("db_total_count"),
+                 "size" : getField("db_total_size"),
+                 "connections" : getField("serv_conn_count") }
+
+    def isHealthy(self):
+        return self.getHealth() is not None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+###############################################################################
+# Samples the report of a running server every interval seconds and appends
+# the number of records, the size of the databases, the number of open
+# connections and the number of operations run so far as a line of the csv
+# file metricsPath, so that the load on the server can be followed during
+# a run.  A sample the server does not answer is skipped.
+###############################################################################
+class KtServerMetricsRecorder:
+    fields = ("time", "port", "records", "size", "connections", "ops")
+    opsFields = ("cnt_get", "cnt_set", "cnt_remove", "cnt_script", "cnt_misc")
+    
+    def __init__(self, dbElem, metricsPath, interval=60.0):
+        self.dbElem = dbElem
+        self.metricsPath = metricsPath
+        self.interval = interval
+        self.probe = None
+        self.samples = []
+        self.lastSampleTime = None
+
+    def sample(self):
+        now = time.time()
+        if self.lastSampleTime is not None and \
+                now - self.lastSampleTime < self.interval:
+            return False
+        self.lastSampleTime = now
+        if self.probe is None:
+            self.probe = KtServerProbe(self.dbElem)
+        try:
+            report = self.probe.report()
+        except RuntimeError:
+            return False
+        def getField(name):
+            try:
+                return int(report[name])
+            except (KeyError, ValueError):
+                return 0
+        sample = (now, self.dbElem.getDbPort(), getField("db_total_count"),
+                  getField("db_total_size"), getField("serv_conn_count"),
+                  sum([ getField(name) for name in self.opsFields ]))
+        self.samples.append(sample)
+        writeHeader = not os.path.isfile(self.metricsPath)
+        metricsFile = open(self.metricsPath, "a")
+        if writeHeader:
+            metricsFile.write("%s\n" % ",".join(self.fields))
+        metricsFile.write("%.1f,%d,%d,%d,%d,%d\n" % sample)
+        metricsFile.close()
+        return True
+
+    # Returns the peak size, peak number of connections and mean number of
+    # operations per second of the samples, or None if there are none
+    def getSummary(self):
+        if len(self.samples) == 0:
+            return None
+        first, last = self.samples[0], self.samples[-1]
+        meanOpsPerSecond = 0.0
+        if last[0] > first[0]:
+            meanOpsPerSecond = (last[5] - first[5]) / (last[0] - first[0])
+        return { "samples" : len(self.samples),
+                 "peakSize" : max([ sample[3] for sample in self.samples ]),
+                 "peakConnections" : max([ sample[4] for sample in 
+                                           self.samples ]),
+                 "meanOpsPerSecond" : meanOpsPerSecond }
+
+    def close(self):
+        if self.probe is not None:
+            self.probe.close()
+            self.probe = None
 
 ###############################################################################
 # Query a running server
 ###############################################################################
-def pingKtServer(dbElem):
-    canPing = subprocess.call(['ping', '-c', '1', dbElem.getDbHost()],
-                              shell=False, bufsize=-1,
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE)
-    if canPing != 0:
-        raise RuntimeError("Unable to ping ktserver host %s from %s" % (
-            dbElem.getDbHost(), __getHostName()))
+def pingKtServer(dbElem, timeout=5.0):
+    probe = KtServerProbe(dbElem, timeout)
+    healthy = probe.isHealthy()
+    probe.close()
+    return healthy
 
-    return subprocess.call(['ktremotemgr', 'report',
-                            '-port', str(dbElem.getDbPort()),
-                            '-host', dbElem.getDbHost()],
-                           shell=False, bufsize=-1,
-                           stdout=subprocess.PIPE,
-                           stderr=subprocess.PIPE) == 0
+###############################################################################
+# Remove all the records of a running server, so that it can be reused
+# for a new database
+###############################################################################
+def clearKtServer(dbElem, timeout=60.0):
+    probe = KtServerProbe(dbElem, timeout)
+    probe.call("clear")
+    probe.close()
 
 ###############################################################################
 # Get a report on a running server
 ###############################################################################
 def getKtServerReport(dbElem):
-    assert pingKtServer(dbElem) is True
-    process = subprocess.Popen(['ktremotemgr', 'report',
-                                '-port', str(dbElem.getDbPort()),
-                                '-host', dbElem.getDbHost()],
-                               shell=False, bufsize=-1,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-    report, nothing = process.communicate()
-
-    process = subprocess.Popen(['ls', '-lh',
-                                dbElem.getDbDir()],
-                               shell=False, bufsize=-1,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-    dirList, nothing = process.communicate()
+    probe = KtServerProbe(dbElem)
+    report = probe.report()
+    probe.close()
+    dirList = []
+    dbDir = dbElem.getDbDir()
+    if dbDir is not None and os.path.isdir(dbDir):
+        for fileName in sorted(os.listdir(dbDir)):
+            filePath = os.path.join(dbDir, fileName)
+            if os.path.isfile(filePath):
+                dirList.append("%s %d" % (fileName, os.path.getsize(filePath)))
 
     return "Report for %s:%d:\n%s\nContents of %s:\n%s\n" % (
-        dbElem.getDbHost(), dbElem.getDbPort(), report,
-        dbElem.getDbDir(), dirList)
+        dbElem.getDbHost(), dbElem.getDbPort(),
+        "\n".join([ "%s: %s" % (key, report[key]) for key in sorted(report.keys()) ]),
+        dbDir, "\n".join(dirList))
     
 ###############################################################################
 # Test if the server is reorganizing.  don't know what this means
 # except that it can really add to the opening time
 ###############################################################################
-def __isKtServerReorganizing(dbElem):
-    logPath = __getLogPath(dbElem)
-    success = False
-    if os.path.exists(logPath):                    
-        outFile = open(logPath, "r")
-        for line in outFile.readlines():
-            if line.lower().find("listening") >= 0:
-                success = False
-                break
-            if line.lower().find("error") >= 0:
-                success = False
-                break
-            if line.lower().find("reorganizing") >= 0 or\
-                   line.find("applying a snapshot") >= 0:
-                success = True
-    return success
+def __isKtServerReorganizing(dbElem, logTailer=None):
+    if logTailer is None:
+        logTailer = KtserverLogTailer(__getLogPath(dbElem))
+    logTailer.update()
+    return logTailer.reorganizing and not logTailer.error
 
 ###############################################################################
-# Test if the server log has an error.
+# Test if the server log has an error (before the server started listening).
 ###############################################################################
-def __isKtServerFailed(dbElem):
-    logPath = __getLogPath(dbElem)
-    isFailed = False
-    if os.path.exists(logPath):                    
-        outFile = open(logPath, "r")
-        for line in outFile.readlines():
-            if line.lower().find("listening") >= 0:
-                isFailed = False
-                break
-            if line.lower().find("error") >= 0:
-                isFailed = True
-                break
-            if line.lower().find("reorganizing") >= 0 or\
-                   line.find("applying a snapshot") >= 0:
-                isFailed = False
-                break
-    return isFailed
+def __isKtServerFailed(dbElem, logTailer=None):
+    if logTailer is None:
+        logTailer = KtserverLogTailer(__getLogPath(dbElem))
+    logTailer.update()
+    return logTailer.failed
 
 ###############################################################################
 # Check if a server has the same port as another server.  The only way to
@@ -411,9 +916,10 @@ def __isKtServerFailed(dbElem):
 # Ktserver can sometimes catch these errors, but often doesn't.  Once you
 # have two servers on the same port running all bets are off.
 ###############################################################################
-def __isKtServerOnTakenPort(dbElem, killSwitchPath, pretest = False):
-    if __isKtServerReorganizing(dbElem) or __isKtServerRunning(dbElem,
-                                                               killSwitchPath):
+def __isKtServerOnTakenPort(dbElem, killSwitchPath, pretest = False,
+                            logTailer = None):
+    if __isKtServerReorganizing(dbElem, logTailer) or \
+           __isKtServerRunning(dbElem, killSwitchPath, logTailer):
         logPath = __getLogPath(dbElem)
         pidList = __scrapePids([logPath])
         if pretest is False:
@@ -434,18 +940,20 @@ def __isKtServerOnTakenPort(dbElem, killSwitchPath, pretest = False):
 def __getLogPath(dbElem):
     return os.path.join(dbElem.getDbDir(), "ktout.log")
 
+def __getExitLogPath(dbElem):
+    return os.path.join(dbElem.getDbDir(), "ktexit.log")
+
 ###############################################################################
 # Get the database tuning options.  They can be different depending
 # one whether or not we are creating a new database
 ###############################################################################
 def __getKtTuningOptions(dbElem, exists = False, readOnly = False):
-    # these are some hardcoded defaults.  should think about moving to config
+    # these are some hardcoded defaults, used if the options were not
+    # set from the workload (see setKtTuningOptionsForWorkload)
     createTuningOptions = "#opts=ls#bnum=30m#msiz=50g#ktopts=p"
     readTuningOptions = "#opts=ls#ktopts=p"
     # override default ktserver settings if they are present in the
     # epxeriment xml file. 
-    if dbElem.getDbServerOptions() is not None:
-        serverOptions = dbElem.getDbServerOptions()
     if dbElem.getDbTuningOptions() is not None:
         createTuningOptions = dbElem.getDbTuningOptions()
         readTuningOptions = dbElem.getDbTuningOptions()
@@ -455,7 +963,78 @@ def __getKtTuningOptions(dbElem, exists = False, readOnly = False):
         readTuningOptions = dbElem.getDbReadTuningOptions()
     tuning = createTuningOptions
     if exists or readOnly:
-        tuning = self.readTuningOptions
+        tuning = readTuningOptions
+    return tuning
+
+###############################################################################
+# Estimate the size of the cactus database of an alignment from its input
+# sequences, as (total bases, number of genomes, number of sequences).  The
+# stats cached next to each sequence by the preprocessor are used where they
+# are up to date, otherwise the size of the sequence files (so that no
+# sequence is read).
+###############################################################################
+def getKtWorkload(sequencePaths):
+    totalBases = 0
+    totalSequences = 0
+    for sequencePath in sequencePaths:
+        stats = readCachedFastaStats(sequencePath)
+        if stats is not None:
+            totalBases += stats["totalLength"]
+            totalSequences += stats["totalSequences"]
+        else:
+            sequenceFiles = getSequenceFiles(sequencePath)
+            totalBases += sum([ os.path.getsize(sequenceFile) for 
+                                sequenceFile in sequenceFiles ])
+            totalSequences += len(sequenceFiles)
+    return totalBases, len(sequencePaths), totalSequences
+
+# Each flower covers about this many aligned columns, each of which has a
+# base in (roughly) every genome
+ktBasesPerFlowerPerGenome = 50
+# The database takes about this many bytes per input base, for the sequence
+# itself and the caps, segments and flowers that align it
+ktBytesPerBase = 10
+# The memory map is no bigger than the old fixed size, in 1024^3 bytes
+ktMaxMsiz = 50
+
+###############################################################################
+# Create tuning options for the workload.  Kyoto Cabinet wants a hash bucket
+# for every one or two records, and a memory map the size of the database.
+# An in memory database is a scratch (secondary) database, which has a
+# record or so for each flower, and has no memory map.
+###############################################################################
+def getKtTuningOptionsForWorkload(totalBases, genomeNumber, totalSequences,
+                                  inMemory=False):
+    expectedFlowers = totalBases / (max(1, genomeNumber) * 
+                                    ktBasesPerFlowerPerGenome)
+    if inMemory:
+        bnum = max(1, int(math.ceil(2.0 * expectedFlowers / 1024**2)))
+        return "#bnum=%dm" % bnum
+    expectedRecords = expectedFlowers + totalSequences
+    # in units of 1024^2 buckets and 1024^3 bytes, as ktserver reads them
+    bnum = max(1, int(math.ceil(2.0 * expectedRecords / 1024**2)))
+    msiz = max(1, int(math.ceil(float(totalBases) * ktBytesPerBase / 1024**3)))
+    msiz = min(msiz, ktMaxMsiz)
+    return "#opts=ls#bnum=%dm#msiz=%dg#ktopts=p" % (bnum, msiz)
+
+###############################################################################
+# Set the create tuning options of the database from the workload, unless
+# they are already set in the database element.  Returns the options set, or
+# None if they were already set.
+###############################################################################
+def setKtTuningOptionsForWorkload(dbElem, sequencePaths):
+    if dbElem.getDbTuningOptions() is not None or \
+            dbElem.getDbCreateTuningOptions() is not None:
+        return None
+    totalBases, genomeNumber, totalSequences = getKtWorkload(sequencePaths)
+    tuning = getKtTuningOptionsForWorkload(totalBases, genomeNumber,
+                                           totalSequences,
+                                           dbElem.getDbInMemory())
+    logger.info("Setting the tuning options of the ktserver of %s to %s "
+                "for %d bases in %d sequences of %d genomes" % (
+            dbElem.getDbDir(), tuning, totalBases, totalSequences,
+            genomeNumber))
+    dbElem.setDbCreateTuningOptions(tuning)
     return tuning
 
 ###############################################################################
@@ -468,6 +1047,11 @@ def __getKtServerOptions(dbElem):
         serverOptions = dbElem.getDbServerOptions()
     return serverOptions
 
+# The names of the kinds of in memory database of Kyoto Cabinet, which an in
+# memory database element can be given (by default it is a prototype hash
+# database, ":")
+ktInMemoryDbNames = ("-", "+", ":", "*", "%")
+
 ###############################################################################
 # Construct the ktserver command line from the xml database element.
 ###############################################################################
@@ -485,21 +1069,144 @@ def __getKtserverCommand(dbElem, exists = False, readOnly = False):
         cmd += " -bgs %s -bgsi 100000000" % dbElem.getDbDir()
     if dbElem.getDbInMemory() == False:
         cmd += " %s" % os.path.join(dbElem.getDbDir(), dbElem.getDbName())
+    elif dbElem.getDbName() in ktInMemoryDbNames:
+        cmd += " %s" % dbElem.getDbName()
     else:
         cmd += " :"
     cmd += tuning
     return cmd
 
+###############################################################################
+# A registry of the ports reserved for ktservers on this host, so that
+# servers launched at the same time get different ports without scanning
+# the processes of the host.  There is a lock file for each port in a
+# directory on a local disk, and a port is reserved by holding an exclusive
+# flock() on its file.  The kernel drops the lock when its holder (the
+# launching process and the server, which inherits it) exits, so the
+# reservation of a process that died is reclaimed without any cleanup.  A
+# port is only reserved if it can also be bound, as it may be in use by a
+# process that does not use the registry.  The file records the owner of
+# the reservation, for debugging.  The lock files are closed on exec, so
+# that a server only inherits the lock of its own port and not those that
+# the threads launching its siblings (see runKtserverSet) hold meanwhile.
+###############################################################################
+class KtserverPortRegistry:
+    # Serializes opening the lock files and launching the servers in this
+    # process, so no server is forked while a lock file is still inheritable
+    inheritanceLock = threading.Lock()
+
+    def __init__(self, registryDir=None):
+        if registryDir is None:
+            registryDir = os.path.join(tempfile.gettempdir(),
+                                       "cactus_ktserver_ports")
+        self.registryDir = registryDir
+        if not os.path.isdir(registryDir):
+            try:
+                os.makedirs(registryDir)
+                os.chmod(registryDir, 01777) # shared by all users
+            except OSError:
+                # made by another process
+                pass
+        self.lockFiles = dict()
+
+    def __getLockPath(self, port):
+        return os.path.join(self.registryDir, "%d.lock" % port)
+
+    # Reserve the port for the owner (a string), returns False if it is
+    # reserved by another process or can't be bound
+    def reserve(self, port, owner):
+        assert port not in self.lockFiles
+        try:
+            with self.inheritanceLock:
+                lockFile = os.fdopen(os.open(self.__getLockPath(port),
+                                             os.O_RDWR | os.O_CREAT, 0666), "r+")
+                setCloseOnExec(lockFile.fileno(), True)
+        except OSError:
+            # the lock file of another user we can't open
+            return False
+        try:
+            fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            lockFile.close()
+            if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
+                return False
+            raise
+        if not isPortFree(port):
+            lockFile.close()
+            return False
+        previousOwner = lockFile.read().strip()
+        if previousOwner != "":
+            logger.info("Reclaimed the stale reservation of port %d (%s)" % (
+                port, previousOwner))
+        lockFile.seek(0)
+        lockFile.truncate()
+        lockFile.write("%s %d %s %f\n" % (socket.gethostname(), os.getpid(), owner,
+                                          time.time()))
+        lockFile.flush()
+        self.lockFiles[port] = lockFile
+        return True
+
+    # Release a port reserved by this registry.  The lock file is left, so
+    # that a process waiting to lock it does not lock a removed file
+    def release(self, port):
+        lockFile = self.lockFiles.pop(port)
+        lockFile.seek(0)
+        lockFile.truncate()
+        lockFile.close()
+
+    # Run launch(), which starts the server of a reserved port, so that the
+    # server inherits the lock of that port, and only that lock
+    def launchHoldingLock(self, port, launch):
+        fd = self.lockFiles[port].fileno()
+        with self.inheritanceLock:
+            setCloseOnExec(fd, False)
+            try:
+                return launch()
+            finally:
+                setCloseOnExec(fd, True)
+
+    # Stop holding the reservations of this process.  The ports of
+    # servers that are running stay reserved, as they hold the locks too.
+    def releaseAll(self):
+        for lockFile in self.lockFiles.values():
+            lockFile.close()
+        self.lockFiles = dict()
+
+###############################################################################
+# Set or clear the close-on-exec flag of a file descriptor
+###############################################################################
+def setCloseOnExec(fd, closeOnExec):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    if closeOnExec:
+        flags |= fcntl.FD_CLOEXEC
+    else:
+        flags &= ~fcntl.FD_CLOEXEC
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags)
+
+###############################################################################
+# Test if a port can be bound on this host
+###############################################################################
+def isPortFree(port):
+    testSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    testSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        testSocket.bind(("", port))
+        return True
+    except socket.error:
+        return False
+    finally:
+        testSocket.close()
+
 ###############################################################################
 # By having a (non-daemon)thread waiting on the ktserver process at all times,
 # we hope to guarantee that the server proc gets aborted if
 # anything happens in the parent
 ###############################################################################
 class ProcessWaiter(threading.Thread):
-    def __init__(self, process):
+    def __init__(self, process, daemon=False):
         threading.Thread.__init__(self)
         self.__process = process
-        self.daemon = False
+        self.daemon = daemon
     def run (self):
         self.__process.wait()
 
@@ -544,8 +1251,23 @@ def main():
         usage = "usage: %prog <dbElem file> <killFile>"
         description = "Open ktserver of a given dbElem until <killFile> erased"
         parser = OptionParser(usage=usage, description=description)
+        parser.add_option("--watchPid", dest="watchPid", type="int",
+                          default=None, help="Instead, wait for the ktserver "
+                          "process with this pid to exit after it has been "
+                          "shut down, killing it after --watchTimeout seconds")
+        parser.add_option("--watchTimeout", dest="watchTimeout", type="float",
+                          default=10000)
+        parser.add_option("--watchLog", dest="watchLog", default=None,
+                          help="File the outcome of --watchPid is appended to")
         
         options, args = parser.parse_args()
+
+        if options.watchPid is not None:
+            if options.watchLog is None:
+                raise RuntimeError("--watchLog is needed with --watchPid")
+            watchKtserverExit(options.watchPid, options.watchTimeout,
+                              options.watchLog)
+            return 0
         
         if len(args) != 2:
             parser.print_help()
@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+
+#Copyright (C) 2026 by the cactus contributors
+#
+#Released under the MIT license, see LICENSE.txt
+
+"""Tests the functions that wait for a ktserver, using a stand-in server that
+writes the lines a ktserver writes to its log and accepts connections, so that
+ktserver need not be installed.
+"""
+
+import unittest
+import os
+import sys
+import time
+import socket
+import threading
+import random
+import signal
+import hashlib
+import subprocess
+import xml.etree.ElementTree as ET
+from sonLib.bioio import getTempDirectory
+from sonLib.bioio import system
+
+from cactus.shared.experimentWrapper import DbElemWrapper
+from cactus.pipeline.ktserverControl import blockUntilKtserverIsRunnning
+from cactus.pipeline.ktserverControl import isKtServerAcceptingConnections
+from cactus.pipeline.ktserverControl import KtserverLogTailer
+from cactus.pipeline.ktserverControl import KtServerProbe
+from cactus.pipeline.ktserverControl import pingKtServer
+from cactus.pipeline.ktserverControl import getKtServerReport
+from cactus.pipeline.ktserverControl import clearKtServer
+from cactus.pipeline.ktserverControl import KtServerMetricsRecorder
+from cactus.pipeline.ktserverControl import getKtTuningOptionsForWorkload
+from cactus.pipeline.ktserverControl import setKtTuningOptionsForWorkload
+from cactus.pipeline.ktserverControl import KtserverPortRegistry
+from cactus.pipeline.ktserverControl import isPortFree
+from cactus.pipeline.ktserverControl import watchKtserverExit
+from cactus.pipeline.ktserverControl import runKtserver
+from cactus.pipeline.ktserverControl import killKtServer
+from cactus.pipeline.ktserverControl import getShutdownStatusPath
+from cactus.pipeline.ktserverControl import runKtserverSet
+from cactus.pipeline.ktserverControl import blockUntilKtserverSetIsRunning
+from cactus.pipeline.ktserverControl import killKtServerSet
+
+class StandInKtserver(threading.Thread):
+    """After startDelay seconds writes the startup lines of a ktserver to the log of
+    the dbElem, starts listening on its port and notes the time it became ready.
+    Answers /rpc/report and /rpc/clear requests over kept-alive HTTP connections (or,
+    if silent, accepts connections but never answers) until stop() is called.
+    The port is chosen by the system unless one is given, and the kill switch file is
+    only written if a path is given.
+    """
+    def __init__(self, dbElem, killSwitchPath, startDelay, silent=False, port=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.startDelay = startDelay
+        self.silent = silent
+        self.connectionNumber = 0
+        self.requestNumber = 0
+        self.recordNumber = 100
+        self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.serverSocket.bind(("localhost", port))
+        self.port = self.serverSocket.getsockname()[1]
+        dbElem.setDbHost("localhost")
+        dbElem.setDbPort(self.port)
+        self.logPath = os.path.join(dbElem.getDbDir(), "ktout.log")
+        if killSwitchPath is not None:
+            switchFile = open(killSwitchPath, "w")
+            switchFile.write("localhost\n%d\n%d\n" % (self.port, os.getpid()))
+            switchFile.close()
+        self.readyTime = None
+        self.stopped = False
+
+    def run(self):
+        time.sleep(self.startDelay)
+        logFile = open(self.logPath, "a")
+        logFile.write("2014-01-01T00:00:00: [SYSTEM]: ================ [START]: pid=%d\n" % os.getpid())
+        logFile.write("2014-01-01T00:00:00: [SYSTEM]: opening a database: path=:\n")
+        logFile.write("2014-01-01T00:00:00: [SYSTEM]: starting the server: expr=localhost:%d\n" % self.port)
+        logFile.flush()
+        self.serverSocket.listen(64)
+        logFile.write("2014-01-01T00:00:00: [SYSTEM]: server socket opened: expr=localhost:%d timeout=200000.0\n" % self.port)
+        logFile.write("2014-01-01T00:00:00: [SYSTEM]: listening server socket started: fd=3\n")
+        logFile.close()
+        self.readyTime = time.time()
+        self.serverSocket.settimeout(0.1)
+        while not self.stopped:
+            try:
+                connection, address = self.serverSocket.accept()
+            except socket.timeout:
+                continue
+            self.connectionNumber += 1
+            thread = threading.Thread(target=self.serve, args=(connection,))
+            thread.daemon = True
+            thread.start()
+        self.serverSocket.close()
+
+    def serve(self, connection):
+        connection.settimeout(0.1)
+        data = ""
+        while not self.stopped:
+            if data.find("\r\n\r\n") < 0 or self.silent:
+                try:
+                    newData = connection.recv(4096)
+                except socket.timeout:
+                    continue
+                if newData == "":
+                    break
+                data += newData
+                continue
+            request, data = data.split("\r\n\r\n", 1)
+            self.requestNumber += 1
+            if request.startswith("GET /rpc/clear"):
+                self.recordNumber = 0
+                body = ""
+            else:
+                body = "db_total_count\t%d\ndb_total_size\t%d\nserv_conn_count\t%d\nserv_thread_count\t64\ncnt_get\t%d\n" % \
+                    (self.recordNumber, 64 * self.recordNumber, self.connectionNumber, self.requestNumber)
+            connection.sendall("HTTP/1.1 200 OK\r\nContent-Type: text/tab-separated-values\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+        connection.close()
+
+    def stop(self):
+        self.stopped = True
+        self.join()
+
+def runStandInKtserver(args):
+    """Runs a StandInKtserver with the arguments runKtserver gives the ktserver command.
+    When terminated it writes a snapshot to the -bgs directory, if given, and ends the
+    log with the [FINISH] line, as ktserver does.
+    """
+    logPath = args[args.index("-log") + 1]
+    dbElem = DbElemWrapper(ET.fromstring("<st_kv_database_conf type=\"kyoto_tycoon\"><kyoto_tycoon database_dir=\"%s\"/></st_kv_database_conf>" % os.path.dirname(logPath)))
+    server = StandInKtserver(dbElem, None, startDelay=0.0, port=int(args[args.index("-port") + 1]))
+    terminated = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: terminated.append(signum))
+    server.start()
+    while len(terminated) == 0:
+        time.sleep(0.05)
+    server.stop()
+    if "-bgs" in args:
+        open(os.path.join(args[args.index("-bgs") + 1], "00000001.ktss"), "w").write("ACGT" * 10000)
+    open(logPath, "a").write("2014-01-01T00:00:00: [SYSTEM]: ================ [FINISH]: pid=%d\n" % os.getpid())
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempDir = getTempDirectory(os.getcwd())
+        self.dbElem = DbElemWrapper(ET.fromstring("<st_kv_database_conf type=\"kyoto_tycoon\"><kyoto_tycoon host=\"localhost\" port=\"1978\" database_dir=\"%s\"/></st_kv_database_conf>" % self.tempDir))
+        self.killSwitchPath = os.path.join(self.tempDir, "kill.txt")
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        system("rm -rf %s" % self.tempDir)
+
+    def testKtserverLogTailer(self):
+        logPath = os.path.join(self.tempDir, "ktout.log")
+        logTailer = KtserverLogTailer(logPath)
+        self.assertFalse(logTailer.update())
+        logFile = open(logPath, "w")
+        logFile.write("[SYSTEM]: ================ [START]: pid=12\n[SYSTEM]: starting the server: expr=host:1979\n[SYSTEM]: listen")
+        logFile.flush()
+        self.assertTrue(logTailer.update())
+        self.assertEquals((12, 1979, False), (logTailer.pid, logTailer.port, logTailer.listening))
+        self.assertFalse(logTailer.update())
+        logFile.write("ing server socket started: fd=3\n")
+        logFile.close()
+        self.assertTrue(logTailer.update())
+        self.assertTrue(logTailer.listening)
+        self.assertFalse(logTailer.failed)
+        self.assertFalse(logTailer.finished)
+        open(logPath, "a").write("[SYSTEM]: ================ [FINISH]: pid=12\n")
+        self.assertTrue(logTailer.update())
+        self.assertTrue(logTailer.finished)
+        #A replaced log is read from the start
+        open(logPath, "w").write("[SYSTEM]: an error\n")
+        self.assertTrue(logTailer.update())
+        self.assertEquals((None, False, True), (logTailer.pid, logTailer.listening, logTailer.failed))
+
+    def testBlockUntilKtserverIsRunning(self):
+        """Measures the time from the stand-in server being ready to the waiting function
+        returning, for a server with an empty log and one that has already written a lot.
+        """
+        for previousLogLines in (0, 100000):
+            logFile = open(os.path.join(self.tempDir, "ktout.log"), "w")
+            for i in xrange(previousLogLines):
+                logFile.write("2014-01-01T00:00:00: [DEBUG]: a line written before the server was restarted\n")
+            logFile.close()
+            server = StandInKtserver(self.dbElem, self.killSwitchPath, startDelay=1.0)
+            self.assertFalse(isKtServerAcceptingConnections(self.dbElem))
+            server.start()
+            startTime = time.time()
+            self.assertTrue(blockUntilKtserverIsRunnning(self.dbElem, self.killSwitchPath, timeout=60))
+            endTime = time.time()
+            self.assertTrue(isKtServerAcceptingConnections(self.dbElem))
+            server.stop()
+            print "With %i lines already in the log, the stand-in server was ready %s seconds after the wait started and the wait ended %s seconds after that" % \
+                (previousLogLines, server.readyTime - startTime, endTime - server.readyTime)
+            self.assertTrue(endTime - server.readyTime < 0.5)
+
+    def testKtServerProbe(self):
+        server = StandInKtserver(self.dbElem, self.killSwitchPath, startDelay=0.0)
+        server.start()
+        blockUntilKtserverIsRunnning(self.dbElem, self.killSwitchPath, timeout=60)
+        probe = KtServerProbe(self.dbElem, timeout=1.0)
+        health = probe.getHealth()
+        self.assertEquals({ "records":100, "size":6400, "connections":server.connectionNumber }, health)
+        #The later checks share the connection
+        for i in xrange(9):
+            self.assertEquals(health, probe.getHealth())
+        self.assertEquals(health["connections"], server.connectionNumber)
+        self.assertEquals(10, server.requestNumber)
+        self.assertTrue(pingKtServer(self.dbElem))
+        self.assertTrue(getKtServerReport(self.dbElem).find("db_total_count: 100") >= 0)
+        server.stop()
+        self.assertEquals(None, probe.getHealth())
+        self.assertFalse(pingKtServer(self.dbElem))
+        probe.close()
+
+    def testClearKtServer(self):
+        server = StandInKtserver(self.dbElem, self.killSwitchPath, startDelay=0.0)
+        server.start()
+        blockUntilKtserverIsRunnning(self.dbElem, self.killSwitchPath, timeout=60)
+        self.assertEquals(100, KtServerProbe(self.dbElem).getHealth()["records"])
+        clearKtServer(self.dbElem)
+        self.assertEquals(0, KtServerProbe(self.dbElem).getHealth()["records"])
+        server.stop()
+        self.assertRaises(RuntimeError, clearKtServer, self.dbElem, 1.0)
+
+    def testKtServerMetricsRecorder(self):
+        server = StandInKtserver(self.dbElem, self.killSwitchPath, startDelay=0.0)
+        server.start()
+        blockUntilKtserverIsRunnning(self.dbElem, self.killSwitchPath, timeout=60)
+        metricsPath = os.path.join(self.tempDir, "metrics.csv")
+        recorder = KtServerMetricsRecorder(self.dbElem, metricsPath, interval=0.2)
+        self.assertEquals(None, recorder.getSummary())
+        self.assertTrue(recorder.sample())
+        #Samples are only taken every interval seconds
+        self.assertFalse(recorder.sample())
+        time.sleep(0.3)
+        self.assertTrue(recorder.sample())
+        connectionNumber = server.connectionNumber
+        server.stop()
+        time.sleep(0.3)
+        self.assertFalse(recorder.sample())
+        recorder.close()
+        lines = open(metricsPath).read().split("\n")
+        self.assertEquals(["time,port,records,size,connections,ops", ""], [lines[0], lines[-1]])
+        self.assertEquals([ [ str(self.dbElem.getDbPort()), "100", "6400", str(connectionNumber), str(i + 1) ] for i in xrange(2) ],
+                          [ line.split(",")[1:] for line in lines[1:-1] ])
+        summary = recorder.getSummary()
+        self.assertEquals((2, 6400, connectionNumber), (summary["samples"], summary["peakSize"], summary["peakConnections"]))
+        self.assertTrue(summary["meanOpsPerSecond"] > 0 and summary["meanOpsPerSecond"] < 1 / 0.2)
+
+    def testKtServerProbeTimeout(self):
+        server = StandInKtserver(self.dbElem, self.killSwitchPath, startDelay=0.0, silent=True)
+        server.start()
+        blockUntilKtserverIsRunnning(self.dbElem, self.killSwitchPath, timeout=60)
+        startTime = time.time()
+        self.assertFalse(pingKtServer(self.dbElem, timeout=0.5))
+        self.assertTrue(time.time() - startTime < 5)
+        server.stop()
+
+    def testKtTuningOptionsForWorkload(self):
+        self.assertEquals("#opts=ls#bnum=1m#msiz=1g#ktopts=p", getKtTuningOptionsForWorkload(1000000, 2, 10))
+        self.assertEquals("#opts=ls#bnum=115m#msiz=28g#ktopts=p", getKtTuningOptionsForWorkload(3000000000, 1, 100000))
+        #10 mammalian genomes
+        self.assertEquals("#opts=ls#bnum=115m#msiz=50g#ktopts=p", getKtTuningOptionsForWorkload(30000000000, 10, 100000))
+        sequencePath = os.path.join(self.tempDir, "seq.fa")
+        open(sequencePath, "w").write(">a\n%s\n" % ("ACGT" * 1000))
+        self.assertEquals("#opts=ls#bnum=1m#msiz=1g#ktopts=p", setKtTuningOptionsForWorkload(self.dbElem, [ sequencePath ]))
+        self.assertEquals("#opts=ls#bnum=1m#msiz=1g#ktopts=p", self.dbElem.getDbCreateTuningOptions())
+        #An in memory (scratch) database is sized from the flowers alone
+        self.assertEquals("#bnum=115m", getKtTuningOptionsForWorkload(3000000000, 1, 100000, inMemory=True))
+        #Options set in the database element are kept
+        self.dbElem.setDbCreateTuningOptions("#opts=ls#bnum=7m")
+        self.assertEquals(None, setKtTuningOptionsForWorkload(self.dbElem, [ sequencePath ]))
+        self.assertEquals("#opts=ls#bnum=7m", self.dbElem.getDbCreateTuningOptions())
+
+    def testKtserverPortRegistry(self):
+        registryDir = os.path.join(self.tempDir, "ports")
+        basePort = random.randint(20000, 60000)
+        registry = KtserverPortRegistry(registryDir)
+        self.assertTrue(registry.reserve(basePort, owner="first"))
+        #A port reserved by another registry (so another process) is not reserved again
+        otherRegistry = KtserverPortRegistry(registryDir)
+        self.assertFalse(otherRegistry.reserve(basePort, owner="second"))
+        registry.release(basePort)
+        self.assertTrue(otherRegistry.reserve(basePort, owner="second"))
+        #The reservation of an owner that exited without releasing it is reclaimed
+        otherRegistry.releaseAll()
+        self.assertTrue(open(os.path.join(registryDir, "%d.lock" % basePort)).read().find("second") >= 0)
+        self.assertTrue(registry.reserve(basePort, owner="third"))
+        registry.releaseAll()
+        #A port used by a process that does not use the registry is not reserved
+        serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        serverSocket.bind(("", 0))
+        serverSocket.listen(1)
+        port = serverSocket.getsockname()[1]
+        self.assertFalse(isPortFree(port))
+        self.assertFalse(registry.reserve(port, owner="fourth"))
+        serverSocket.close()
+        self.assertTrue(registry.reserve(port, owner="fourth"))
+        registry.releaseAll()
+
+    def testKtserverPortRegistryLaunch(self):
+        registryDir = os.path.join(self.tempDir, "ports")
+        basePort = random.randint(20000, 60000)
+        #Two registries, as held by the threads launching two servers at once
+        registry = KtserverPortRegistry(registryDir)
+        siblingRegistry = KtserverPortRegistry(registryDir)
+        self.assertTrue(registry.reserve(basePort, owner="server"))
+        self.assertTrue(siblingRegistry.reserve(basePort + 1, owner="sibling"))
+        process = registry.launchHoldingLock(basePort, lambda: subprocess.Popen([ "sleep", "60" ]))
+        registry.releaseAll()
+        siblingRegistry.releaseAll()
+        #The server holds the lock of its own port but not the lock of its sibling's port
+        otherRegistry = KtserverPortRegistry(registryDir)
+        self.assertFalse(otherRegistry.reserve(basePort, owner="other"))
+        self.assertTrue(otherRegistry.reserve(basePort + 1, owner="other"))
+        process.kill()
+        process.wait()
+        self.assertTrue(otherRegistry.reserve(basePort, owner="other"))
+        otherRegistry.releaseAll()
+
+    def testKtserverPortRegistryStress(self):
+        """Starts dozens of stand-in servers at once, each reserving the first port it can 
+        from the same base port and then listening on it, and checks that none collide.
+        """
+        registryDir = os.path.join(self.tempDir, "ports")
+        basePort = random.randint(20000, 60000)
+        serverNumber = 48
+        ports = []
+        errors = []
+        startEvent = threading.Event()
+        def launchServer(i):
+            registry = KtserverPortRegistry(registryDir)
+            startEvent.wait()
+            for port in xrange(basePort, basePort + 2 * serverNumber):
+                if registry.reserve(port, owner="server%i" % i):
+                    break
+            else:
+                errors.append("Server %i found no port" % i)
+                return
+            try:
+                serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                serverSocket.bind(("", port))
+                serverSocket.listen(1)
+                ports.append(port)
+                time.sleep(1)
+                serverSocket.close()
+            except socket.error, e:
+                errors.append("Server %i could not listen on port %i: %s" % (i, port, e))
+            registry.releaseAll()
+        threads = [ threading.Thread(target=launchServer, args=(i,)) for i in xrange(serverNumber) ]
+        for thread in threads:
+            thread.start()
+        startTime = time.time()
+        startEvent.set()
+        for thread in threads:
+            thread.join()
+        print "%i stand-in servers got ports in %s seconds" % (serverNumber, time.time() - startTime)
+        self.assertEquals([], errors)
+        self.assertEquals(serverNumber, len(set(ports)))
+
+    def testWatchKtserverExit(self):
+        exitLogPath = os.path.join(self.tempDir, "ktexit.log")
+        #The process isn't reaped by this one while it is watched
+        process = subprocess.Popen(["sleep", "1"])
+        self.assertTrue(watchKtserverExit(process.pid, 60, exitLogPath, watchInterval=0.1))
+        process.wait()
+        process = subprocess.Popen(["sleep", "60"])
+        startTime = time.time()
+        self.assertFalse(watchKtserverExit(process.pid, 1, exitLogPath, watchInterval=0.1))
+        self.assertTrue(time.time() - startTime < 30)
+        process.wait()
+        lines = open(exitLogPath).readlines()
+        self.assertEquals(2, len(lines))
+        self.assertTrue(lines[0].find("exited") >= 0)
+        self.assertTrue(lines[1].find("killed") >= 0)
+
+    def testKtserverShutdownStatus(self):
+        """Runs a stand-in ktserver with runKtserver and kills it with killKtServer, neither
+        waiting for it to exit, once with a snapshot that can be checksummed and once with one
+        that can't, which the killer must report as soon as the launcher finds it.
+        """
+        binDir = os.path.join(self.tempDir, "bin")
+        os.mkdir(binDir)
+        ktserverPath = os.path.join(binDir, "ktserver")
+        open(ktserverPath, "w").write("#!%s\nimport sys\nfrom cactus.pipeline.ktserverControlTest import runStandInKtserver\nrunStandInKtserver(sys.argv[1:])\n" % sys.executable)
+        os.chmod(ktserverPath, 0755)
+        path = os.environ["PATH"]
+        os.environ["PATH"] = binDir + os.pathsep + path
+        try:
+            for brokenSnapshot in (False, True):
+                self.dbElem.setDbInMemory(True)
+                self.dbElem.setDbSnapshot(True)
+                self.dbElem.setDbPort(random.randint(20000, 60000))
+                open(self.killSwitchPath, "w").write("init")
+                launcherResult = []
+                def launch():
+                    launcherResult.append(runKtserver(self.dbElem, self.killSwitchPath, waitForExit=False))
+                launcher = threading.Thread(target=launch)
+                launcher.start()
+                self.assertTrue(blockUntilKtserverIsRunnning(self.dbElem, self.killSwitchPath, timeout=60))
+                if brokenSnapshot:
+                    #A snapshot that can't be read can't be checksummed
+                    os.mkdir(os.path.join(self.tempDir, "00000000.ktss"))
+                    startTime = time.time()
+                    self.assertRaises(RuntimeError, killKtServer, self.dbElem, self.killSwitchPath, killTimeout=60, waitForExit=False)
+                    self.assertTrue(time.time() - startTime < 30)
+                    launcher.join()
+                    self.assertTrue(launcherResult[0]["error"] is not None)
+                    os.rmdir(os.path.join(self.tempDir, "00000000.ktss"))
+                else:
+                    stats = killKtServer(self.dbElem, self.killSwitchPath, killTimeout=60, waitForExit=False)
+                    launcher.join()
+                    self.assertEquals(None, stats["error"])
+                    snapshotPath = os.path.join(self.tempDir, "00000001.ktss")
+                    self.assertEquals([ snapshotPath ], stats["files"].keys())
+                    self.assertEquals(40000, stats["bytes"])
+                    self.assertEquals(hashlib.md5("ACGT" * 10000).hexdigest(), stats["files"][snapshotPath]["md5"])
+                    self.assertEquals(launcherResult[0]["files"], stats["files"])
+                #The kill switch and the status are gone
+                self.assertFalse(os.path.exists(self.killSwitchPath))
+                self.assertFalse(os.path.exists(getShutdownStatusPath(self.killSwitchPath)))
+        finally:
+            os.environ["PATH"] = path
+
+    def testKtserverSet(self):
+        """Runs the stand-in ktservers of a partitioned database with runKtserverSet, checks
+        the partitions file the cactus disk reads once they are running, and kills them with
+        killKtServerSet, which returns the shutdown statistics of each.
+        """
+        binDir = os.path.join(self.tempDir, "bin")
+        os.mkdir(binDir)
+        ktserverPath = os.path.join(binDir, "ktserver")
+        open(ktserverPath, "w").write("#!%s\nimport sys\nfrom cactus.pipeline.ktserverControlTest import runStandInKtserver\nrunStandInKtserver(sys.argv[1:])\n" % sys.executable)
+        os.chmod(ktserverPath, 0755)
+        path = os.environ["PATH"]
+        os.environ["PATH"] = binDir + os.pathsep + path
+        try:
+            self.dbElem.setDbInMemory(True)
+            self.dbElem.setDbSnapshot(True)
+            self.dbElem.setDbPort(random.randint(20000, 60000))
+            self.dbElem.setDbPartitionNumber(3)
+            open(self.killSwitchPath, "w").write("init")
+            launcher = threading.Thread(target=runKtserverSet, args=(self.dbElem, self.killSwitchPath),
+                                        kwargs={ "waitForExit":False })
+            launcher.start()
+            self.assertTrue(blockUntilKtserverSetIsRunning(self.dbElem, self.killSwitchPath, timeout=60))
+            partitions = self.dbElem.getDbPartitions()
+            for partition in partitions:
+                self.assertTrue(isKtServerAcceptingConnections(partition))
+            self.assertEquals([ "%s %i" % (partition.getDbHost(), partition.getDbPort()) for partition in partitions ],
+                              open(self.dbElem.getDbPartitionsFile(), "r").read().split("\n")[:-1])
+            stats = killKtServerSet(self.dbElem, self.killSwitchPath, killTimeout=60, waitForExit=False)
+            launcher.join()
+            self.assertEquals([ (partition.getDbHost(), partition.getDbPort(), None) for partition in partitions ],
+                              [ (i["host"], i["port"], i["error"]) for i in stats ])
+            self.assertFalse(os.path.exists(self.killSwitchPath))
+        finally:
+            os.environ["PATH"] = path
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,22 +28,56 @@ T as a child.
 Block also schedules Kill as a follow-on
 
 Kill deletes the temporary file, causing the ktserver to terminate.  
+
+The servers of the secondary databases can instead be reused by the phases
+of a cactus workflow, rather than launched for each phase that uses them.
+addReusedKtserverDependentChild launches them, when the first phase that
+uses them is about to run, with that phase as the child: the phases that
+follow it are its follow-ons, so the Kill, which kills the reused servers,
+runs once the last of them is done.  Their kill switch files are kept in the
+reuse dir, named after their databases, so each target that uses a secondary
+database just Blocks on the server (and clears the scratch database) before
+running.  Each server still serves the one database it was launched with;
+servers are not shared between the workflows of different progressive
+events.
+
+The server of the primary database of a cactus workflow is killed at each
+phase checkpoint, so it writes the database, and launched again for the
+phases that follow, as the dependent child of the checkpoint target (see
+runPhaseTarget in cactus_workflow).  Block records its kill switch file in
+the workflow's arguments for the checkpoint to kill it with, and the Kill of
+a server killed by a checkpoint finds its kill switch file gone and does
+nothing.
+
+If the database is partitioned (see DbElemWrapper.getDbPartition) Launch
+runs a server for each partition, Block waits for all of them and writes
+the partitions file the cactus disk connects to them from, and Kill kills
+all of them.
+
+If metricsInterval is given, Launch samples the report of the server every
+metricsInterval seconds into a csv file next to the experiment file, and
+logs a summary of the samples when the server is killed.  The servers of a
+partitioned database are not sampled.
 """
 
 import os
 import sys
 import random
 import math
+import hashlib
+import shutil
 import xml.etree.ElementTree as ET
 
 from sonLib.bioio import getTempFile
 from jobTree.scriptTree.target import Target
 from cactus.shared.experimentWrapper import DbElemWrapper
 from cactus.shared.experimentWrapper import ExperimentWrapper
-from cactus.pipeline.ktserverControl import runKtserver
-from cactus.pipeline.ktserverControl import blockUntilKtserverIsRunnning
-from cactus.pipeline.ktserverControl import killKtServer
+from cactus.pipeline.ktserverControl import runKtserverSet
+from cactus.pipeline.ktserverControl import blockUntilKtserverSetIsRunning
+from cactus.pipeline.ktserverControl import killKtServerSet
 from cactus.pipeline.ktserverControl import getKtServerReport
+from cactus.pipeline.ktserverControl import clearKtServer
+from cactus.pipeline.ktserverControl import KtServerMetricsRecorder
 
 ###############################################################################
 # Launch childTargetClosure (which is a JobtreeTarget with bound parameters)
@@ -69,17 +103,24 @@ from cactus.pipeline.ktserverControl import getKtServerReport
 # blockTimeout : seconds that Block target waits for the ktserver to be
 #                launched before aborting with an error
 # blockTimestep : length of interval in seconds between polling for the server
+#                 (each poll only reads the lines added to the server log)
 # runTimeout : maximum number of seconds for the ktserver to run
 # runTimestep : polling interval for above
 # killTimeout : amount of time to wait for server to die after deleting
 #               the kill switch file before throwing an error
+# reuseDir : if given and isSecondary is True, the server of the secondary
+#            database was launched for reuse, keeping its kill switch file
+#            in this directory (see addReusedKtserverDependentChild)
+# metricsInterval : seconds between the samples of the server's report
+#                   (0 for none)
 ###############################################################################
 def addKtserverDependentChild(rootTarget, newChild, maxMemory, maxCpu,
                               isSecondary = False,
                               createTimeout = 30, loadTimeout = 10000,
-                              blockTimeout=sys.maxint, blockTimestep=10,
-                              runTimeout=sys.maxint, runTimestep=10,
-                              killTimeout=10000):
+                              blockTimeout=sys.maxint, blockTimestep=0.05,
+                              runTimeout=sys.maxint, runTimestep=0.5,
+                              killTimeout=10000, reuseDir=None,
+                              metricsInterval=0):
     from cactus.pipeline.cactus_workflow import CactusPhasesTarget
     from cactus.pipeline.cactus_workflow import CactusRecursionTarget
     
@@ -87,31 +128,113 @@ def addKtserverDependentChild(rootTarget, newChild, maxMemory, maxCpu,
 
     if killTimeout < runTimestep * 2:
         killTimeout = runTimestep * 2
-    killSwitchPath = getTempFile(suffix="_kill.txt",
-                                 rootDir=rootTarget.getGlobalTempDir())
-    killSwitchFile = open(killSwitchPath, "w")
-    killSwitchFile.write("init")
-    killSwitchFile.close()
 
     if isSecondary == False:
         assert isinstance(newChild, CactusPhasesTarget)
         wfArgs = newChild.cactusWorkflowArguments
         dbElem = ExperimentWrapper(wfArgs.experimentNode)
+        experimentPath = wfArgs.experimentFile
     else:
         assert isinstance(newChild, CactusRecursionTarget)
         dbString = newChild.getOptionalPhaseAttrib("secondaryDatabaseString")
         assert dbString is not None
         confXML = ET.fromstring(dbString)
         dbElem = DbElemWrapper(confXML)
+        experimentPath = newChild.phaseNode.attrib["experimentPath"]
+
+    if isSecondary == True and reuseDir is not None:
+        killSwitchPath = getReusedKillSwitchPath(reuseDir, dbElem)
+        if not os.path.isfile(killSwitchPath):
+            raise RuntimeError("No ktserver was launched for reuse in %s "
+                               "for %s" % (reuseDir, dbElem.getConfString()))
+        rootTarget.addChildTarget(
+            KtserverTargetBlocker(killSwitchPath, newChild, isSecondary,
+                                  blockTimeout, blockTimestep, killTimeout,
+                                  reused=True))
+        return
+
+    killSwitchPath = getTempFile(suffix="_kill.txt",
+                                 rootDir=rootTarget.getGlobalTempDir())
+    killSwitchFile = open(killSwitchPath, "w")
+    killSwitchFile.write("init")
+    killSwitchFile.close()
     
     rootTarget.addChildTarget(
         KtserverTargetLauncher(dbElem, killSwitchPath, maxMemory,
                                maxCpu, createTimeout,
-                               loadTimeout, runTimeout, runTimestep))
+                               loadTimeout, runTimeout, runTimestep,
+                               getMetricsPath(experimentPath, isSecondary),
+                               metricsInterval))
+
     rootTarget.addChildTarget(
         KtserverTargetBlocker(killSwitchPath, newChild, isSecondary,
                                 blockTimeout, blockTimestep, killTimeout))
 
+###############################################################################
+# Launch the servers of the given secondary databases for reuse, as children
+# of rootTarget, for the lifespan of newChild (a phase target, and so the
+# phases that follow it), which runs as a child of rootTarget once they are
+# launched.  The targets of the phases that use a secondary database add
+# their children with addKtserverDependentChild, giving it the reuseDir, to
+# block on its server.  The parameters are those of addKtserverDependentChild.
+###############################################################################
+def addReusedKtserverDependentChild(rootTarget, newChild, reusedDbElems,
+                                    reuseDir, experimentPath, maxMemory,
+                                    maxCpu, createTimeout = 30,
+                                    loadTimeout = 10000,
+                                    runTimeout=sys.maxint, runTimestep=0.5,
+                                    killTimeout=10000, metricsInterval=0):
+    assert isinstance(rootTarget, Target)
+
+    if killTimeout < runTimestep * 2:
+        killTimeout = runTimestep * 2
+
+    if not os.path.isdir(reuseDir):
+        os.makedirs(reuseDir)
+    for reusedDbElem in reusedDbElems:
+        reusedKillSwitchPath = getReusedKillSwitchPath(reuseDir, reusedDbElem)
+        confFile = open(reusedKillSwitchPath[:-len("_kill.txt")] + 
+                        "_conf.xml", "w")
+        confFile.write(reusedDbElem.getConfString())
+        confFile.close()
+        killSwitchFile = open(reusedKillSwitchPath, "w")
+        killSwitchFile.write("init")
+        killSwitchFile.close()
+        rootTarget.addChildTarget(
+            KtserverTargetLauncher(reusedDbElem, reusedKillSwitchPath,
+                                   maxMemory, maxCpu, createTimeout,
+                                   loadTimeout, runTimeout, runTimestep,
+                                   getMetricsPath(experimentPath, True),
+                                   metricsInterval))
+
+    rootTarget.addChildTarget(
+        KtserverReusedTargetScope(newChild, reuseDir, killTimeout))
+
+###############################################################################
+# Whether the servers of the secondary databases are running for reuse
+###############################################################################
+def areReusedKtserversRunning(reuseDir):
+    return os.path.isdir(reuseDir) and len(
+        [ fileName for fileName in os.listdir(reuseDir)
+          if fileName.endswith("_kill.txt") ]) > 0
+
+###############################################################################
+# The kill switch file of the reused server of a database is named after
+# the database's directory, which is unique to it
+###############################################################################
+def getReusedKillSwitchPath(reuseDir, dbElem):
+    return os.path.join(reuseDir, "%s_kill.txt" % 
+                        hashlib.md5(dbElem.getDbDir()).hexdigest())
+
+###############################################################################
+# The metrics of the servers are written next to the experiment file
+###############################################################################
+def getMetricsPath(experimentPath, isSecondary):
+    if isSecondary == True:
+        suffix = "_secondaryKtserverMetrics.csv"
+    else:
+        suffix = "_ktserverMetrics.csv"
+    return os.path.splitext(experimentPath)[0] + suffix
 
 ###############################################################################
 # Launch the server on whatever node runs this target
@@ -119,7 +242,8 @@ def addKtserverDependentChild(rootTarget, newChild, maxMemory, maxCpu,
 class KtserverTargetLauncher(Target):
     def __init__(self, dbElem, killSwitchPath,
                  maxMemory, maxCpu, createTimeout,
-                 loadTimeout, runTimeout, runTimestep):
+                 loadTimeout, runTimeout, runTimestep,
+                 metricsPath=None, metricsInterval=0):
         Target.__init__(self, memory=maxMemory, cpu=maxCpu)
         self.dbElem = dbElem
         self.killSwitchPath = killSwitchPath
@@ -127,16 +251,43 @@ class KtserverTargetLauncher(Target):
         self.loadTimeout = loadTimeout
         self.runTimeout = runTimeout
         self.runTimestep = runTimestep
+        self.metricsPath = metricsPath
+        self.metricsInterval = metricsInterval
         
     def run(self):
         self.logToMaster("Launching ktserver %s with killPath %s" % (
             ET.tostring(self.dbElem.getDbElem()), self.killSwitchPath))
-        runKtserver(self.dbElem, self.killSwitchPath,
-                    maxPortsToTry=100, readOnly = False,
-                    createTimeout=self.createTimeout,
-                    loadTimeout=self.loadTimeout,
-                    killTimeout=self.runTimeout,
-                    killPingInterval=self.runTimestep)
+        metricsRecorder = None
+        if self.metricsPath is not None and self.metricsInterval > 0 and \
+                self.dbElem.getDbPartitionNumber() == 1:
+            metricsRecorder = KtServerMetricsRecorder(self.dbElem,
+                                                      self.metricsPath,
+                                                      self.metricsInterval)
+        try:
+            # the exit of the server is left to a watcher once its database
+            # is written, so this target finishes with the shutdown.  the
+            # killer logs the statistics of the shutdown
+            runKtserverSet(self.dbElem, self.killSwitchPath,
+                           maxPortsToTry=100, readOnly = False,
+                           createTimeout=self.createTimeout,
+                           loadTimeout=self.loadTimeout,
+                           killTimeout=self.runTimeout,
+                           killPingInterval=self.runTimestep,
+                           metricsRecorder=metricsRecorder,
+                           waitForExit=False)
+        finally:
+            if metricsRecorder is not None:
+                metricsRecorder.close()
+        if metricsRecorder is not None:
+            summary = metricsRecorder.getSummary()
+            if summary is not None:
+                self.logToMaster("Metrics of ktserver %s:%d from %d samples "
+                                 "written to %s: peak size %d bytes, peak "
+                                 "connections %d, mean ops/s %.1f" % (
+                        self.dbElem.getDbHost(), self.dbElem.getDbPort(),
+                        summary["samples"], self.metricsPath,
+                        summary["peakSize"], summary["peakConnections"],
+                        summary["meanOpsPerSecond"]))
 
 ###############################################################################
 # Block until the server's detected.
@@ -144,7 +295,8 @@ class KtserverTargetLauncher(Target):
 ###############################################################################
 class KtserverTargetBlocker(Target):
     def __init__(self, killSwitchPath, newChild, isSecondary,
-                 blockTimeout, blockTimestep, killTimeout):
+                 blockTimeout, blockTimestep, killTimeout,
+                 reused=False):
         Target.__init__(self)
         self.killSwitchPath = killSwitchPath
         self.newChild = newChild
@@ -152,6 +304,7 @@ class KtserverTargetBlocker(Target):
         self.blockTimeout = blockTimeout
         self.blockTimestep = blockTimestep
         self.killTimeout = killTimeout
+        self.reused = reused
         
     def run(self):
         if self.isSecondary == False:
@@ -168,12 +321,17 @@ class KtserverTargetBlocker(Target):
         self.logToMaster("Blocking on ktserver %s with killPath %s" % (
             ET.tostring(dbElem.getDbElem()), self.killSwitchPath))
             
-        blockUntilKtserverIsRunnning(dbElem, self.killSwitchPath,
-                                     self.blockTimeout, self.blockTimestep)
+        blockUntilKtserverSetIsRunning(dbElem, self.killSwitchPath,
+                                       self.blockTimeout, self.blockTimestep)
+        if self.reused:
+            # the database is scratch space, so the data left by the
+            # target that last used the server is removed
+            clearKtServer(dbElem)
 
         if self.isSecondary == False:
             experiment.writeXML(wfArgs.experimentFile)
             wfArgs.cactusDiskDatabaseString = dbElem.getConfString()
+            wfArgs.ktserverKillSwitchPath = self.killSwitchPath
         else:
             self.newChild.phaseNode.attrib[
                 "secondaryDatabaseString"] = dbElem.getConfString()
@@ -185,25 +343,80 @@ class KtserverTargetBlocker(Target):
             experiment.writeXML(etPath)            
         
         self.addChildTarget(self.newChild)
-        self.setFollowOnTarget(KtserverTargetKiller(dbElem,
-                                                    self.killSwitchPath,
-                                                    self.killTimeout))
+        if not self.reused:
+            self.setFollowOnTarget(KtserverTargetKiller(dbElem,
+                                                        self.killSwitchPath,
+                                                        self.killTimeout))
 
 ###############################################################################
-# Kill the server by deleting its kill switch file
+# Run the child target as a child, and kill the reused servers in a follow-on
+###############################################################################
+class KtserverReusedTargetScope(Target):
+    def __init__(self, newChild, reuseDir, killTimeout):
+        Target.__init__(self)
+        self.newChild = newChild
+        self.reuseDir = reuseDir
+        self.killTimeout = killTimeout
+
+    def run(self):
+        self.addChildTarget(self.newChild)
+        self.setFollowOnTarget(KtserverTargetKiller(None, None,
+                                                    self.killTimeout,
+                                                    self.reuseDir))
+
+###############################################################################
+# Kill the server by deleting its kill switch file, unless it was already
+# killed at a phase checkpoint, then the reused servers in killReuseDir, if
+# given (dbElem is None if there are only those)
 ###############################################################################
 class KtserverTargetKiller(Target):
-    def __init__(self, dbElem, killSwitchPath, killTimeout):
+    def __init__(self, dbElem, killSwitchPath, killTimeout, killReuseDir=None):
         Target.__init__(self)
         self.dbElem = dbElem
         self.killSwitchPath = killSwitchPath
         self.killTimeout = killTimeout
+        self.killReuseDir = killReuseDir
         
     def run(self):
-        self.logToMaster("Killing ktserver %s with killPath %s" % (
-            ET.tostring(self.dbElem.getDbElem()), self.killSwitchPath))
-        report = getKtServerReport(self.dbElem)
-        self.logToMaster(report)
-        killKtServer(self.dbElem, self.killSwitchPath,
-                     killTimeout=self.killTimeout)
-    
+        if self.dbElem is not None and not os.path.isfile(self.killSwitchPath):
+            self.logToMaster("ktserver %s with killPath %s was already killed" % (
+                ET.tostring(self.dbElem.getDbElem()), self.killSwitchPath))
+        elif self.dbElem is not None:
+            self.logToMaster("Killing ktserver %s with killPath %s" % (
+                ET.tostring(self.dbElem.getDbElem()), self.killSwitchPath))
+            for partition in self.dbElem.getDbPartitions():
+                self.logToMaster(getKtServerReport(partition))
+            logShutdownStats(self, killKtServerSet(self.dbElem, self.killSwitchPath,
+                                                   killTimeout=self.killTimeout,
+                                                   waitForExit=False))
+        if self.killReuseDir is not None and os.path.isdir(self.killReuseDir):
+            for fileName in sorted(os.listdir(self.killReuseDir)):
+                if not fileName.endswith("_kill.txt"):
+                    continue
+                killSwitchPath = os.path.join(self.killReuseDir, fileName)
+                dbElem = DbElemWrapper(ET.parse(
+                    killSwitchPath[:-len("_kill.txt")] + "_conf.xml").getroot())
+                self.logToMaster("Killing reused ktserver %s with killPath %s" % (
+                    ET.tostring(dbElem.getDbElem()), killSwitchPath))
+                logShutdownStats(self, killKtServerSet(dbElem, killSwitchPath,
+                                                       killTimeout=self.killTimeout,
+                                                       waitForExit=False))
+            shutil.rmtree(self.killReuseDir)
+
+###############################################################################
+# Log the time a ktserver took to write its database when it was shut down,
+# and the size of what it wrote, as returned by killKtServer (killKtServerSet
+# returns a list of them for a partitioned database)
+###############################################################################
+def logShutdownStats(target, shutdownStats):
+    if isinstance(shutdownStats, list):
+        for partitionShutdownStats in shutdownStats:
+            logShutdownStats(target, partitionShutdownStats)
+        return
+    if not isinstance(shutdownStats, dict):
+        return
+    target.logToMaster("ktserver %s:%d wrote %d bytes to %d files in %.2f "
+                       "seconds on shutdown" % (
+            shutdownStats["host"], shutdownStats["port"],
+            shutdownStats["bytes"], len(shutdownStats["files"]),
+            shutdownStats["seconds"]))
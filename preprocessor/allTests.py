@@ -7,12 +7,16 @@ import unittest
 
 from cactus.preprocessor.lastzRepeatMasking.cactus_lastzRepeatMaskTest import TestCase as repeatMaskTest
 from cactus.preprocessor.cactus_preprocessorTest import TestCase as preprocessorTest
+from cactus.preprocessor.cactus_kmerRepeatMaskTest import TestCase as kmerRepeatMaskTest
+from cactus.preprocessor.cactus_validateFastaTest import TestCase as validateFastaTest
  
 from cactus.shared.test import parseCactusSuiteTestOptions
 
 def allSuites(): 
     allTests = unittest.TestSuite((unittest.makeSuite(repeatMaskTest, 'test'),
-                                   unittest.makeSuite(preprocessorTest, 'test')))
+                                   unittest.makeSuite(preprocessorTest, 'test'),
+                                   unittest.makeSuite(kmerRepeatMaskTest, 'test'),
+                                   unittest.makeSuite(validateFastaTest, 'test')))
     return allTests
         
 def main():
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+
+## USE K-MER FREQUENCIES TO SOFTMASK REPEATS OF A GIVEN FASTA SEQUENCE FILE.
+
+############################################################
+##  NOTE:   This is an alignment free alternative to
+##          cactus_lastzRepeatMask.py. It takes the same
+##          arguments from the preprocessor (the sampled
+##          chunks are read from stdin), so the two can be
+##          swapped by changing the preprocessorString.
+############################################################
+
+import os
+import sys
+import array
+import string
+import struct
+import hashlib
+from optparse import OptionParser
+
+from sonLib.bioio import fastaRead
+from sonLib.bioio import fastaWrite
+from sonLib.bioio import reverseComplement
+
+def isPrime(n):
+    if n < 2:
+        return False
+    i = 2
+    while i * i <= n:
+        if n % i == 0:
+            return False
+        i += 1
+    return True
+
+def getMaxSketchWidth(maxMemory, depth=3):
+    """The widest sketch of the given depth whose counters fit in maxMemory bytes.
+    """
+    return max(1009, maxMemory / (depth * array.array('H').itemsize))
+
+def getSketchWidth(kmerNumber, maxWidth=None):
+    """The width of a count-min sketch for the given number of k-mers: the first prime at
+    least as big, so that each counter gets about one k-mer and the counts of the k-mers
+    seen a few times are rarely inflated past a threshold. It is at most about maxWidth, if
+    given.
+    """
+    width = max(1009, kmerNumber)
+    if maxWidth is not None:
+        width = max(1009, min(width, maxWidth))
+    while not isPrime(width):
+        width += 1
+    return width
+
+class KmerCounter:
+    """Count-min sketch of the k-mers in a set of sequences. The estimated count
+    of a k-mer is never less than its true count, but may be more if the sketch
+    is too small for the number of distinct k-mers. Counts stop at 65535, which
+    is far more than any threshold.
+    """
+    def __init__(self, kmerSize, width=1009, depth=3, step=1):
+        assert kmerSize > 0 and width > 0 and depth > 0 and step > 0
+        self.kmerSize = kmerSize
+        self.width = width
+        self.depth = depth
+        self.step = step
+        self.tables = [ array.array('H', [0]) * width for i in xrange(depth) ]
+
+    def _indices(self, kmer):
+        #Double hashing, the width is prime so the rows are independent enough. The hashes
+        #are taken from the md5 digest, not the built in hash function, as the sketch is
+        #written by one process and read by others, on other machines
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(kmer).digest())
+        h2 |= 1
+        return [ (h1 + i * h2) % self.width for i in xrange(self.depth) ]
+
+    def addSequence(self, sequence):
+        """Adds every step-th k-mer of the sequence that does not contain a masked or N base.
+        """
+        k = self.kmerSize
+        tables = self.tables
+        for i in xrange(0, len(sequence) - k + 1, self.step):
+            kmer = sequence[i:i+k]
+            if kmer.isupper() and 'N' not in kmer:
+                for table, j in zip(tables, self._indices(kmer)):
+                    if table[j] < 0xFFFF:
+                        table[j] += 1
+
+    def addBothStrands(self, sequence):
+        self.addSequence(sequence)
+        self.addSequence(reverseComplement(sequence))
+
+    def getCount(self, kmer):
+        return min([ table[j] for table, j in zip(self.tables, self._indices(kmer)) ])
+
+    def write(self, fileHandle, sequenceFiles=[]):
+        """Writes the sketch, and the files whose k-mers it counts, so it can be read
+        by another process.
+        """
+        fileHandle.write("%i %i %i %i\n" % (self.kmerSize, self.width, self.depth, self.step))
+        fileHandle.write(" ".join(sequenceFiles) + "\n")
+        for table in self.tables:
+            table.tofile(fileHandle)
+
+def readKmerCounter(fileHandle):
+    """Reads a sketch written by KmerCounter.write, returns the sketch and the files
+    whose k-mers it counts.
+    """
+    kmerSize, width, depth, step = [ int(i) for i in fileHandle.readline().split() ]
+    sequenceFiles = fileHandle.readline().split()
+    counter = KmerCounter(kmerSize, width=1, depth=depth, step=step)
+    counter.width = width
+    counter.tables = []
+    for i in xrange(depth):
+        table = array.array('H')
+        table.fromfile(fileHandle, width)
+        counter.tables.append(table)
+    return counter, sequenceFiles
+
+def countKmers(sequenceFiles, kmerSize, width=0, depth=3, step=1, unmask=False, maxMemory=536870912):
+    """Counts the k-mers on both strands of the sequences of the given fasta files. If
+    the width is 0 it is chosen from the number of k-mers, estimated from the sizes of
+    the files. The sketch takes at most about maxMemory bytes: if there are more k-mers
+    than counters the step is raised, so that each counter still gets about one k-mer.
+    """
+    maxWidth = getMaxSketchWidth(maxMemory, depth)
+    kmerNumber = 2 * sum([ os.path.getsize(sequenceFile) for sequenceFile in sequenceFiles ])
+    if kmerNumber / step > maxWidth:
+        step = (kmerNumber + maxWidth - 1) / maxWidth
+        sys.stderr.write("Counting every %i-th k-mer, so that the sketch fits in %i bytes\n" % (step, maxMemory))
+    if width <= 0:
+        width = kmerNumber / step
+    width = getSketchWidth(width, maxWidth)
+    counter = KmerCounter(kmerSize, width=width, depth=depth, step=step)
+    for sequenceFile in sequenceFiles:
+        fileHandle = open(sequenceFile, "r")
+        for header, sequence in fastaRead(fileHandle):
+            if unmask:
+                sequence = sequence.upper()
+            counter.addBothStrands(sequence)
+        fileHandle.close()
+    return counter
+
+def getRepeatIntervals(sequence, counter, threshold, windowSize, windowFraction):
+    """Returns a list of merged, half-open (start, end) intervals of the sequence
+    covering windows in which at least windowFraction of the k-mers have a count
+    of threshold or more.
+    """
+    k = counter.kmerSize
+    kmerNumber = max(0, len(sequence) - k + 1)
+    #Prefix sums of the high frequency k-mer starts
+    prefix = array.array('l', [0]) * (kmerNumber + 1)
+    for i in xrange(kmerNumber):
+        kmer = sequence[i:i+k]
+        high = kmer.isupper() and 'N' not in kmer and counter.getCount(kmer) >= threshold
+        prefix[i+1] = prefix[i] + int(high)
+    intervals = []
+    windowStep = max(1, windowSize/2)
+    for start in xrange(0, kmerNumber, windowStep):
+        end = min(kmerNumber, start + windowSize)
+        if prefix[end] - prefix[start] >= windowFraction * (end - start):
+            maskEnd = end + k - 1 #The last k-mer covers k bases
+            if len(intervals) > 0 and intervals[-1][1] >= start:
+                intervals[-1] = (intervals[-1][0], max(intervals[-1][1], maskEnd))
+            else:
+                intervals.append((start, maskEnd))
+    return intervals
+
+def softMask(sequence, intervals):
+    """Lower cases the given intervals of the sequence.
+    """
+    if len(intervals) == 0:
+        return sequence
+    pieces = []
+    previousEnd = 0
+    for start, end in intervals:
+        pieces.append(sequence[previousEnd:start])
+        pieces.append(sequence[start:end].lower())
+        previousEnd = end
+    pieces.append(sequence[previousEnd:])
+    return "".join(pieces)
+
+def sampleSequencePieces(sequenceFiles, sampleSize, pieceSize=10000):
+    """Takes pieces of about pieceSize bases, at evenly spaced positions across all the given fasta files
+    (taken as if they were concatenated), until they total about sampleSize bases. Only the files read
+    around each position are read, so the files can be much bigger than the sample. A piece stops at the
+    end of a sequence, so it never joins two sequences.
+    """
+    assert len(sequenceFiles) > 0 and sampleSize > 0 and pieceSize > 0
+    fileSizes = [ os.path.getsize(sequenceFile) for sequenceFile in sequenceFiles ]
+    totalSize = sum(fileSizes)
+    if totalSize == 0:
+        return []
+    pieceNumber = max(1, (sampleSize + pieceSize - 1) / pieceSize)
+    pieceSize = min(pieceSize, sampleSize)
+    sample = []
+    fileIndex = 0
+    fileStart = 0 #The position of the start of the file in the concatenated files
+    for k in xrange(pieceNumber):
+        position = (k * totalSize) / pieceNumber
+        while position >= fileStart + fileSizes[fileIndex]:
+            fileStart += fileSizes[fileIndex]
+            fileIndex += 1
+        #Look back for the start of the line the position is in, to see if it is a header (headers are
+        #short, so a line with no start in the last 1000 bytes is a sequence line)
+        offset = position - fileStart
+        fileHandle = open(sequenceFiles[fileIndex], "r")
+        fileHandle.seek(max(0, offset - 1000))
+        lineStart = fileHandle.read(offset - max(0, offset - 1000))
+        #Enough bytes for the piece and its line breaks, with lines of 50 or more bases
+        lines = fileHandle.read(pieceSize + pieceSize / 50 + 1000).split("\n")
+        fileHandle.close()
+        if (offset <= 1000 or "\n" in lineStart) and lineStart[lineStart.rfind("\n") + 1:].startswith(">"):
+            lines = lines[1:]
+        piece = []
+        pieceLength = 0
+        for line in lines:
+            line = line.strip()
+            if line.startswith(">"):
+                if pieceLength > 0:
+                    break
+                continue
+            piece.append(line)
+            pieceLength += len(line)
+            if pieceLength >= pieceSize:
+                break
+        if pieceLength > 0:
+            sample.append("".join(piece)[:pieceSize])
+    return sample
+
+def estimateRepeatDensity(sequenceFiles, sampleSize, kmerSize=16, threshold=2, pieceSize=10000):
+    """Estimates the proportion of a genome that is repetitive from a sample of about sampleSize bases, taken
+    in pieces of pieceSize bases spread evenly across the given sequence files. A base is counted as repetitive
+    if it is already soft/hard masked, or if the k-mer starting at it occurs (on either strand) at least
+    threshold times in the sample.
+    """
+    sample = sampleSequencePieces(sequenceFiles, sampleSize, pieceSize)
+    counter = KmerCounter(kmerSize, width=getSketchWidth(8*sampleSize, getMaxSketchWidth(536870912))) #Wide enough for few false repeats
+    for sequence in sample:
+        counter.addBothStrands(sequence)
+    maskedBases = 0
+    kmerNumber = 0
+    repeatKmers = 0
+    for sequence in sample:
+        maskedBases += len(sequence.translate(None, string.ascii_uppercase)) + sequence.count('N') #Everything but upper case non-Ns
+        for i in xrange(len(sequence) - kmerSize + 1):
+            kmer = sequence[i:i+kmerSize]
+            if kmer.isupper() and 'N' not in kmer:
+                kmerNumber += 1
+                if counter.getCount(kmer) >= threshold:
+                    repeatKmers += 1
+    if maskedBases + kmerNumber == 0:
+        return 0.0
+    return min(1.0, float(maskedBases + repeatKmers) / (maskedBases + kmerNumber))
+
+def main():
+    ##########################################
+    #Construct the arguments.
+    ##########################################
+
+    usage = "usage: %prog [options] <query> <output>\n\n" + \
+            "    <query>:  fasta sequence to mask\n" + \
+            "    <output>: softmasked version of <query>\n" + \
+            "    The fasta files to count k-mers in are read from stdin.\n\n" + \
+            "Example: echo genome.fa | %prog chunk.fa chunk.masked.fa\n\n" + \
+            "To count the k-mers once for many chunks, write a sketch with --countKmers and\n" + \
+            "pass it with --sketch to each masking of a chunk:\n" + \
+            "    echo genome.fa | %prog --countKmers --sketch=genome.sketch\n" + \
+            "    %prog --sketch=genome.sketch chunk.fa chunk.masked.fa < /dev/null\n\n"
+    description = "softrepeat mask a fasta file using the frequency of its k-mers."
+    parser = OptionParser(usage=usage, description=description)
+
+    parser.add_option("--kmerSize", dest="kmerSize", type="int",
+                      help="The length of k-mers to count",
+                      default=16)
+
+    parser.add_option("--minPeriod", dest="period", type="int",
+                     help="minimum number of other occurrences of a k-mer for it to be considered repetitive",
+                     default=10)
+
+    parser.add_option("--step", dest="step", type="int",
+                      help="Only count every step-th k-mer of the sampled sequences (the period is adjusted accordingly)",
+                      default=1)
+
+    parser.add_option("--window", dest="window", type="int",
+                      help="The size of the windows which are masked",
+                      default=50)
+
+    parser.add_option("--windowFraction", dest="windowFraction", type="float",
+                      help="The fraction of k-mers in a window that must be repetitive for it to be masked",
+                      default=0.5)
+
+    parser.add_option("--sketchWidth", dest="sketchWidth", type="int",
+                      help="The number of counters in each row of the count-min sketch (ideally a prime), 0 for the first prime at least the number of k-mers counted",
+                      default=0)
+
+    parser.add_option("--sketchDepth", dest="sketchDepth", type="int",
+                      help="The number of rows in the count-min sketch",
+                      default=3)
+
+    parser.add_option("--maxSketchMemory", dest="maxSketchMemory", type="int",
+                      help="The most bytes the count-min sketch may take, if there are more k-mers than fit then only every step-th k-mer is counted, raising the step",
+                      default=536870912)
+
+    parser.add_option("--sketch", dest="sketch",
+                      help="Read the k-mer counts from this sketch, written with --countKmers, rather than counting the files read from stdin",
+                      default=None)
+
+    parser.add_option("--countKmers", dest="countKmers", action="store_true",
+                      help="Only count the k-mers of the files read from stdin, writing them to the file given by --sketch. Any arguments are ignored",
+                      default=False)
+
+    parser.add_option("--unmaskInput", dest="unmaskInput", action="store_true",
+                      help="Makes any previous masking of the input sequence invisible to the repeat masking process",
+                      default=False)
+
+    parser.add_option("--unmaskOutput", dest="unmaskOutput", action="store_true",
+                      help="Discards any previous masking from the output sequence, uses just the masking discovered by counting k-mers",
+                      default=False)
+
+    parser.add_option("--proportionSampled", dest="proportionSampled", type="float",
+                     help="The amount of the genome that is being sampled for masking, used to adjust the minPeriod parameter according to sampling",
+                     default="1.0")
+
+    parser.add_option("--tempDir", dest="tempDir",
+                     help="Ignored, accepted for compatibility with cactus_lastzRepeatMask.py",
+                     default=None)
+
+    options, args = parser.parse_args()
+
+    if options.countKmers:
+        if options.sketch is None:
+            parser.print_help()
+            return 1
+        targetFiles = sys.stdin.readline().split() #Read them from stdin
+        assert len(targetFiles) >= 1
+        counter = countKmers(targetFiles, options.kmerSize, width=options.sketchWidth,
+                             depth=options.sketchDepth, step=options.step, unmask=options.unmaskInput,
+                             maxMemory=options.maxSketchMemory)
+        fileHandle = open(options.sketch, "wb")
+        counter.write(fileHandle, targetFiles)
+        fileHandle.close()
+        return 0
+
+    if len(args) != 2:
+        parser.print_help()
+        return 1
+
+    queryFile = args[0]
+    outputFile = args[1]
+    assert os.path.isfile(queryFile)
+    assert options.kmerSize > 0 and options.window > 0
+    assert options.windowFraction > 0.0 and options.windowFraction <= 1.0
+
+    if options.sketch is not None:
+        fileHandle = open(options.sketch, "rb")
+        counter, targetFiles = readKmerCounter(fileHandle)
+        fileHandle.close()
+        #The query chunk may not be part of the sample the sketch was counted from
+        if os.path.abspath(queryFile) not in [ os.path.abspath(targetFile) for targetFile in targetFiles ]:
+            fileHandle = open(queryFile, "r")
+            for header, sequence in fastaRead(fileHandle):
+                if options.unmaskInput:
+                    sequence = sequence.upper()
+                counter.addBothStrands(sequence)
+            fileHandle.close()
+    else:
+        targetFiles = sys.stdin.readline().split() #Read them from stdin
+        assert len(targetFiles) >= 1
+        counter = countKmers(targetFiles, options.kmerSize, width=options.sketchWidth,
+                             depth=options.sketchDepth, step=options.step, unmask=options.unmaskInput,
+                             maxMemory=options.maxSketchMemory)
+
+    #Adjust the period parameter using the amount of genome sampled and the k-mer step.
+    #The query chunk is part of the sample, so every k-mer is counted at least once.
+    period = max(1, round(options.proportionSampled * options.period / counter.step))
+    threshold = int(period) + 1
+
+    inputFile = open(queryFile, "r")
+    outputFileHandle = open(outputFile, "w")
+    for header, sequence in fastaRead(inputFile):
+        querySequence = sequence
+        if options.unmaskInput:
+            querySequence = querySequence.upper()
+        if options.unmaskOutput:
+            sequence = sequence.upper()
+        intervals = getRepeatIntervals(querySequence, counter, threshold,
+                                       options.window, options.windowFraction)
+        fastaWrite(outputFileHandle, header, softMask(sequence, intervals))
+    outputFileHandle.close()
+    inputFile.close()
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
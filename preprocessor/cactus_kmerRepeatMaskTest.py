@@ -0,0 +1,139 @@
+from cactus.preprocessor.preprocessorTest import *
+from cactus.preprocessor.preprocessorTest import TestCase as PreprocessorTestCase
+from cactus.preprocessor.cactus_kmerRepeatMask import KmerCounter, getRepeatIntervals, softMask, estimateRepeatDensity, sampleSequencePieces
+from cactus.preprocessor.cactus_kmerRepeatMask import getSketchWidth, getMaxSketchWidth, countKmers, readKmerCounter
+from sonLib.bioio import popenCatch
+from sonLib.bioio import fastaWrite
+import sys
+import random
+
+"""Benchmarks the k-mer repeat masking script against the lastz repeat masking script on
+synthetic genomes with injected repeats, comparing the run times and the masked bases.
+"""
+
+def makeRepeatInjectedGenome(length, repeatFamilies, repeatLength, copiesPerFamily, mutationRate):
+    """Makes a random sequence into which mutated copies of some random repeat elements are
+    inserted. Returns the sequence and the set of positions covered by the repeat copies.
+    """
+    sequence = [ random.choice("ACGT") for i in xrange(length) ]
+    repeatPositions = set()
+    for family in xrange(repeatFamilies):
+        element = [ random.choice("ACGT") for i in xrange(repeatLength) ]
+        for copy in xrange(copiesPerFamily):
+            start = random.randint(0, length - repeatLength)
+            for i in xrange(repeatLength):
+                base = element[i]
+                if random.random() < mutationRate:
+                    base = random.choice("ACGT")
+                sequence[start + i] = base
+                repeatPositions.add(start + i)
+    return "".join(sequence), repeatPositions
+
+class TestCase(PreprocessorTestCase):
+    def testKmerCounter(self):
+        counter = KmerCounter(4, width=1009, depth=2)
+        counter.addSequence("ACGTACGTNNNNacgtACGT")
+        self.assertTrue(counter.getCount("ACGT") >= 3)
+        self.assertTrue(counter.getCount("ACGT") >= counter.getCount("CGTA"))
+        intervals = getRepeatIntervals("ACGTACGTACGT", counter, 2, 2, 0.5)
+        self.assertTrue(len(intervals) > 0)
+        self.assertEquals("acgtACGT", softMask("ACGTACGT", [ (0, 4) ]))
+
+    def testKmerSketch(self):
+        #The width is the first prime at least the number of k-mers
+        self.assertEquals(1009, getSketchWidth(10))
+        self.assertEquals(1000003, getSketchWidth(1000000))
+        sequence, repeatPositions = makeRepeatInjectedGenome(100000, 5, 300, 30, 0.02)
+        fileHandle = open(self.tempOutputFile, "w")
+        fastaWrite(fileHandle, "synthetic", sequence)
+        fileHandle.close()
+        counter = countKmers([ self.tempOutputFile ], 16)
+        self.assertTrue(counter.width >= 200000)
+        #The sketch read back has the same counts, and the files it counted
+        sketchFile = os.path.join(self.tempDir, "sketch")
+        fileHandle = open(sketchFile, "wb")
+        counter.write(fileHandle, [ self.tempOutputFile ])
+        fileHandle.close()
+        fileHandle = open(sketchFile, "rb")
+        counter2, sequenceFiles = readKmerCounter(fileHandle)
+        fileHandle.close()
+        self.assertEquals([ self.tempOutputFile ], sequenceFiles)
+        self.assertEquals((counter.kmerSize, counter.width, counter.depth, counter.step), (counter2.kmerSize, counter2.width, counter2.depth, counter2.step))
+        for i in xrange(0, len(sequence) - 16, 997):
+            self.assertEquals(counter.getCount(sequence[i:i+16]), counter2.getCount(sequence[i:i+16]))
+        #The sketch is read the same by a python whose built in hash is randomised
+        kmers = [ sequence[i:i+16] for i in xrange(0, len(sequence) - 16, 997) ]
+        counts = popenCatch("%s -R -c 'import sys; from cactus.preprocessor.cactus_kmerRepeatMask import readKmerCounter; " \
+                            "counter = readKmerCounter(open(sys.argv[1], \"rb\"))[0]; " \
+                            "print \" \".join([ str(counter.getCount(kmer)) for kmer in sys.argv[2:] ])' %s %s" % \
+                            (sys.executable, sketchFile, " ".join(kmers)))
+        self.assertEquals([ counter.getCount(kmer) for kmer in kmers ], [ int(i) for i in counts.split() ])
+        #The sketch is capped at maxMemory bytes, counting every step-th k-mer to fit
+        self.assertEquals(1009, getSketchWidth(1000000, maxWidth=1000))
+        self.assertEquals(1000003, getSketchWidth(1000000, maxWidth=getMaxSketchWidth(6000000)))
+        counter = countKmers([ self.tempOutputFile ], 16, maxMemory=60000)
+        self.assertTrue(counter.width * counter.depth * 2 <= 60000 + 1000)
+        self.assertTrue(counter.step >= 20)
+
+    def testEstimateRepeatDensity(self):
+        densities = []
+        for repeatFamilies in (0, 20):
+            sequence, repeatPositions = makeRepeatInjectedGenome(200000, repeatFamilies, 300, 30, 0.02)
+            fileHandle = open(self.tempOutputFile, "w")
+            fastaWrite(fileHandle, "synthetic", sequence)
+            fileHandle.close()
+            densities.append(estimateRepeatDensity([ self.tempOutputFile ], 100000))
+            self.assertTrue(densities[-1] <= 1.5 * float(len(repeatPositions)) / len(sequence) + 0.05)
+        self.assertTrue(densities[0] < 0.05)
+        self.assertTrue(densities[1] > densities[0] + 0.1)
+
+    def testSampleSequencePieces(self):
+        #Each of 10 files gets one of the 10 pieces, none of which includes a header or joins two sequences
+        sequenceFiles = []
+        for i in xrange(10):
+            sequenceFiles.append(os.path.join(self.tempDir, "chunk%i.fa" % i))
+            fileHandle = open(sequenceFiles[-1], "w")
+            fastaWrite(fileHandle, "a%i" % i, "A" * 20000)
+            fastaWrite(fileHandle, "c%i" % i, "C" * 20000)
+            fileHandle.close()
+        pieces = sampleSequencePieces(sequenceFiles, 100000, pieceSize=10000)
+        self.assertEquals(10, len(pieces))
+        for piece in pieces:
+            self.assertTrue(len(piece) > 0 and len(piece) <= 10000)
+            self.assertTrue(piece == "A" * len(piece) or piece == "C" * len(piece))
+        self.assertEquals([ "A" ] * 10, [ piece[0] for piece in pieces ])
+
+    def testKmerRepeatMaskBenchmark(self):
+        sequenceFile = os.path.join(self.tempDir, "synthetic.fa")
+        for length, repeatFamilies in ((100000, 5), (300000, 20)):
+            sequence, repeatPositions = makeRepeatInjectedGenome(length, repeatFamilies, 300, 30, 0.02)
+            fileHandle = open(sequenceFile, "w")
+            fastaWrite(fileHandle, "synthetic", sequence)
+            fileHandle.close()
+            injectedBases = set([ ("synthetic", i) for i in repeatPositions ])
+
+            results = {}
+            for name, command in (("lastz", "cactus_lastzRepeatMask.py --proportionSampled=1.0 --minPeriod=10 --lastzOpts='--step=3 --ambiguous=iupac,100,100 --ungapped --queryhsplimit=keep,nowarn:200' --fragment=200 %s %s"),
+                                  ("kmer", "cactus_kmerRepeatMask.py --proportionSampled=1.0 --minPeriod=10 %s %s")):
+                startTime = time.time()
+                popenPush(command % (sequenceFile, self.tempOutputFile), sequenceFile)
+                runTime = time.time() - startTime
+                maskedSequences = getSequences(self.tempOutputFile)
+                self.checkSequenceSetsEqualModuloSoftMasking(getSequences(sequenceFile), maskedSequences)
+                results[name] = (runTime, set([ (header, i) for (header, i, base) in getMaskedBases(maskedSequences) ]))
+
+            lastzTime, lastzMasked = results["lastz"]
+            kmerTime, kmerMasked = results["kmer"]
+            overlap = len(kmerMasked.intersection(lastzMasked))
+            print "For a synthetic genome of %i bases with %i repeat families (%i bases in repeats):" % (length, repeatFamilies, len(injectedBases)), \
+             " lastz masking took %s seconds and masked %i bases," % (lastzTime, len(lastzMasked)), \
+             " k-mer masking took %s seconds and masked %i bases," % (kmerTime, len(kmerMasked)), \
+             " the masked-base overlap is %i," % overlap, \
+             " the recall of injected repeats is %s (lastz) and %s (k-mer)" % (float(len(lastzMasked.intersection(injectedBases)))/len(injectedBases),
+                                                                                float(len(kmerMasked.intersection(injectedBases)))/len(injectedBases))
+            #Nearly all the injected repeats should be found, and little else
+            self.assertTrue(len(kmerMasked.intersection(injectedBases)) >= 0.8 * len(injectedBases))
+            self.assertTrue(len(kmerMasked - injectedBases) <= 0.1 * len(injectedBases))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,35 +25,105 @@ from sonLib.bioio import makeSubDir
 from sonLib.bioio import catFiles, getTempFile
 from jobTree.scriptTree.target import Target
 from jobTree.scriptTree.stack import Stack
-from cactus.shared.common import getOptionalAttrib, runCactusAnalyseAssembly
+from cactus.shared.common import getOptionalAttrib
+from cactus.preprocessor.cactus_kmerRepeatMask import estimateRepeatDensity
+from cactus.preprocessor.cactus_validateFasta import validateFasta, validateFastaFromConfig, getSequenceFiles
+from cactus.preprocessor.cactus_validateFasta import readCachedFastaStats, cacheFastaStats, formatFastaStats
 from sonLib.bioio import setLoggingFromOptions
 from cactus.shared.configWrapper import ConfigWrapper
 
 class PreprocessorOptions:
-    def __init__(self, chunkSize, cmdLine, memory, cpu, check, proportionToSample):
+    def __init__(self, chunkSize, cmdLine, memory, cpu, check, proportionToSample,
+                 adaptiveSampling=False, minProportionToSample=0.05, maxProportionToSample=0.5,
+                 targetCost=0, hspLimitPerGenome=None, repeatEstimateSampleSize=1000000):
         self.chunkSize = chunkSize
         self.cmdLine = cmdLine
         self.memory = memory
         self.cpu = cpu
         self.check = check
         self.proportionToSample=proportionToSample
+        self.adaptiveSampling = adaptiveSampling
+        self.minProportionToSample = minProportionToSample
+        self.maxProportionToSample = maxProportionToSample
+        self.targetCost = targetCost
+        self.hspLimitPerGenome = hspLimitPerGenome
+        self.repeatEstimateSampleSize = repeatEstimateSampleSize
+
+def chooseProportionToSample(genomeLength, repeatDensity, prepOptions):
+    """Chooses the proportion of a genome to sample for each chunk. The more repetitive the genome
+    the more of it is sampled, so that repeats are seen often enough to be masked, but the
+    sample is kept small enough that the cost of each chunk (the chunk size times the number of
+    bases sampled) is within the target cost, if one is given.
+    """
+    proportion = prepOptions.minProportionToSample + \
+        (prepOptions.maxProportionToSample - prepOptions.minProportionToSample) * min(1.0, 2.0 * repeatDensity)
+    if prepOptions.targetCost > 0 and genomeLength > 0:
+        proportion = min(proportion, float(prepOptions.targetCost) / (max(1, prepOptions.chunkSize) * genomeLength))
+    return max(prepOptions.minProportionToSample, min(1.0, proportion))
+
+def getHspLimit(proportionSampled, prepOptions):
+    """The number of hsps each query position of a chunk may have, which scales with the amount of
+    the genome sampled (so that the same repeats reach it) and bounds the work on repetitive chunks.
+    """
+    return int(max(1, math.ceil(prepOptions.hspLimitPerGenome * proportionSampled)))
+
+def getPreprocessorCommand(prepOptions, inChunk, outChunk, tempDir, proportionSampled, sketchPath=None):
+    """The preprocessor command for a chunk, with the place holders of the preprocessor string replaced.
+    """
+    cmdline = prepOptions.cmdLine.replace("IN_FILE", "\"" + inChunk + "\"")
+    cmdline = cmdline.replace("OUT_FILE", "\"" + outChunk + "\"")
+    cmdline = cmdline.replace("TEMP_DIR", "\"" + tempDir + "\"")
+    cmdline = cmdline.replace("PROPORTION_SAMPLED", str(proportionSampled))
+    if "HSP_LIMIT" in cmdline:
+        if prepOptions.hspLimitPerGenome is None:
+            raise RuntimeError("The preprocessor string uses HSP_LIMIT, but the preprocessor has no hspLimitPerGenome attribute: %s" % prepOptions.cmdLine)
+        cmdline = cmdline.replace("HSP_LIMIT", str(getHspLimit(proportionSampled, prepOptions)))
+    if sketchPath is not None:
+        cmdline = cmdline.replace("KMER_SKETCH", "\"" + sketchPath + "\"")
+    return cmdline
+
+def countKmersOnce(prepOptions, seqPaths, proportionSampled, sketchPath, tempDir):
+    """Runs the preprocessor command with --countKmers, so that it writes the k-mer counts of the
+    given sequences to the sketch that replaces KMER_SKETCH (see cactus_kmerRepeatMask.py).
+    """
+    cmdline = getPreprocessorCommand(prepOptions, seqPaths[0], os.devnull, tempDir, proportionSampled, sketchPath) + " --countKmers"
+    logger.info("Preprocessor k-mer counting exec " + cmdline)
+    popenPush(cmdline, " ".join(seqPaths))
+
+class CountKmers(Target):
+    """Counts the k-mers of a sample of the chunks of a sequence once, for the preprocessor commands
+    of all the chunks to read, rather than each counting its own sample.
+    """
+    def __init__(self, prepOptions, seqPaths, proportionSampled, sketchPath):
+        Target.__init__(self, memory=prepOptions.memory, cpu=prepOptions.cpu)
+        self.prepOptions = prepOptions
+        self.seqPaths = seqPaths
+        self.proportionSampled = proportionSampled
+        self.sketchPath = sketchPath
+
+    def run(self):
+        countKmersOnce(self.prepOptions, self.seqPaths, self.proportionSampled, self.sketchPath, self.getLocalTempDir())
 
 class PreprocessChunk(Target):
     """ locally preprocess a fasta chunk, output then copied back to input
     """
-    def __init__(self, prepOptions, seqPaths, proportionSampled, inChunk, outChunk):
+    def __init__(self, prepOptions, seqPaths, proportionSampled, inChunk, outChunk, sketchPath=None):
         Target.__init__(self, memory=prepOptions.memory, cpu=prepOptions.cpu)
         self.prepOptions = prepOptions 
         self.seqPaths = seqPaths
         self.inChunk = inChunk
         self.outChunk = outChunk
         self.proportionSampled = proportionSampled
+        self.sketchPath = sketchPath
     
     def run(self):
-        cmdline = self.prepOptions.cmdLine.replace("IN_FILE", "\"" + self.inChunk + "\"")
-        cmdline = cmdline.replace("OUT_FILE", "\"" + self.outChunk + "\"")
-        cmdline = cmdline.replace("TEMP_DIR", "\"" + self.getLocalTempDir() + "\"")
-        cmdline = cmdline.replace("PROPORTION_SAMPLED", str(self.proportionSampled))
+        sketchPath = self.sketchPath
+        if "KMER_SKETCH" in self.prepOptions.cmdLine and sketchPath is None:
+            #No sketch was counted for the chunks, so count one for this chunk alone
+            sketchPath = os.path.join(self.getLocalTempDir(), "kmerSketch")
+            countKmersOnce(self.prepOptions, self.seqPaths, self.proportionSampled, sketchPath, self.getLocalTempDir())
+        cmdline = getPreprocessorCommand(self.prepOptions, self.inChunk, self.outChunk, self.getLocalTempDir(),
+                                         self.proportionSampled, sketchPath)
         logger.info("Preprocessor exec " + cmdline)
         #print "command", cmdline
         #sys.exit(1)
@@ -74,12 +144,12 @@ class MergeChunks(Target):
         popenPush("cactus_batch_mergeChunks > %s" % self.outSequencePath, " ".join(self.chunkList))
  
 class PreprocessSequence(Target):
-    """Cut a sequence into chunks, process, then merge
+    """Cut a sequence, which may be split over several files, into chunks, process, then merge
     """
-    def __init__(self, prepOptions, inSequencePath, outSequencePath):
+    def __init__(self, prepOptions, inSequencePaths, outSequencePath):
         Target.__init__(self, cpu=prepOptions.cpu)
         self.prepOptions = prepOptions 
-        self.inSequencePath = inSequencePath
+        self.inSequencePaths = inSequencePaths
         self.outSequencePath = outSequencePath
     
     def run(self):        
@@ -88,14 +158,48 @@ class PreprocessSequence(Target):
         inChunkDirectory = makeSubDir(os.path.join(self.getGlobalTempDir(), "preprocessChunksIn"))
         inChunkList = [ chunk for chunk in popenCatch("cactus_blast_chunkSequences %s %i 0 %s %s" % \
                (getLogLevelString(), self.prepOptions.chunkSize,
-                inChunkDirectory, self.inSequencePath)).split("\n") if chunk != "" ]   
+                inChunkDirectory, " ".join(self.inSequencePaths))).split("\n") if chunk != "" ]   
         outChunkDirectory = makeSubDir(os.path.join(self.getGlobalTempDir(), "preprocessChunksOut"))
-        outChunkList = [] 
+        proportionToSample = self.prepOptions.proportionToSample
+        if self.prepOptions.adaptiveSampling:
+            #Estimate the repeat content from small pieces spread evenly across the chunks and choose the proportion to sample from it
+            genomeLength = sum([ os.path.getsize(inSequencePath) for inSequencePath in self.inSequencePaths ])
+            repeatDensity = estimateRepeatDensity(inChunkList, self.prepOptions.repeatEstimateSampleSize)
+            proportionToSample = chooseProportionToSample(genomeLength, repeatDensity, self.prepOptions)
+            hspLimitString = ""
+            if self.prepOptions.hspLimitPerGenome is not None:
+                hspLimitString = ", hsp limit per chunk: %i" % getHspLimit(proportionToSample, self.prepOptions)
+            self.logToMaster("Adaptive sampling for %s (about %i bases in %i chunks): estimated repeat density: %f, proportion to sample: %f%s" % \
+                             (" ".join(self.inSequencePaths), genomeLength, len(inChunkList), repeatDensity, proportionToSample, hspLimitString))
+        #Calculate the number of chunks to use
+        inChunkNumber = int(max(1, math.ceil(len(inChunkList) * proportionToSample)))
+        sketchPath = None
+        if "KMER_SKETCH" in self.prepOptions.cmdLine and len(inChunkList) > 0:
+            #Count the k-mers of the same number of chunks, evenly spaced along the sequence, once for all the chunks
+            sketchPath = os.path.join(self.getGlobalTempDir(), "kmerSketch")
+            sampleChunks = [ inChunkList[(k * len(inChunkList)) / inChunkNumber] for k in xrange(inChunkNumber) ]
+            self.addChildTarget(CountKmers(self.prepOptions, sampleChunks, float(inChunkNumber)/len(inChunkList), sketchPath))
+        self.setFollowOnTarget(PreprocessChunks(self.prepOptions, inChunkList, inChunkNumber, outChunkDirectory, self.outSequencePath, sketchPath))
+
+class PreprocessChunks(Target):
+    """Preprocess each chunk of a sequence, then merge them
+    """
+    def __init__(self, prepOptions, inChunkList, inChunkNumber, outChunkDirectory, outSequencePath, sketchPath=None):
+        Target.__init__(self, cpu=prepOptions.cpu)
+        self.prepOptions = prepOptions
+        self.inChunkList = inChunkList
+        self.inChunkNumber = inChunkNumber
+        self.outChunkDirectory = outChunkDirectory
+        self.outSequencePath = outSequencePath
+        self.sketchPath = sketchPath
+
+    def run(self):
+        inChunkList = self.inChunkList
+        inChunkNumber = self.inChunkNumber
+        outChunkList = []
         #For each input chunk we create an output chunk, it is the output chunks that get concatenated together.
         for i in xrange(len(inChunkList)):
-            outChunkList.append(os.path.join(outChunkDirectory, "chunk_%i" % i))
-            #Calculate the number of chunks to use
-            inChunkNumber = int(max(1, math.ceil(len(inChunkList) * self.prepOptions.proportionToSample)))
+            outChunkList.append(os.path.join(self.outChunkDirectory, "chunk_%i" % i))
             assert inChunkNumber <= len(inChunkList) and inChunkNumber > 0
             #Now get the list of chunks flanking and including the current chunk
             j = max(0, i - inChunkNumber/2)
@@ -103,16 +207,16 @@ class PreprocessSequence(Target):
             if len(inChunks) < inChunkNumber: #This logic is like making the list circular
                 inChunks += inChunkList[:inChunkNumber-len(inChunks)]
             assert len(inChunks) == inChunkNumber
-            self.addChildTarget(PreprocessChunk(self.prepOptions, inChunks, float(inChunkNumber)/len(inChunkList), inChunkList[i], outChunkList[i]))
+            self.addChildTarget(PreprocessChunk(self.prepOptions, inChunks, float(inChunkNumber)/len(inChunkList), inChunkList[i], outChunkList[i], self.sketchPath))
         # follow on to merge chunks
         self.setFollowOnTarget(MergeChunks(self.prepOptions, outChunkList, self.outSequencePath))
 
 class BatchPreprocessor(Target):
-    def __init__(self, prepXmlElems, inSequence, 
+    def __init__(self, prepXmlElems, inSequences, 
                  globalOutSequence, iteration = 0):
         Target.__init__(self, time=0.0002) 
         self.prepXmlElems = prepXmlElems
-        self.inSequence = inSequence
+        self.inSequences = inSequences
         self.globalOutSequence = globalOutSequence
         prepNode = self.prepXmlElems[iteration]
         self.memory = getOptionalAttrib(prepNode, "memory", typeFn=int, default=sys.maxint)
@@ -129,7 +233,13 @@ class BatchPreprocessor(Target):
                                           int(self.memory),
                                           int(self.cpu),
                                           bool(int(prepNode.get("check", default="0"))),
-                                          getOptionalAttrib(prepNode, "proportionToSample", typeFn=float, default=1.0))
+                                          getOptionalAttrib(prepNode, "proportionToSample", typeFn=float, default=1.0),
+                                          adaptiveSampling=getOptionalAttrib(prepNode, "adaptiveSampling", typeFn=bool, default=False),
+                                          minProportionToSample=getOptionalAttrib(prepNode, "minProportionToSample", typeFn=float, default=0.05),
+                                          maxProportionToSample=getOptionalAttrib(prepNode, "maxProportionToSample", typeFn=float, default=0.5),
+                                          targetCost=getOptionalAttrib(prepNode, "targetCost", typeFn=float, default=0),
+                                          hspLimitPerGenome=getOptionalAttrib(prepNode, "hspLimitPerGenome", typeFn=int, default=None),
+                                          repeatEstimateSampleSize=getOptionalAttrib(prepNode, "repeatEstimateSampleSize", typeFn=int, default=1000000))
         
         #output to temporary directory unless we are on the last iteration
         lastIteration = self.iteration == len(self.prepXmlElems) - 1
@@ -139,12 +249,18 @@ class BatchPreprocessor(Target):
             outSeq = self.globalOutSequence
         
         if prepOptions.chunkSize <= 0: #In this first case we don't need to break up the sequence
-            self.addChildTarget(PreprocessChunk(prepOptions, [ self.inSequence ], 1.0, self.inSequence, outSeq))
-        else:
-            self.addChildTarget(PreprocessSequence(prepOptions, self.inSequence, outSeq)) 
+            if len(self.inSequences) > 1: #But the preprocessor needs it in a single file
+                inSequence = getTempFile(rootDir=self.getGlobalTempDir())
+                catFiles(self.inSequences, inSequence)
+                logger.info("Concatenated %i input files for preprocessor: %s" % (len(self.inSequences), prepOptions.cmdLine))
+            else:
+                inSequence = self.inSequences[0]
+            self.addChildTarget(PreprocessChunk(prepOptions, [ inSequence ], 1.0, inSequence, outSeq))
+        else: #The chunker reads the input files in turn, so they need not be concatenated
+            self.addChildTarget(PreprocessSequence(prepOptions, self.inSequences, outSeq)) 
         
         if lastIteration == False:
-            self.setFollowOnTarget(BatchPreprocessor(self.prepXmlElems, outSeq,
+            self.setFollowOnTarget(BatchPreprocessor(self.prepXmlElems, [ outSeq ],
                                                      self.globalOutSequence, self.iteration + 1))
         else:
             self.setFollowOnTarget(BatchPreprocessorEnd(self.globalOutSequence))
@@ -155,8 +271,9 @@ class BatchPreprocessorEnd(Target):
         self.globalOutSequence = globalOutSequence
         
     def run(self):
-        analysisString = runCactusAnalyseAssembly(self.globalOutSequence)
-        self.logToMaster("After preprocessing assembly we got the following stats: %s" % analysisString)
+        stats = validateFasta([ self.globalOutSequence ], sample=self.globalOutSequence)
+        cacheFastaStats(stats, self.globalOutSequence)
+        self.logToMaster("After preprocessing assembly we got the following stats: %s" % stats)
 
 ############################################################
 ############################################################
@@ -199,26 +316,41 @@ class CactusPreprocessor2(Target):
         
     def run(self):
         #If the files are in a sub-dir then rip them out.
-        if os.path.isdir(self.inputSequenceFileOrDirectory):
-            tempFile = getTempFile(rootDir=self.getGlobalTempDir())
-            catFiles([ os.path.join(self.inputSequenceFileOrDirectory, f) for f in os.listdir(self.inputSequenceFileOrDirectory)], tempFile)
-            inputSequenceFile = tempFile
-        else:
-            inputSequenceFile = self.inputSequenceFileOrDirectory
-            
-        assert inputSequenceFile != self.outputSequenceFile
+        inputSequenceFiles = getSequenceFiles(self.inputSequenceFileOrDirectory)
+        assert self.outputSequenceFile not in inputSequenceFiles
         
         prepXmlElems = self.configNode.findall("preprocessor")
+        validationNode = self.configNode.find("fastaValidation")
         
-        analysisString = runCactusAnalyseAssembly(inputSequenceFile)
-        self.logToMaster("Before running any preprocessing on the assembly: %s got following stats (assembly may be listed as temp file if input sequences from a directory): %s" % \
-                         (self.inputSequenceFileOrDirectory, analysisString))
+        #The headers are checked, small sequences filtered and the stats collected in one pass
+        #over the input. The files of a directory are read in turn rather than being concatenated
+        #into a temporary copy.
+        if len(prepXmlElems) == 0: #Just write the sequences to the output file
+            outputFile = self.outputSequenceFile
+        elif getOptionalAttrib(validationNode, "minLength", typeFn=int, default=0) > 0:
+            outputFile = getTempFile(rootDir=self.getGlobalTempDir())
+        else:
+            outputFile = None #The input files can be used as they are
+        cachedStats = readCachedFastaStats(self.inputSequenceFileOrDirectory)
+        if outputFile is None and validationNode is None and cachedStats is not None: #Nothing to check, so no need to read the input
+            statsString = formatFastaStats(cachedStats)
+        else:
+            stats = validateFastaFromConfig(inputSequenceFiles, validationNode, outputFile=outputFile,
+                                            sample=self.inputSequenceFileOrDirectory)
+            if cachedStats is None and getOptionalAttrib(validationNode, "minLength", typeFn=int, default=0) <= 0:
+                cacheFastaStats(stats, self.inputSequenceFileOrDirectory) #Can be reused in the next run, e.g. for outgroup selection
+            statsString = str(stats)
+        self.logToMaster("Before running any preprocessing on the assembly: %s got following stats: %s" % \
+                         (self.inputSequenceFileOrDirectory, statsString))
         
-        if len(prepXmlElems) == 0: #Just cp the file to the output file
-            system("cp %s %s" % (inputSequenceFile, self.outputSequenceFile))
+        if len(prepXmlElems) == 0: #The stats are of the sequences written to the output file
+            stats.sample = self.outputSequenceFile
+            cacheFastaStats(stats, self.outputSequenceFile)
         else:
+            if outputFile is not None:
+                inputSequenceFiles = [ outputFile ]
             logger.info("Adding child batch_preprocessor target")
-            self.addChildTarget(BatchPreprocessor(prepXmlElems, inputSequenceFile, self.outputSequenceFile, 0))
+            self.addChildTarget(BatchPreprocessor(prepXmlElems, inputSequenceFiles, self.outputSequenceFile, 0))
                     
 def main():
     usage = "usage: %prog outputSequenceDir configXMLFile inputSequenceFastaFilesxN [options]"
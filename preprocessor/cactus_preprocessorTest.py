@@ -1,7 +1,7 @@
 from cactus.preprocessor.preprocessorTest import *
 from cactus.preprocessor.preprocessorTest import TestCase as PreprocessorTestCase
 from cactus.shared.common import cactusRootPath
-from cactus.preprocessor.cactus_preprocessor import CactusPreprocessor
+from cactus.preprocessor.cactus_preprocessor import CactusPreprocessor, PreprocessorOptions, chooseProportionToSample, getHspLimit, getPreprocessorCommand
 import xml.etree.ElementTree as ET
 
 """Runs cactus preprocessor using the lastz repeat mask script to show it working.
@@ -61,6 +61,26 @@ class TestCase(PreprocessorTestCase):
             print " The number of bases masked after running lastz repeat masking without the preprocessor is: ", len(maskedBasesLastzMaskedFast), \
              " the recall of the fast vs. the new is: ", i/len(maskedBasesLastzMasked), \
              " the precision of the fast vs. the new is: ", i/len(maskedBasesLastzMaskedFast)
+
+    def testChooseProportionToSample(self):
+        prepOptions = PreprocessorOptions(3000000, "", 0, 1, False, 0.2, adaptiveSampling=True,
+                                          minProportionToSample=0.05, maxProportionToSample=0.5,
+                                          targetCost=2e15, hspLimitPerGenome=7500)
+        #Repeat poor genomes are sampled less than repeat rich ones
+        self.assertAlmostEquals(chooseProportionToSample(100000000, 0.0, prepOptions), 0.05)
+        self.assertTrue(chooseProportionToSample(100000000, 0.1, prepOptions) < chooseProportionToSample(100000000, 0.2, prepOptions))
+        self.assertAlmostEquals(chooseProportionToSample(100000000, 0.6, prepOptions), 0.5)
+        #But the sample is capped by the target cost, though not below the minimum proportion
+        self.assertAlmostEquals(chooseProportionToSample(3000000000, 0.6, prepOptions), 2e15/(3000000*3000000000.0))
+        self.assertAlmostEquals(chooseProportionToSample(30000000000, 0.6, prepOptions), 0.05)
+        #The hsp limit scales with the proportion sampled
+        self.assertEquals(getHspLimit(0.2, prepOptions), 1500)
+        self.assertEquals(getHspLimit(1.0, prepOptions), 7500)
+
+    def testGetPreprocessorCommand(self):
+        prepOptions = PreprocessorOptions(3000000, "cactus_kmerRepeatMask.py --proportionSampled=PROPORTION_SAMPLED --sketch=KMER_SKETCH IN_FILE OUT_FILE", 0, 1, False, 0.2)
+        self.assertEquals("cactus_kmerRepeatMask.py --proportionSampled=0.25 --sketch=\"sketch\" \"in\" \"out\"",
+                          getPreprocessorCommand(prepOptions, "in", "out", "tmp", 0.25, "sketch"))
         
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+## CHECK THE HEADERS OF, OPTIONALLY FILTER AND COLLECT STATISTICS ON
+## A SET OF FASTA FILES IN A SINGLE PASS.
+
+############################################################
+##  NOTE:   This combines cactus_checkUniqueHeaders.py,
+##          cactus_filterSmallFastaSequences.py and
+##          cactus_analyseAssembly so that each genome is
+##          only read once. The statistics are written to a
+##          json "sidecar" file which later steps can read
+##          instead of re-reading the sequences, as long as
+##          the sizes and modification times of the sequence
+##          files are unchanged.
+############################################################
+
+import os
+import sys
+import string
+import json
+import multiprocessing
+from optparse import OptionParser
+
+from sonLib.bioio import fastaRead
+from sonLib.bioio import fastaWrite
+from cactus.shared.common import getOptionalAttrib
+
+class FastaStats:
+    """Statistics on a set of sequences, matching those reported by cactus_analyseAssembly.
+    """
+    def __init__(self, sample=""):
+        self.sample = sample
+        self.sequenceLengths = []
+        self.repeatBases = 0
+        self.nBases = 0
+        self.gcBases = 0
+
+    def addSequence(self, sequence):
+        length = len(sequence)
+        self.sequenceLengths.append(length)
+        #Everything but the upper case, non-N bases is counted as masked, as in cactus_analyseAssembly
+        nBases = sequence.count('N') + sequence.count('n')
+        upperBases = length - len(sequence.translate(None, string.ascii_uppercase)) - sequence.count('N')
+        self.repeatBases += length - upperBases
+        self.nBases += nBases
+        self.gcBases += sum([ sequence.count(base) for base in "GCgc" ])
+
+    def toDict(self):
+        lengths = sorted(self.sequenceLengths)
+        totalSequences = len(lengths)
+        totalLength = sum(lengths)
+        n50 = 0
+        j = 0
+        for length in reversed(lengths):
+            n50 = length
+            j += length
+            if j >= totalLength/2:
+                break
+        return { "sample":self.sample,
+                 "totalSequences":totalSequences,
+                 "totalLength":totalLength,
+                 "proportionRepeatMasked":float(self.repeatBases)/totalLength if totalLength > 0 else 0.0,
+                 "proportionNs":float(self.nBases)/totalLength if totalLength > 0 else 0.0,
+                 "totalNs":self.nBases,
+                 "proportionGC":float(self.gcBases)/(totalLength - self.nBases) if totalLength > self.nBases else 0.0,
+                 "n50":n50,
+                 "medianSequenceLength":lengths[totalSequences/2] if totalSequences > 0 else 0,
+                 "maxSequenceLength":lengths[-1] if totalSequences > 0 else 0,
+                 "minSequenceLength":lengths[0] if totalSequences > 0 else 0 }
+
+    def __str__(self):
+        return formatFastaStats(self.toDict())
+
+def formatFastaStats(stats):
+    """Formats the stats in the same way as cactus_analyseAssembly (plus the GC content), so that
+    log parsers work with either.
+    """
+    return "Input-sample: %(sample)s Total-sequences: %(totalSequences)i Total-length: %(totalLength)i Proportion-repeat-masked: %(proportionRepeatMasked)f ProportionNs: %(proportionNs)f Total-Ns: %(totalNs)i N50: %(n50)i Median-sequence-length: %(medianSequenceLength)i Max-sequence-length: %(maxSequenceLength)i Min-sequence-length: %(minSequenceLength)i Proportion-GC: %(proportionGC)f" % stats
+
+def getFastaStatsFile(sequencePath):
+    """The name of the sidecar file holding the stats for a sequence file or directory of sequence files.
+    """
+    return sequencePath.rstrip("/") + ".stats"
+
+def getSequenceFiles(sequencePath):
+    """The list of fasta files of a genome, which is either a single file or a directory of files.
+    """
+    if os.path.isdir(sequencePath):
+        return [ os.path.join(sequencePath, f) for f in os.listdir(sequencePath) ]
+    if not os.path.isfile(sequencePath):
+        raise RuntimeError("Unable to open sequence file %s" % sequencePath)
+    return [ sequencePath ]
+
+def getFastaStatsKey(sequencePath):
+    """The sizes and modification times of the files of a genome, used to check that stats are up to date.
+    """
+    key = []
+    for sequenceFile in sorted(getSequenceFiles(sequencePath)):
+        fileStats = os.stat(sequenceFile)
+        key.append([ os.path.basename(sequenceFile), fileStats.st_size, fileStats.st_mtime ])
+    return key
+
+def writeFastaStats(stats, statsFile, key=None):
+    fileHandle = open(statsFile, "w")
+    json.dump({ "key":key, "stats":stats.toDict() }, fileHandle)
+    fileHandle.close()
+
+def readFastaStats(statsFile):
+    """Returns the dictionary of stats written by writeFastaStats.
+    """
+    fileHandle = open(statsFile, "r")
+    stats = json.load(fileHandle)["stats"]
+    fileHandle.close()
+    return stats
+
+def readCachedFastaStats(sequencePath):
+    """Returns the stats in the sidecar file of the genome, or None if there is no sidecar
+    file or the genome has changed since it was written.
+    """
+    statsFile = getFastaStatsFile(sequencePath)
+    if not os.path.isfile(statsFile):
+        return None
+    try:
+        fileHandle = open(statsFile, "r")
+        cache = json.load(fileHandle)
+        fileHandle.close()
+    except (IOError, ValueError):
+        return None
+    if cache.get("key") != getFastaStatsKey(sequencePath):
+        return None
+    return cache["stats"]
+
+def cacheFastaStats(stats, sequencePath):
+    """Writes the stats of the genome to its sidecar file, if the location is writable.
+    """
+    try:
+        writeFastaStats(stats, getFastaStatsFile(sequencePath), key=getFastaStatsKey(sequencePath))
+    except (IOError, OSError):
+        pass
+
+def getFastaStats(sequencePath):
+    """Returns the stats of the genome, from its sidecar file if up to date, otherwise by
+    reading the genome (and then caching the stats).
+    """
+    stats = readCachedFastaStats(sequencePath)
+    if stats is None:
+        fastaStats = validateFasta(getSequenceFiles(sequencePath), sample=sequencePath)
+        cacheFastaStats(fastaStats, sequencePath)
+        stats = fastaStats.toDict()
+    return stats
+
+def getFastaStatsInParallel(sequencePaths, processes=None):
+    """Returns a map of each genome to its stats. The genomes without up to date stats in their
+    sidecar files are read in parallel, using a pool of the given number of processes (by
+    default the number of cpus).
+    """
+    statsMap = dict([ (sequencePath, readCachedFastaStats(sequencePath)) for sequencePath in sequencePaths ])
+    uncachedPaths = [ sequencePath for sequencePath in statsMap.keys() if statsMap[sequencePath] is None ]
+    if len(uncachedPaths) > 1 and processes != 1:
+        pool = multiprocessing.Pool(processes=min(len(uncachedPaths), processes or multiprocessing.cpu_count()))
+        try:
+            statsList = pool.map(getFastaStats, uncachedPaths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        statsList = map(getFastaStats, uncachedPaths)
+    statsMap.update(zip(uncachedPaths, statsList))
+    return statsMap
+
+class HeaderChecker:
+    """Checks the first word of each fasta header is unique and, optionally, is made of
+    characters acceptable for the outputs.
+    """
+    def __init__(self, checkAlphaNumeric=False, checkUCSC=False, checkAssemblyHub=False):
+        self.checkAlphaNumeric = checkAlphaNumeric
+        self.checkUCSC = checkUCSC
+        self.checkAssemblyHub = checkAssemblyHub
+        self.seen = set()
+
+    def checkHeader(self, header):
+        mungedHeader = header.split()[0] if len(header.split()) > 0 else ""
+        if self.checkAlphaNumeric and "".join([ i for i in mungedHeader if str.isalnum(i) ]) != mungedHeader: #Check is only alpha numeric
+            raise RuntimeError("We found a non-alpha numeric character in the fasta header, and the config file (checkAlphaNumeric option) demands that all fasta headers be alpha numeric: %s" % header)
+        if self.checkUCSC:
+            mungedHeader = mungedHeader.split('.')[-1]
+            if "".join([ i for i in mungedHeader if (str.isalnum(i) or i == '_' or i == '-' or i == ':') ]) != mungedHeader:
+                raise RuntimeError("We found a non-alpha numeric, '-', ':' or '_' prefix in the fasta header (UCSC Names option), please modify the first word after the '>' and after the last '.' in every fasta header to only contain alpha-numeric, '_', ':' or '-' characters, or consider using a more lenient option like --checkForAssemblyHub. The offending header: %s" % header)
+        if self.checkAssemblyHub:
+            if "".join([ i for i in mungedHeader if (str.isalnum(i) or i == '_' or i == '-' or i == ':' or i == ".") ]) != mungedHeader:
+                raise RuntimeError("An invalid character was found in the first word of a fasta header. Acceptable characters for headers in an assembly hub include alphanumeric characters plus '_', '-', ':', and '.'. Please modify your headers to eliminate other characters. The offending header: %s" % header)
+        if mungedHeader in self.seen:
+            raise RuntimeError("We found a duplicated fasta header, the first word of each fasta header should be unique within each genome, as this is a requirement for the output HAL file or any MAF file subsequently created. Please modify the input fasta file. Offending duplicate header: %s" % header)
+        self.seen.add(mungedHeader)
+
+def _parseChunkHeader(header):
+    """Returns the (name, offset) of a header in the "name|1|offset" format of cactus_batchChunk,
+    else None.
+    """
+    idx = header.find('|1|')
+    if idx == -1 or header[idx+3:].isdigit() == False:
+        return None
+    return header[:idx], int(header[idx+3:])
+
+class SmallSequenceFilter:
+    """Streaming equivalent of cactus_filterSmallFastaSequences.py. Sequences shorter than minLength
+    are removed. If the headers are in chunk format the length is that of the whole sequence the
+    chunks were cut from, and a sequence is only removed if it is followed by a differently named
+    one, so chunks of the same name are buffered until the name changes.
+    """
+    def __init__(self, minLength, outputFn):
+        self.minLength = minLength
+        self.outputFn = outputFn
+        self.chunkFormat = None
+        self.name = None
+        self.buffer = []
+        self.length = 0
+        self.hasStart = False
+
+    def addSequence(self, header, sequence):
+        chunk = _parseChunkHeader(header)
+        if self.chunkFormat is None:
+            self.chunkFormat = chunk is not None
+        if not self.chunkFormat:
+            if len(sequence) >= self.minLength:
+                self.outputFn(header, sequence)
+            return
+        if chunk is None:
+            raise RuntimeError("Fasta headers are a mixture of chunk and non-chunk formats: %s" % header)
+        name, offset = chunk
+        if name != self.name:
+            self._flush(True)
+            self.name = name
+        if offset == 0:
+            self.hasStart = True
+        self.length = max(self.length, offset + len(sequence))
+        self.buffer.append((header, sequence))
+        if self.length >= self.minLength: #Long enough to be kept, so there is no need to buffer it
+            for header, sequence in self.buffer:
+                self.outputFn(header, sequence)
+            self.buffer = []
+
+    def _flush(self, contained):
+        if not (contained and self.hasStart and self.length < self.minLength):
+            for header, sequence in self.buffer:
+                self.outputFn(header, sequence)
+        self.buffer = []
+        self.length = 0
+        self.hasStart = False
+
+    def finish(self):
+        #The last sequence is not followed by another, so is kept
+        self._flush(False)
+
+def fastaReadFiles(inputFiles):
+    """Iterates over the (header, sequence) pairs of a list of fasta files in turn, as if they
+    were a single concatenated file.
+    """
+    for inputFile in inputFiles:
+        fileHandle = open(inputFile, "r")
+        for header, sequence in fastaRead(fileHandle):
+            yield header, sequence
+        fileHandle.close()
+
+def validateFasta(inputFiles, outputFile=None, statsFile=None, sample=None,
+                  checkAlphaNumeric=False, checkUCSC=False, checkAssemblyHub=False,
+                  minLength=0):
+    """Reads the input fasta files once, checking the headers, removing sequences shorter than
+    minLength and collecting stats on the remaining sequences. The remaining sequences are written
+    to outputFile and the stats to statsFile, if given. Returns the FastaStats.
+    """
+    if outputFile is not None and os.path.realpath(outputFile) in [ os.path.realpath(inputFile) for inputFile in inputFiles ]:
+        raise RuntimeError("The output file %s is one of the input files" % outputFile)
+    stats = FastaStats(sample if sample is not None else " ".join(inputFiles))
+    headerChecker = HeaderChecker(checkAlphaNumeric, checkUCSC, checkAssemblyHub)
+    outputFileHandle = open(outputFile, "w") if outputFile is not None else None
+    def outputFn(header, sequence):
+        stats.addSequence(sequence)
+        if outputFileHandle is not None:
+            fastaWrite(outputFileHandle, header, sequence)
+    sequenceFilter = SmallSequenceFilter(minLength, outputFn)
+    for header, sequence in fastaReadFiles(inputFiles):
+        headerChecker.checkHeader(header)
+        if minLength > 0:
+            sequenceFilter.addSequence(header, sequence)
+        else:
+            outputFn(header, sequence)
+    sequenceFilter.finish()
+    if outputFileHandle is not None:
+        outputFileHandle.close()
+    if statsFile is not None:
+        writeFastaStats(stats, statsFile)
+    return stats
+
+def validateFastaFromConfig(inputFiles, validationNode, outputFile=None, statsFile=None, sample=None):
+    """Runs validateFasta using the options in a "fastaValidation" config element (which may be None, in which
+    case only the stats are collected).
+    """
+    return validateFasta(inputFiles, outputFile=outputFile, statsFile=statsFile, sample=sample,
+                         checkAlphaNumeric=getOptionalAttrib(validationNode, "checkAlphaNumeric", typeFn=bool, default=False),
+                         checkUCSC=getOptionalAttrib(validationNode, "checkUCSCNames", typeFn=bool, default=False),
+                         checkAssemblyHub=getOptionalAttrib(validationNode, "checkAssemblyHub", typeFn=bool, default=False),
+                         minLength=getOptionalAttrib(validationNode, "minLength", typeFn=int, default=0))
+
+def main():
+    ##########################################
+    #Construct the arguments.
+    ##########################################
+
+    usage = "usage: %prog [options] <fasta input file>xN\n\n" + \
+            "    <fasta file>:  fasta sequences to check, filter and collect stats on\n"
+    description = "Check fasta headers, filter small sequences and report stats in a single pass\n"
+    parser = OptionParser(usage=usage, description=description)
+
+    parser.add_option("--checkAlphaNumeric", dest="checkAlphaNumeric", action="store_true",
+                      help="Checks that the first word contains only alphanumeric characters, periods or underscores.",
+                      default=False)
+
+    parser.add_option("--checkUCSCNames", dest="checkUCSC", action="store_true",
+                      help="Checks that suffix of the first word after the last '.' character contains only alpha-numeric characters or underscores and is unique. This is useful if exporting to MAF, where sequences are named 'genome.chr'.",
+                      default=False)
+
+    parser.add_option("--checkAssemblyHub", dest="checkAssemblyHub",
+                      action="store_true", help="Checks that the first word "
+                      "of each header is able to be used in a UCSC Assembly "
+                      "Hub.", default=False)
+
+    parser.add_option("--minLength", dest="minLength", type="int",
+                      help="filter sequences shorter than length [default=0]",
+                      default=0)
+
+    parser.add_option("--outputFile", dest="outputFile",
+                      help="Write the (filtered) sequences to this file",
+                      default=None)
+
+    parser.add_option("--statsFile", dest="statsFile",
+                      help="Write the stats as json to this file",
+                      default=None)
+
+    options, args = parser.parse_args()
+
+    if len(args) == 0:
+        parser.print_help()
+        return 1
+
+    stats = validateFasta(args, outputFile=options.outputFile, statsFile=options.statsFile,
+                          checkAlphaNumeric=options.checkAlphaNumeric, checkUCSC=options.checkUCSC,
+                          checkAssemblyHub=options.checkAssemblyHub, minLength=options.minLength)
+    print str(stats)
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,111 @@
+from cactus.preprocessor.preprocessorTest import *
+from cactus.preprocessor.preprocessorTest import TestCase as PreprocessorTestCase
+from cactus.preprocessor.cactus_validateFasta import validateFasta, readFastaStats, fastaReadFiles
+from cactus.preprocessor.cactus_validateFasta import getFastaStats, getFastaStatsInParallel, readCachedFastaStats
+from cactus.preprocessor.cactus_filterSmallFastaSequences import containedSequences, tooShort
+from sonLib.bioio import fastaWrite
+import random
+
+"""Tests the single pass fasta validation against the separate header checking and small
+sequence filtering scripts it replaces.
+"""
+
+class FilterOptions:
+    def __init__(self, length):
+        self.length = length
+
+class TestCase(PreprocessorTestCase):
+    def writeSequences(self, sequences):
+        sequenceFile = os.path.join(self.tempDir, "input.fa")
+        fileHandle = open(sequenceFile, "w")
+        for header, sequence in sequences:
+            fastaWrite(fileHandle, header, sequence)
+        fileHandle.close()
+        return sequenceFile
+
+    def testStats(self):
+        sequenceFile = self.writeSequences([ ("a", "ACGTacgtNN"), ("b", "GGCC"), ("c", "A"*20) ])
+        statsFile = os.path.join(self.tempDir, "input.stats")
+        stats = validateFasta([ sequenceFile ], statsFile=statsFile).toDict()
+        self.assertEquals(stats, readFastaStats(statsFile))
+        self.assertEquals(stats["totalSequences"], 3)
+        self.assertEquals(stats["totalLength"], 34)
+        self.assertEquals(stats["totalNs"], 2)
+        self.assertAlmostEquals(stats["proportionRepeatMasked"], 6.0/34)
+        self.assertAlmostEquals(stats["proportionGC"], 8.0/32)
+        self.assertEquals(stats["n50"], 20)
+        self.assertEquals(stats["maxSequenceLength"], 20)
+        self.assertEquals(stats["minSequenceLength"], 4)
+
+    def testMultipleFiles(self):
+        #A genome split over several files is read as if the files were concatenated
+        sequences = [ ("seq%i" % i, "ACGT"*(i+1)) for i in xrange(10) ]
+        sequenceFiles = []
+        for i in xrange(0, len(sequences), 3):
+            sequenceFiles.append(os.path.join(self.tempDir, "input_%i.fa" % i))
+            fileHandle = open(sequenceFiles[-1], "w")
+            for header, sequence in sequences[i:i+3]:
+                fastaWrite(fileHandle, header, sequence)
+            fileHandle.close()
+        self.assertEquals(sequences, list(fastaReadFiles(sequenceFiles)))
+        stats = validateFasta(sequenceFiles, outputFile=self.tempOutputFile).toDict()
+        self.assertEquals(stats["totalSequences"], len(sequences))
+        self.assertEquals(sequences, list(fastaReadFiles([ self.tempOutputFile ])))
+        self.assertRaises(RuntimeError, validateFasta, sequenceFiles + sequenceFiles[:1])
+        #An output file that is one of the inputs, under any name, is refused before it is touched
+        inputSize = os.path.getsize(sequenceFiles[1])
+        for outputFile in (sequenceFiles[1], os.path.join(self.tempDir, ".", os.path.basename(sequenceFiles[1]))):
+            self.assertRaises(RuntimeError, validateFasta, sequenceFiles, outputFile=outputFile)
+            self.assertEquals(inputSize, os.path.getsize(sequenceFiles[1]))
+
+    def testStatsCache(self):
+        sequencePaths = []
+        for i in xrange(4):
+            sequencePaths.append(os.path.join(self.tempDir, "genome_%i.fa" % i))
+            fileHandle = open(sequencePaths[-1], "w")
+            for j in xrange(i+1):
+                fastaWrite(fileHandle, "seq%i" % j, "ACGTN"*(j+1))
+            fileHandle.close()
+        statsMap = getFastaStatsInParallel(sequencePaths, processes=2)
+        for i in xrange(len(sequencePaths)):
+            self.assertEquals(statsMap[sequencePaths[i]]["totalSequences"], i+1)
+            self.assertEquals(statsMap[sequencePaths[i]], readCachedFastaStats(sequencePaths[i]))
+        #Changing a genome invalidates its cached stats
+        time.sleep(1)
+        fileHandle = open(sequencePaths[0], "a")
+        fastaWrite(fileHandle, "extra", "ACGT")
+        fileHandle.close()
+        self.assertEquals(readCachedFastaStats(sequencePaths[0]), None)
+        self.assertEquals(getFastaStats(sequencePaths[0])["totalSequences"], 2)
+        self.assertEquals(readCachedFastaStats(sequencePaths[0])["totalSequences"], 2)
+
+    def testHeaderChecks(self):
+        sequenceFile = self.writeSequences([ ("a b", "ACGT"), ("a c", "ACGT") ])
+        self.assertRaises(RuntimeError, validateFasta, [ sequenceFile ])
+        sequenceFile = self.writeSequences([ ("a/b", "ACGT") ])
+        validateFasta([ sequenceFile ])
+        self.assertRaises(RuntimeError, validateFasta, [ sequenceFile ], checkAssemblyHub=True)
+
+    def testSmallSequenceFilter(self):
+        for chunked in (False, True):
+            sequences = []
+            for i in xrange(50):
+                length = random.randint(1, 3000)
+                if chunked:
+                    for offset in xrange(0, length, 500):
+                        sequences.append(("seq%i|1|%i" % (i, offset), "A"*min(500, length - offset)))
+                else:
+                    sequences.append(("seq%i" % i, "A"*length))
+            sequenceFile = self.writeSequences(sequences)
+            options = FilterOptions(1000)
+            fileHandle = open(sequenceFile, "r")
+            contTable = containedSequences(fileHandle)
+            fileHandle.close()
+            expected = [ (header, sequence) for header, sequence in sequences if not tooShort(header, sequence, options, contTable) ]
+            validateFasta([ sequenceFile ], outputFile=self.tempOutputFile, minLength=options.length)
+            fileHandle = open(self.tempOutputFile, "r")
+            self.assertEquals(expected, list(fastaRead(fileHandle)))
+            fileHandle.close()
+
+if __name__ == '__main__':
+    unittest.main()
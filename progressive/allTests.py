@@ -9,6 +9,7 @@ from cactus.progressive.multiCactusTreeTest import TestCase as multiCactusTreeTe
 from cactus.progressive.outgroupTest import TestCase as outgroupTest
 from cactus.progressive.scheduleTest import TestCase as scheduleTest
 from cactus.shared.experimentWrapperTest import TestCase as experimentWrapperTest
+from cactus.shared.configWrapperTest import TestCase as configWrapperTest
 from cactus.progressive.cactus_progressiveTest import TestCase as cactus_progressiveTest
  
 from cactus.shared.test import parseCactusSuiteTestOptions
@@ -18,6 +19,7 @@ def allSuites():
                                    unittest.makeSuite(outgroupTest, 'test'),
                                    unittest.makeSuite(scheduleTest, 'test'),
                                    unittest.makeSuite(experimentWrapperTest, 'test'),
+                                   unittest.makeSuite(configWrapperTest, 'test'),
                                    unittest.makeSuite(cactus_progressiveTest, 'test')))
     return allTests
         
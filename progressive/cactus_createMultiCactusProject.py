@@ -84,7 +84,8 @@ def createMCProject(tree, experiment, config, options):
         # size/quality automatically. 
         mcProj.outgroup = DynamicOutgroup()
         mcProj.outgroup.importTree(mcProj.mcTree, mcProj.getInputSequenceMap(), alignmentRootId,
-                                   candidateSet=options.outgroupNames)
+                                   candidateSet=options.outgroupNames,
+                                   numProcesses=options.statsProcesses)
         mcProj.outgroup.compute(maxNumOutgroups=config.getMaxNumOutgroups())
     elif config.getOutgroupStrategy() != 'none':
         raise RuntimeError("Could not understand outgroup strategy %s" % config.getOutgroupStrategy())
@@ -313,6 +314,10 @@ def main():
                       "outgroups.  NOTE: ADDED TO REPLACE --rootOutgroupPaths and --rootOutgroupDists.",
                       default=None)
     parser.add_option("--overwrite", action="store_true", help="Overwrite existing experiment files", default=False)
+    parser.add_option("--statsProcesses", dest="statsProcesses", type=int,
+                      help="number of processes used to collect the assembly stats of the input sequences for "
+                      "the dynamic outgroup strategy (stats are cached in a .stats file beside each input) [default=number of cpus]",
+                      default=None)
 
     options, args = parser.parse_args()
     
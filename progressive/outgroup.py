@@ -23,7 +23,7 @@ from optparse import OptionParser
 
 from cactus.progressive.multiCactusProject import MultiCactusProject
 from cactus.progressive.multiCactusTree import MultiCactusTree
-from sonLib.bioio import popenCatch
+from cactus.preprocessor.cactus_validateFasta import getFastaStatsInParallel
 
 class GreedyOutgroup(object):
     def __init__(self):
@@ -246,7 +246,7 @@ class DynamicOutgroup(GreedyOutgroup):
     # 
     # for internal nodes, we store the stats of the max leaf underneath
     def importTree(self, mcTree, seqMap, rootId = None, candidateSet = None,
-                   candidateBoost = 1.5):
+                   candidateBoost = 1.5, numProcesses = None):
         super(DynamicOutgroup, self).importTree(mcTree, rootId)
         self.candidateSet = candidateSet
         if candidateSet is not None and len(candidateSet) == 0:
@@ -255,14 +255,12 @@ class DynamicOutgroup(GreedyOutgroup):
         assert seqMap is not None
         # map name to (numSequences, totalLength)
         self.sequenceInfo = dict()
+        # the stats of the genomes are read in parallel, or from the
+        # files cached beside them by a previous run
+        statsMap = getFastaStatsInParallel(seqMap.values(), numProcesses)
         for event, inPath in seqMap.items():
             node = self.mcTree.getNodeId(event)
-            if os.path.isdir(inPath):
-                fastaPaths = [os.path.join(inPath, f) for
-                              f in os.listdir(inPath)]
-            else:
-                fastaPaths = [inPath]
-            totalFaInfo = self.__getSeqInfo(fastaPaths, event)
+            totalFaInfo = self.__getSeqInfo(statsMap[inPath], event)
             self.sequenceInfo[node] = totalFaInfo
 
             # propagate leaf stats up to the root
@@ -453,39 +451,20 @@ class DynamicOutgroup(GreedyOutgroup):
             assert x != None
         return dist
 
-    # use cactus_analyseAssembly to get some very basic stats about the
-    # length and fragmentation of an assembly.  there is certainly
-    # room for investigation of more sophisticated stats...
-    #
-    # Warning: we are tightly coupled to the output format of
-    # cactus_analyseAssembly here... any change may cause an
-    # assertion error
-    def __getSeqInfo(self, faPaths, event):
-        cmdLine = "cactus_analyseAssembly"
-        for faPath in faPaths:
-            if not os.path.isfile(faPath):
-                raise RuntimeError("Unable to open sequence file %s" % faPath)
-            cmdLine += " %s" % faPath
+    # use the assembly stats (see cactus_validateFasta.py) to get some
+    # very basic stats about the length and fragmentation of an
+    # assembly.  there is certainly room for investigation of more
+    # sophisticated stats...
+    def __getSeqInfo(self, stats, event):
         isCandidate = False
         if self.candidateSet is not None and event in self.candidateSet:
             isCandidate = True
-        analyseOutput = popenCatch(cmdLine).split()
-        tsIdx = analyseOutput.index("Total-sequences:")
-        assert tsIdx >= 0 and tsIdx < len(analyseOutput) - 1
-        numSequences = int(analyseOutput[tsIdx + 1])
-        tlIdx = analyseOutput.index("Total-length:")
-        assert tlIdx >= 0 and tlIdx < len(analyseOutput) - 1
-        totalLength = int(analyseOutput[tlIdx + 1])
-        nsIdx = analyseOutput.index("ProportionNs:")
-        assert nsIdx >= 0 and nsIdx < len(analyseOutput) - 1
-        nsPct = float(analyseOutput[nsIdx + 1])
-        rmIdx = analyseOutput.index("Proportion-repeat-masked:")
-        assert rmIdx >= 0 and rmIdx < len(analyseOutput) - 1
-        rmPct = float(analyseOutput[rmIdx + 1])
+        numSequences = stats["totalSequences"]
+        totalLength = stats["totalLength"]
+        nsPct = stats["proportionNs"]
+        rmPct = stats["proportionRepeatMasked"]
         assert rmPct <= 1. and rmPct >= 0.
-        n50Idx = analyseOutput.index("N50:")
-        assert n50Idx >= 0 and n50Idx < len(analyseOutput) - 1
-        n50 = int(analyseOutput[n50Idx + 1])
+        n50 = stats["n50"]
         
         if isCandidate is True:
             totalLength *= self.candidateBoost
@@ -193,7 +193,14 @@ void buildRecursiveThreads(stKVDatabase *database, stList *caps, char *(*segment
         free(data);
     }
 
-    //Delete old records and insert new records
+    //Delete old records and insert new records, unless the job has been given up on (see cactusDisk_takeCommitToken),
+    //as it is then rerun on the old records
+    if (!cactusDisk_takeCommitToken()) {
+        st_logCritical("The commit token has been taken, so this job has been given up on, not writing the threads\n");
+        stCache_destruct(cache);
+        stList_destruct(records);
+        return;
+    }
     deleteNestedRecords(database, caps);
     stTry {
             stKVDatabase_bulkSetRecords(database, records);
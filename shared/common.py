@@ -7,7 +7,22 @@
 
 import os
 import random
+import re
 import sys
+import time
+import socket
+import hashlib
+import tempfile
+import subprocess
+import struct
+import mmap
+import signal
+import traceback
+import errno
+import cPickle
+import math
+import json
+import xml.etree.ElementTree as ET
 
 from sonLib.bioio import logger
 from sonLib.bioio import getTempDirectory
@@ -32,14 +47,19 @@ def getLogLevelString2(logLevelString):
         return getLogLevelString()
     return logLevelString
 
+def convertAttrib(value, typeFn):
+    """Convert the string value of an attrib to the given type, bools being written as integers
+    """
+    if typeFn == bool:
+        return bool(int(value))
+    return typeFn(value)
+
 def getOptionalAttrib(node, attribName, typeFn=None, default=None):
     """Get an optional attrib, or default if not set or node is None
     """
     if node != None and node.attrib.has_key(attribName):
         if typeFn != None:
-            if typeFn == bool:
-                return bool(int(node.attrib[attribName]))
-            return typeFn(node.attrib[attribName])
+            return convertAttrib(node.attrib[attribName], typeFn)
         return node.attrib[attribName]
     return default
 
@@ -63,19 +83,76 @@ def findRequiredNode(configNode, nodeName, index=0):
 def readFlowerNames(flowerStrings): 
     return [ (bool(int(line[0])), line[1:]) for line in flowerStrings.split("\n") if line != '' ]
     
+def getFlowerServiceSocketPath(cactusDiskDatabaseString):
+    """The node local unix socket of the flower service for the given database.
+    """
+    return os.path.join(tempfile.gettempdir(), "cactus_flowerService_%s.sock" % hashlib.md5(cactusDiskDatabaseString).hexdigest())
+
+def startFlowerService(cactusDiskDatabaseString, idleTimeout, logLevel=None):
+    """Starts a cactus_workflow_flowerServer process for the database in the background. It
+    outlives the calling job, exiting after idleTimeout seconds without a query, and does nothing
+    if a server for the database is already running on this node.
+    """
+    logLevel = getLogLevelString2(logLevel)
+    socketPath = getFlowerServiceSocketPath(cactusDiskDatabaseString)
+    devNull = open(os.devnull, "r+")
+    logFile = open(socketPath + ".log", "a")
+    subprocess.Popen([ "cactus_workflow_flowerServer", logLevel, cactusDiskDatabaseString, socketPath, str(int(idleTimeout)) ],
+                     stdin=devNull, stdout=devNull, stderr=logFile, close_fds=True, preexec_fn=os.setsid)
+    devNull.close()
+    logFile.close()
+
+def queryFlowerService(cactusDiskDatabaseString, query):
+    """Sends a query to the flower service for the database, returning the answer, or None if
+    there is no service running or it failed to answer.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(getFlowerServiceSocketPath(cactusDiskDatabaseString))
+            sock.sendall(query + "\n")
+            sock.shutdown(socket.SHUT_WR)
+            answer = []
+            while True:
+                data = sock.recv(65536)
+                if data == "":
+                    break
+                answer.append(data)
+        except socket.error:
+            return None
+    finally:
+        sock.close()
+    answer = "".join(answer)
+    if not answer.endswith("done\n"):
+        return None
+    return answer[:-len("done\n")]
+
 def runCactusGetFlowers(cactusDiskDatabaseString, flowerNames, 
                         minSequenceSizeOfFlower=1,
                         maxSequenceSizeOfFlowerGrouping=-1, 
                         maxSequenceSizeOfSecondaryFlowerGrouping=-1, 
-                        logLevel=None):
+                        logLevel=None, flowerServiceIdleTimeout=0):
     """Gets a list of flowers attached to the given flower. 
+    
+    If flowerServiceIdleTimeout is greater than 0 and the database is a kyoto tycoon server, the
+    query is sent to the flower service on this node, which keeps its database connection open
+    between queries. If the service isn't running it is started for later queries, and the query
+    is answered by running cactus_workflow_getFlowers as usual.
     """
+    startTime = time.time()
+    query = "%i %i %i" % (int(minSequenceSizeOfFlower), int(maxSequenceSizeOfFlowerGrouping), 
+                          int(maxSequenceSizeOfSecondaryFlowerGrouping))
+    if flowerServiceIdleTimeout > 0 and "kyoto_tycoon" in cactusDiskDatabaseString:
+        flowerStrings = queryFlowerService(cactusDiskDatabaseString, "getFlowers %s %s" % (query, flowerNames))
+        if flowerStrings is not None:
+            logger.info("Got flowers from the flower service in %s seconds" % (time.time() - startTime))
+            return readFlowerNames(flowerStrings)
+        startFlowerService(cactusDiskDatabaseString, flowerServiceIdleTimeout, logLevel=logLevel)
     logLevel = getLogLevelString2(logLevel)
-    flowerStrings = popenCatch("cactus_workflow_getFlowers %s '%s' %i %i %i" % \
-                               (logLevel, cactusDiskDatabaseString, int(minSequenceSizeOfFlower), 
-                                int(maxSequenceSizeOfFlowerGrouping), 
-                                int(maxSequenceSizeOfSecondaryFlowerGrouping)), 
+    flowerStrings = popenCatch("cactus_workflow_getFlowers %s '%s' %s" % \
+                               (logLevel, cactusDiskDatabaseString, query), 
                                 stdinString=flowerNames)
+    logger.info("Got flowers with a new process and database connection in %s seconds" % (time.time() - startTime))
     l = readFlowerNames(flowerStrings)
     return l
 
@@ -97,41 +174,186 @@ def runCactusExtendFlowers(cactusDiskDatabaseString, flowerNames,
     l = readFlowerNames(flowerStrings)
     return l
 
-def encodeFlowerNames(flowerNames):
+def encodeFlowerNames(flowerNames, size=None, overlarge=False):
+    """Encodes a list of flower names. If the total size of the flowers is given the names are
+    preceded by the marker of a secondary group of that size, see getFlowerNamesSize.
+    """
     if len(flowerNames) == 0:
         return "0"
-    return "%i %s" % (len(flowerNames), " ".join([ str(flowerNames[0]) ] + [ str(flowerNames[i] - flowerNames[i-1]) for i in xrange(1, len(flowerNames)) ]))
+    names = " ".join([ str(flowerNames[0]) ] + [ str(flowerNames[i] - flowerNames[i-1]) for i in xrange(1, len(flowerNames)) ])
+    if size != None:
+        return "%i %s%i %s" % (len(flowerNames), "b" if overlarge else "a", size, names)
+    return "%i %s" % (len(flowerNames), names)
+
+def isFlowerGroupMarker(token):
+    """Whether a token of an encoded list of flower names marks the start of a secondary group, 
+    'a' or 'b' (if it is overlarge), followed by the total size of the group if it is known.
+    """
+    return token[0] in ('a', 'b')
     
 def decodeFirstFlowerName(encodedFlowerNames):
     tokens = encodedFlowerNames.split()
     if int(tokens[0]) == 0:
         return None
-    if tokens[1] == 'b':
+    if isFlowerGroupMarker(tokens[1]):
         return int(tokens[2])
     return int(tokens[1])
 
+def decodeFlowerNames(encodedFlowerNames):
+    """Returns the list of flower names in an encoded list of flower names, ignoring any grouping.
+    """
+    flowerNames = []
+    name = 0
+    for i in encodedFlowerNames.split()[1:]:
+        if not isFlowerGroupMarker(i):
+            name = int(i) + name
+            flowerNames.append(name)
+    return flowerNames
+
+def getFlowerNamesSize(encodedFlowerNames):
+    """Returns the total size of the flowers in an encoded list of flower names, from the sizes in the 
+    markers of its secondary groups, as written by cactus_workflow_getFlowers and cactus_workflow_extendFlowers, 
+    or None if the size of any group is not given.
+    """
+    tokens = encodedFlowerNames.split()
+    if int(tokens[0]) == 0:
+        return 0
+    if not isFlowerGroupMarker(tokens[1]):
+        return None
+    sizes = [ token[1:] for token in tokens[1:] if isFlowerGroupMarker(token) ]
+    if "" in sizes:
+        return None
+    return sum([ int(size) for size in sizes ])
+
 def runCactusSplitFlowersBySecondaryGrouping(flowerNames):
-    """Splits a list of flowers into smaller lists.
+    """Splits a list of flowers into smaller lists. The size of each group, if given, is kept in its list.
     """
     flowerNames = flowerNames.split()
     flowerGroups = []
     stack = []
     overlarge = False
+    size = None
     name = 0
     for i in flowerNames[1:]:
         if i != '':
-            if i in ('a', 'b'):
+            if isFlowerGroupMarker(i):
                 if len(stack) > 0:
-                    flowerGroups.append((overlarge, encodeFlowerNames(stack))) #b indicates the stack is overlarge
+                    flowerGroups.append((overlarge, encodeFlowerNames(stack, size, overlarge))) #b indicates the stack is overlarge
                     stack = []
-                overlarge = i == 'b'
+                overlarge = i[0] == 'b'
+                size = int(i[1:]) if len(i) > 1 else None
             else:
                 name = int(i) + name
                 stack.append(name)
     if len(stack) > 0:
-        flowerGroups.append((overlarge, encodeFlowerNames(stack)))
+        flowerGroups.append((overlarge, encodeFlowerNames(stack, size, overlarge)))
     return flowerGroups
 
+flowerTreeIndexMagic = "CACTUSFT"
+
+def writeFlowerTreeIndex(flowersParentsAndSizes, indexFile):
+    """Writes an index of a cactus tree, given a list of (flowerName, parentFlowerName, totalSequenceSize)
+    tuples as printed by cactus_workflow_flowerTree. The index is a header followed by a binary record
+    of (parentFlowerName, flowerName, totalSequenceSize) for each flower, sorted by parent and then name.
+    """
+    records = sorted([ (parentFlowerName, flowerName, size) for flowerName, parentFlowerName, size in flowersParentsAndSizes ])
+    fileHandle = open(indexFile + ".tmp", "wb")
+    fileHandle.write(flowerTreeIndexMagic)
+    for record in records:
+        fileHandle.write(struct.pack("=qqq", *record))
+    fileHandle.close()
+    os.rename(indexFile + ".tmp", indexFile)
+
+class FlowerTreeIndex(object):
+    """Reads an index written by writeFlowerTreeIndex. The file is memory mapped and the children of
+    a flower are found by binary search, so a lookup only touches a few pages, however big the tree.
+    """
+    recordSize = struct.calcsize("=qqq")
+    
+    def __init__(self, indexFile):
+        fileHandle = open(indexFile, "rb")
+        if fileHandle.read(len(flowerTreeIndexMagic)) != flowerTreeIndexMagic:
+            fileHandle.close()
+            raise RuntimeError("The file %s is not a flower tree index" % indexFile)
+        self.flowerNumber = (os.fstat(fileHandle.fileno()).st_size - len(flowerTreeIndexMagic)) / self.recordSize
+        self.map = mmap.mmap(fileHandle.fileno(), 0, access=mmap.ACCESS_READ)
+        fileHandle.close()
+    
+    def getRecord(self, i):
+        return struct.unpack_from("=qqq", self.map, len(flowerTreeIndexMagic) + i * self.recordSize)
+    
+    def getChildFlowers(self, flowerName):
+        """Returns the (name, total sequence size) of each child flower of the given flower, sorted by name.
+        """
+        start, end = 0, self.flowerNumber
+        while start < end:
+            middle = (start + end) / 2
+            if self.getRecord(middle)[0] < flowerName:
+                start = middle + 1
+            else:
+                end = middle
+        childFlowers = []
+        while start < self.flowerNumber:
+            parentFlowerName, childFlowerName, size = self.getRecord(start)
+            if parentFlowerName != flowerName:
+                break
+            childFlowers.append((childFlowerName, size))
+            start += 1
+        return childFlowers
+    
+    def getFlowers(self, flowerNames, minSequenceSizeOfFlower=1, maxSequenceSizeOfFlowerGrouping=-1, 
+                   maxSequenceSizeOfSecondaryFlowerGrouping=-1):
+        """Returns the child flowers of the encoded flower names, grouped as runCactusGetFlowers does.
+        """
+        if maxSequenceSizeOfFlowerGrouping == -1:
+            maxSequenceSizeOfFlowerGrouping = sys.maxint
+        if maxSequenceSizeOfSecondaryFlowerGrouping == -1:
+            maxSequenceSizeOfSecondaryFlowerGrouping = sys.maxint
+        childFlowers = sorted([ (childFlowerName, size) for flowerName in decodeFlowerNames(flowerNames) 
+                                for childFlowerName, size in self.getChildFlowers(flowerName) if size >= minSequenceSizeOfFlower ])
+        flowerGroups = []
+        group, totalSize = [], 0
+        for childFlowerName, size in childFlowers:
+            if len(group) > 0 and totalSize + size > maxSequenceSizeOfFlowerGrouping:
+                flowerGroups.append((totalSize > maxSequenceSizeOfFlowerGrouping, 
+                                     encodeFlowerGroup(group, maxSequenceSizeOfSecondaryFlowerGrouping)))
+                group, totalSize = [], 0
+            group.append((childFlowerName, size))
+            totalSize += size
+        if len(group) > 0:
+            flowerGroups.append((totalSize > maxSequenceSizeOfFlowerGrouping, 
+                                 encodeFlowerGroup(group, maxSequenceSizeOfSecondaryFlowerGrouping)))
+        return flowerGroups
+
+def encodeFlowerGroup(flowersAndSizes, maxSequenceSizeOfSecondaryFlowerGrouping):
+    """Encodes a group of (flowerName, size) pairs, sorted by name, as cactus_workflow_getFlowers does, 
+    marking the starts of the secondary groups with 'a', or 'b' for those that are overlarge, followed by 
+    the total size of the group.
+    """
+    groups = [] #The overlarge flag, total size and flower names of each secondary group
+    for flowerName, size in flowersAndSizes:
+        if len(groups) == 0 or groups[-1][1] + size > maxSequenceSizeOfSecondaryFlowerGrouping:
+            groups.append([ size > maxSequenceSizeOfSecondaryFlowerGrouping, 0, [] ])
+        groups[-1][1] += size
+        groups[-1][2].append(flowerName)
+    tokens = [ str(len(flowersAndSizes)) ]
+    previousFlowerName = 0
+    for overlarge, totalSize, flowerNames in groups:
+        tokens.append("%s%i" % ("b" if overlarge else "a", totalSize))
+        for flowerName in flowerNames:
+            tokens.append(str(flowerName - previousFlowerName))
+            previousFlowerName = flowerName
+    return " %s " % " ".join(tokens)
+
+flowerTreeIndices = {}
+
+def getFlowerTreeIndex(indexFile):
+    """Returns the flower tree index in the given file, opening each index once per process.
+    """
+    if indexFile not in flowerTreeIndices:
+        flowerTreeIndices[indexFile] = FlowerTreeIndex(indexFile)
+    return flowerTreeIndices[indexFile]
+
 #############################################
 #############################################
 #All the following provide command line wrappers
@@ -271,6 +493,222 @@ def runCactusFlowerStats(cactusDiskDatabaseString, flowerName, logLevel=None):
                               (logLevel, cactusDiskDatabaseString, flowerName))
     return flowerStatsString.split("\n")[0]
 
+def runCactusFlowerTree(cactusDiskDatabaseString, indexFile, logLevel=None):
+    """Walks the whole cactus tree once, writing an index of it to indexFile (see FlowerTreeIndex).
+    Returns the number of flowers in the index.
+    """
+    logLevel = getLogLevelString2(logLevel)
+    flowerStrings = popenCatch("cactus_workflow_flowerTree %s '%s'" % (logLevel, cactusDiskDatabaseString))
+    flowersParentsAndSizes = [ tuple([ int(i) for i in line.split() ]) for line in flowerStrings.split("\n") if line != '' ]
+    writeFlowerTreeIndex(flowersParentsAndSizes, indexFile)
+    return len(flowersParentsAndSizes)
+
+def runCactusFlowerStatsBatch(cactusDiskDatabaseString, flowerNames, logLevel=None):
+    """Gets the stats for a list of flowers with one invocation (and so one database connection).
+    Returns a list of the stats strings of the flowers, in the order given.
+    """
+    if len(flowerNames) == 0:
+        return []
+    logLevel = getLogLevelString2(logLevel)
+    flowerStatsString = popenCatch("cactus_workflow_flowerStats %s '%s'" % 
+                                   (logLevel, cactusDiskDatabaseString), stdinString=encodeFlowerNames(flowerNames))
+    flowerStatsStrings = [ line for line in flowerStatsString.split("\n") if line != '' ]
+    assert len(flowerStatsStrings) == len(flowerNames)
+    return flowerStatsStrings
+
+def parseFlowerStats(flowerStatsString):
+    """Parses a line of output of cactus_workflow_flowerStats into a dictionary of the stats, keyed by the
+    names printed for them (e.g. "total bases").
+    """
+    return dict([ (key.strip(), int(value)) for key, value in re.findall("([a-zA-Z -]+): (-?[0-9]+)", flowerStatsString) ])
+
+def takeCommitToken():
+    """Returns True if the process may write to the databases, as cactusDisk_takeCommitToken does: if
+    CACTUS_COMMIT_TOKEN is not set, or the token it names is created by this call holding
+    CACTUS_COMMIT_TOKEN_OWNER, or was created holding it by another program of the same job.
+    """
+    commitToken = os.environ.get("CACTUS_COMMIT_TOKEN")
+    if commitToken is None:
+        return True
+    owner = os.environ["CACTUS_COMMIT_TOKEN_OWNER"]
+    #The token is written under another name then linked, so it is never seen without its owner
+    tempFile = "%s.%i" % (commitToken, os.getpid())
+    fileHandle = open(tempFile, "w")
+    fileHandle.write(owner)
+    fileHandle.close()
+    try:
+        os.link(tempFile, commitToken)
+        return True
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+        fileHandle = open(commitToken, "r")
+        tokenOwner = fileHandle.read()
+        fileHandle.close()
+        return tokenOwner == owner
+    finally:
+        os.remove(tempFile)
+
+def runWithCommitDeadline(fn, timeLimit, commitToken):
+    """Runs fn() in a child process, in which the cactus programs only write to the databases
+    if they can take the commit token (see takeCommitToken), which the first of them to write creates
+    holding the pid of the child, and the others find holding it. If the child has not finished after
+    timeLimit seconds the token is taken, empty. If that succeeds, the child has not started to write, so
+    it is killed and (False, None, None) is returned. Otherwise the child is committing and is waited for. 
+    A timeLimit of None waits for the child however long it takes. Returns (True, the value returned 
+    by fn, the resource usage of the child), or raises a RuntimeError if fn failed. The resource usage 
+    is that reported by os.wait4, so covers the child and the programs it ran and nothing else the 
+    caller has run; its peak memory is the largest of theirs, including the memory the child shares 
+    with its parent.
+    """
+    for path in (commitToken, commitToken + ".result"):
+        if os.path.exists(path):
+            os.remove(path)
+    pid = os.fork()
+    if pid == 0:
+        os.setsid() #So the programs it runs can be killed with it
+        os.environ["CACTUS_COMMIT_TOKEN"] = commitToken
+        os.environ["CACTUS_COMMIT_TOKEN_OWNER"] = str(os.getpid())
+        exitValue = 0
+        try:
+            result = fn()
+            fileHandle = open(commitToken + ".result", "wb")
+            cPickle.dump(result, fileHandle, cPickle.HIGHEST_PROTOCOL)
+            fileHandle.close()
+        except:
+            traceback.print_exc()
+            exitValue = 1
+        os._exit(exitValue)
+    if timeLimit == None:
+        finishedPid, status, usage = os.wait4(pid, 0)
+    else:
+        endTime = time.time() + timeLimit
+        while True:
+            finishedPid, status, usage = os.wait4(pid, os.WNOHANG)
+            if finishedPid == pid:
+                break
+            if time.time() > endTime:
+                try:
+                    os.close(os.open(commitToken, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                except OSError: #The child has taken the token and is writing
+                    finishedPid, status, usage = os.wait4(pid, 0)
+                    break
+                os.killpg(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                return False, None, None
+            time.sleep(0.1)
+    if status != 0:
+        raise RuntimeError("The child process failed with status %i" % status)
+    fileHandle = open(commitToken + ".result", "rb")
+    result = cPickle.load(fileHandle)
+    fileHandle.close()
+    return True, result, usage
+
+def getWrapperResourceUsageFile(experimentFile):
+    """The file the wrapper jobs of a run on the experiment record their resource usage in. It is next to 
+    the experiment file, rather than the database, so the records of previous runs are kept.
+    """
+    return os.path.splitext(experimentFile)[0] + "_wrapperResourceUsage.txt"
+
+def appendWrapperResourceUsage(resourceUsageFile, wrapperName, bases, runtime, memory, clock):
+    """Records the runtime, peak memory (in bytes) and cpu time of a wrapper job on flowers with the 
+    given number of bases. Each record is one short line appended to the file, so jobs can add records 
+    at the same time.
+    """
+    fileHandle = open(resourceUsageFile, "a")
+    fileHandle.write("%s %i %f %i %f\n" % (wrapperName, bases, runtime, memory, clock))
+    fileHandle.close()
+
+def readWrapperResourceUsage(resourceUsageFile):
+    """Returns a map of the wrapper names in the file to lists of their (bases, runtime, memory, clock) records.
+    """
+    resourceUsage = {}
+    if os.path.exists(resourceUsageFile):
+        fileHandle = open(resourceUsageFile, "r")
+        for line in fileHandle:
+            tokens = line.split()
+            if len(tokens) == 5: #Skips a line that is still being written
+                resourceUsage.setdefault(tokens[0], []).append((int(tokens[1]), float(tokens[2]), int(tokens[3]), float(tokens[4])))
+        fileHandle.close()
+    return resourceUsage
+
+def readWrapperRuntimes(resourceUsageFile, wrapperName):
+    """Returns the (bases, runtime) records of the given wrapper in the file.
+    """
+    return [ (bases, runtime) for bases, runtime, memory, clock in readWrapperResourceUsage(resourceUsageFile).get(wrapperName, []) ]
+
+def predictWrapperRuntime(runtimes, bases, minimumRecords=10):
+    """Predicts the runtime of a wrapper on flowers with the given number of bases, as the median 
+    runtime per base of its previous runs times the bases. Returns None if there are too few records.
+    """
+    runtimesPerBase = sorted([ runtime / max(1, recordBases) for recordBases, runtime in runtimes ])
+    if len(runtimesPerBase) < minimumRecords:
+        return None
+    return runtimesPerBase[len(runtimesPerBase)/2] * max(1, bases)
+
+def readJobTreeStats(statsFile):
+    """Returns a map of the target class names in a jobTree stats file (made with --stats) to 
+    lists of their (time, clock, memory) records, with the memory in bytes.
+    """
+    jobTreeStats = {}
+    for target in ET.parse(statsFile).getiterator("target"):
+        if "class" in target.attrib and "memory" in target.attrib:
+            jobTreeStats.setdefault(target.attrib["class"].split(".")[-1], []).append(\
+                    (float(target.attrib["time"]), float(target.attrib["clock"]), int(float(target.attrib["memory"]))*1024)) #Kilobytes, as given by getrusage
+    return jobTreeStats
+
+def fitWrapperResourceModel(resourceUsage, jobTreeStats={}, memoryQuantile=0.95):
+    """Fits a model of the peak memory and the cpus used by each wrapper class, from the records of 
+    readWrapperResourceUsage and readJobTreeStats. The memory of a class with resource usage records 
+    is a line in the bases of its flowers, with the least squares slope, raised so that the given 
+    quantile of the records is under it, so a few outliers do not raise it for every target. A class with only jobTree stats gets a constant memory, the largest recorded. The cpu 
+    is the most cpu time per unit of runtime recorded. Returns a map of class names to the parameters 
+    of their model.
+    """
+    def getCpu(runtimesAndClocks):
+        return max([ 1 ] + [ int(math.ceil(clock / max(1.0, runtime))) for runtime, clock in runtimesAndClocks ])
+    model = {}
+    for wrapperName, records in jobTreeStats.items():
+        model[wrapperName] = { "memory":max([ memory for runtime, clock, memory in records ]), "memoryPerBase":0.0,
+                               "cpu":getCpu([ (runtime, clock) for runtime, clock, memory in records ]) }
+    for wrapperName, records in resourceUsage.items():
+        meanBases = float(sum([ bases for bases, runtime, memory, clock in records ])) / len(records)
+        meanMemory = float(sum([ memory for bases, runtime, memory, clock in records ])) / len(records)
+        variance = sum([ (bases - meanBases) ** 2 for bases, runtime, memory, clock in records ])
+        covariance = sum([ (bases - meanBases) * (memory - meanMemory) for bases, runtime, memory, clock in records ])
+        memoryPerBase = max(0.0, covariance / variance) if variance > 0 else 0.0
+        residuals = sorted([ memory - memoryPerBase * bases for bases, runtime, memory, clock in records ])
+        model[wrapperName] = { "memory":int(math.ceil(residuals[max(0, int(math.ceil(memoryQuantile * len(residuals))) - 1)])), 
+                               "memoryPerBase":memoryPerBase,
+                               "cpu":getCpu([ (runtime, clock) for bases, runtime, memory, clock in records ]) }
+    return model
+
+def writeWrapperResourceModel(model, modelFile):
+    fileHandle = open(modelFile, "w")
+    json.dump(model, fileHandle, indent=4, sort_keys=True)
+    fileHandle.close()
+
+wrapperResourceModels = {}
+
+def getWrapperResourceModel(modelFile):
+    """Returns the wrapper resource model in the given file, reading each model once per process.
+    """
+    if modelFile not in wrapperResourceModels:
+        fileHandle = open(modelFile, "r")
+        wrapperResourceModels[modelFile] = json.load(fileHandle)
+        fileHandle.close()
+    return wrapperResourceModels[modelFile]
+
+def predictWrapperResources(model, wrapperName, bases, safetyMargin=1.5):
+    """Returns the (memory, cpu) to request for a wrapper on flowers with the given number of bases, 
+    the memory being the predicted peak memory times the safety margin. Returns None if the model 
+    has no entry for the wrapper.
+    """
+    if wrapperName not in model:
+        return None
+    parameters = model[wrapperName]
+    return int(safetyMargin * (parameters["memory"] + parameters["memoryPerBase"] * bases)), int(parameters["cpu"])
+
 def runCactusMakeNormal(cactusDiskDatabaseString, flowerNames, maxNumberOfChains=0, logLevel=None):
     """Makes the given flowers normal (see normalisation for the various phases)
     """
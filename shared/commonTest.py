@@ -1,9 +1,13 @@
 import unittest
 import os
 import sys
+import random
+import time
 
 from cactus.shared.test import parseCactusSuiteTestOptions
 from sonLib.bioio import TestStatus
+from sonLib.bioio import getTempDirectory
+from sonLib.bioio import system
 from cactus.shared.common import *
 
 class TestCase(unittest.TestCase):
@@ -23,6 +27,147 @@ class TestCase(unittest.TestCase):
         self.assertEquals(9, decodeFirstFlowerName("4 9 1 1 b 1"))
         self.assertEquals(13, decodeFirstFlowerName("1 b 13"))
     
+    def testDecodeFlowerNames(self):
+        self.assertEquals([], decodeFlowerNames("0"))
+        self.assertEquals([ 100, 5, 1000 ], decodeFlowerNames(encodeFlowerNames([ 100, 5, 1000 ])))
+        self.assertEquals([ 7, 8 ], decodeFlowerNames("2 b 7 a 1"))
+        self.assertEquals([ 9, 10, 11, 8, 12, 13, 20, 28 ], decodeFlowerNames("8 9 1 1 a -3 4 b 1 7 8"))
+    
+    def testParseFlowerStats(self):
+        stats = parseFlowerStats("flower name: 12 total bases: 1000 total-ends: 4 total-caps: 8 max-end-degree: 2 max-adjacency-length: 500 total-blocks: 1 total-groups: 2 total-edges: 3 total-free-ends: 2 total-attached-ends: 0 total-chains: 1 total-link groups: 1")
+        self.assertEquals(12, stats["flower name"])
+        self.assertEquals(1000, stats["total bases"])
+        self.assertEquals(8, stats["total-caps"])
+        self.assertEquals(1, stats["total-link groups"])
+        self.assertEquals(13, len(stats))
+    
+    def testFlowerServiceWithoutServer(self):
+        dbString = "<st_kv_database_conf type=\"kyoto_tycoon\"><kyoto_tycoon host=\"localhost\" port=\"%i\" database_dir=\"x\"/></st_kv_database_conf>" % random.randint(0, 100000)
+        self.assertEquals(getFlowerServiceSocketPath(dbString), getFlowerServiceSocketPath(dbString))
+        self.assertNotEquals(getFlowerServiceSocketPath(dbString), getFlowerServiceSocketPath(dbString + " "))
+        self.assertEquals(None, queryFlowerService(dbString, "getFlowers 0 -1 -1 1 1"))
+        
+    def testFlowerTreeIndex(self):
+        tempDir = getTempDirectory(os.getcwd())
+        indexFile = os.path.join(tempDir, "flowerTree.index")
+        #The root 0 has children 1, 2 and 5; 2 has children 3 and 4
+        writeFlowerTreeIndex([ (5, 0, 100), (1, 0, 10), (2, 0, 50), (4, 2, 20), (3, 2, 30) ], indexFile)
+        index = FlowerTreeIndex(indexFile)
+        self.assertEquals(5, index.flowerNumber)
+        self.assertEquals([ (1, 10), (2, 50), (5, 100) ], index.getChildFlowers(0))
+        self.assertEquals([ (3, 30), (4, 20) ], index.getChildFlowers(2))
+        self.assertEquals([], index.getChildFlowers(1))
+        self.assertEquals([], index.getChildFlowers(6))
+        self.assertEquals([ (False, " 3 a160 1 1 3 ") ], index.getFlowers("1 0"))
+        self.assertEquals([ (False, " 2 a10 1 a50 1 "), (True, " 1 b100 5 ") ], index.getFlowers("1 0", maxSequenceSizeOfFlowerGrouping=60, 
+                                                                                      maxSequenceSizeOfSecondaryFlowerGrouping=55))
+        self.assertEquals([ (False, " 3 b50 2 a30 1 b100 2 ") ], index.getFlowers("2 0 2", minSequenceSizeOfFlower=25, 
+                                                                          maxSequenceSizeOfFlowerGrouping=200, 
+                                                                          maxSequenceSizeOfSecondaryFlowerGrouping=40))
+        self.assertEquals([], index.getFlowers("1 1"))
+        self.assertTrue(getFlowerTreeIndex(indexFile) is getFlowerTreeIndex(indexFile))
+        open(indexFile, "w").write("not an index")
+        self.assertRaises(RuntimeError, FlowerTreeIndex, indexFile)
+        system("rm -rf %s" % tempDir)
+    
+    def testRunWithCommitDeadline(self):
+        tempDir = getTempDirectory(os.getcwd())
+        commitToken = os.path.join(tempDir, "commitToken")
+        finished, result, usage = runWithCommitDeadline(lambda : [ "messages" ], 10, commitToken)
+        self.assertEquals((True, [ "messages" ]), (finished, result))
+        #The usage is of the child and the programs it ran
+        def burn():
+            system("%s -c 'x = \" \" * 200000000; sum(range(3000000))'" % sys.executable)
+            return 2
+        finished, result, usage = runWithCommitDeadline(burn, None, commitToken)
+        self.assertEquals((True, 2), (finished, result))
+        self.assertTrue(usage.ru_maxrss * 1024 >= 200000000)
+        self.assertTrue(usage.ru_utime + usage.ru_stime > 0.0)
+        finished, result, usage = runWithCommitDeadline(lambda : 3, None, commitToken)
+        self.assertEquals((True, 3), (finished, result))
+        self.assertTrue(usage.ru_maxrss * 1024 < 200000000)
+        #A child that has not taken the token is killed
+        startTime = time.time()
+        self.assertEquals((False, None, None), runWithCommitDeadline(lambda : time.sleep(100), 1, commitToken))
+        self.assertTrue(time.time() - startTime < 10)
+        self.assertTrue(os.path.exists(commitToken))
+        #A child that has taken the token is waited for, and every program it runs may write
+        def commit():
+            assert takeCommitToken()
+            time.sleep(2)
+            return [ popenCatch("%s -c 'from cactus.shared.common import takeCommitToken; print takeCommitToken()'" % sys.executable).strip() 
+                     for i in xrange(2) ]
+        self.assertEquals((True, [ "True", "True" ]), runWithCommitDeadline(commit, 0.5, commitToken)[:2])
+        #A child that finds the token taken by the workflow may not write
+        def commitLate():
+            time.sleep(2)
+            return takeCommitToken()
+        self.assertEquals((False, None, None), runWithCommitDeadline(commitLate, 0.5, commitToken))
+        os.environ["CACTUS_COMMIT_TOKEN"] = commitToken
+        os.environ["CACTUS_COMMIT_TOKEN_OWNER"] = "1"
+        try:
+            self.assertFalse(takeCommitToken())
+        finally:
+            os.environ.pop("CACTUS_COMMIT_TOKEN")
+            os.environ.pop("CACTUS_COMMIT_TOKEN_OWNER")
+        self.assertEquals([ "commitToken" ], os.listdir(tempDir))
+        def fail():
+            raise RuntimeError("Failed")
+        self.assertRaises(RuntimeError, runWithCommitDeadline, fail, 10, commitToken)
+        system("rm -rf %s" % tempDir)
+    
+    def testPredictWrapperRuntime(self):
+        tempDir = getTempDirectory(os.getcwd())
+        resourceUsageFile = os.path.join(tempDir, "wrapperResourceUsage.txt")
+        self.assertEquals([], readWrapperRuntimes(resourceUsageFile, "CactusCafWrapper"))
+        for i in xrange(1, 10):
+            appendWrapperResourceUsage(resourceUsageFile, "CactusCafWrapper", 1000 * i, 2.0 * i, 1000000, 1.0)
+        appendWrapperResourceUsage(resourceUsageFile, "CactusBarWrapper", 1000, 100.0, 1000000, 1.0)
+        runtimes = readWrapperRuntimes(resourceUsageFile, "CactusCafWrapper")
+        self.assertEquals(9, len(runtimes))
+        self.assertEquals(None, predictWrapperRuntime(runtimes, 1000)) #Too few records
+        #Outliers have no effect on the median
+        appendWrapperResourceUsage(resourceUsageFile, "CactusCafWrapper", 0, 1000.0, 1000000, 1.0)
+        appendWrapperResourceUsage(resourceUsageFile, "CactusCafWrapper", 10000, 1000.0, 1000000, 1.0)
+        runtimes = readWrapperRuntimes(resourceUsageFile, "CactusCafWrapper")
+        self.assertAlmostEquals(10.0, predictWrapperRuntime(runtimes, 5000))
+        system("rm -rf %s" % tempDir)
+    
+    def testFitWrapperResourceModel(self):
+        tempDir = getTempDirectory(os.getcwd())
+        resourceUsageFile = os.path.join(tempDir, "wrapperResourceUsage.txt")
+        #The memory is 10 bytes per base and up to 1000000 bytes more
+        for i in xrange(100):
+            bases = random.randint(0, 1000000)
+            appendWrapperResourceUsage(resourceUsageFile, "CactusBarWrapper", bases, 10.0, 
+                                       10 * bases + random.randint(0, 1000000), random.choice((5.0, 15.0)))
+        statsFile = os.path.join(tempDir, "stats.xml")
+        open(statsFile, "w").write("""<stats><worker time="10" clock="10" memory="10"><target time="10" clock="5" class="CactusNormalWrapper" memory="1000"/>
+        <target time="1" clock="1" class="CactusNormalWrapper" memory="3000"/><target time="1" clock="1" class="CactusNormalRecursion" memory="2000"/></worker></stats>""")
+        jobTreeStats = readJobTreeStats(statsFile)
+        self.assertEquals([ (10.0, 5.0, 1024000), (1.0, 1.0, 3072000) ], jobTreeStats["CactusNormalWrapper"])
+        model = fitWrapperResourceModel(readWrapperResourceUsage(resourceUsageFile), jobTreeStats)
+        self.assertEquals({ "memory":3072000, "memoryPerBase":0.0, "cpu":1 }, model["CactusNormalWrapper"])
+        self.assertEquals(2, model["CactusBarWrapper"]["cpu"])
+        self.assertTrue(model["CactusBarWrapper"]["memoryPerBase"] > 9.0 and model["CactusBarWrapper"]["memoryPerBase"] < 11.0)
+        #All but the top 5% of the records are under the fitted line
+        records = readWrapperResourceUsage(resourceUsageFile)["CactusBarWrapper"]
+        self.assertTrue(95 <= len([ memory for bases, runtime, memory, clock in records if 
+                                    predictWrapperResources(model, "CactusBarWrapper", bases, safetyMargin=1.0)[0] >= memory ]))
+        #An outlier does not raise the line
+        appendWrapperResourceUsage(resourceUsageFile, "CactusBarWrapper", 500000, 10.0, 100000000, 5.0)
+        self.assertTrue(fitWrapperResourceModel(readWrapperResourceUsage(resourceUsageFile))["CactusBarWrapper"]["memory"] <= 2000000)
+        #With a quantile of 1 every record is under the line
+        model2 = fitWrapperResourceModel(readWrapperResourceUsage(resourceUsageFile), memoryQuantile=1.0)
+        for bases, runtime, memory, clock in readWrapperResourceUsage(resourceUsageFile)["CactusBarWrapper"]:
+            self.assertTrue(predictWrapperResources(model2, "CactusBarWrapper", bases, safetyMargin=1.0)[0] >= memory)
+        modelFile = os.path.join(tempDir, "model.json")
+        writeWrapperResourceModel(model, modelFile)
+        self.assertEquals(model, getWrapperResourceModel(modelFile))
+        self.assertEquals((4608000, 1), predictWrapperResources(getWrapperResourceModel(modelFile), "CactusNormalWrapper", 1000))
+        self.assertEquals(None, predictWrapperResources(getWrapperResourceModel(modelFile), "CactusCafWrapper", 1000))
+        system("rm -rf %s" % tempDir)
+    
     def testRunCactusSplitFlowersBySecondaryGrouping(self):
         self.assertEquals([(True, "1 -1") ], runCactusSplitFlowersBySecondaryGrouping("1 b -1"))
         self.assertEquals([(False, "1 1"), (False, "1 2")], runCactusSplitFlowersBySecondaryGrouping("2 1 a 1"))
@@ -32,6 +177,15 @@ class TestCase(unittest.TestCase):
         self.assertEquals([(False, "3 9 1 1"), (True, "1 12")], runCactusSplitFlowersBySecondaryGrouping("4 9 1 1 b 1"))
         self.assertEquals([(True, "1 13") ], runCactusSplitFlowersBySecondaryGrouping("1 b 13"))
         self.assertEquals([(False, "3 9 1 1"), (False, "2 8 4"), (True, "3 13 7 8")], runCactusSplitFlowersBySecondaryGrouping("8 9 1 1 a -3 4 b 1 7 8"))
+        #The sizes of the groups given by cactus_workflow_getFlowers are kept
+        self.assertEquals([(False, "3 a30 9 1 1"), (True, "1 b100 12")], runCactusSplitFlowersBySecondaryGrouping(" 4 a30 9 1 1 b100 1 "))
+        self.assertEquals(130, getFlowerNamesSize(" 4 a30 9 1 1 b100 1 "))
+        self.assertEquals(30, getFlowerNamesSize("3 a30 9 1 1"))
+        self.assertEquals(None, getFlowerNamesSize("4 9 1 1 b 1"))
+        self.assertEquals(None, getFlowerNamesSize("4 a30 9 1 1 b 1"))
+        self.assertEquals(0, getFlowerNamesSize("0"))
+        self.assertEquals([ 9, 10, 11, 12 ], decodeFlowerNames(" 4 a30 9 1 1 b100 1 "))
+        self.assertEquals(9, decodeFirstFlowerName(" 4 a30 9 1 1 b100 1 "))
       
 def main():
     parseCactusSuiteTestOptions()
@@ -21,6 +21,42 @@ import math
 import copy
 from cactus.shared.common import findRequiredNode
 from cactus.shared.common import getOptionalAttrib
+from cactus.shared.common import convertAttrib
+
+# The types of the attributes of the config nodes read by the workflow, checked
+# by ConfigWrapper.validate. Unlisted attributes are strings, or are checked
+# by the code that reads them.
+targetAttribTypes = { "memory":int, "cpu":int, "overlargeMemory":int, "overlargeCpu":int,
+                      "minFlowerSize":int, "maxFlowerGroupSize":int, "maxFlowerWrapperGroupSize":int }
+
+phaseAttribTypes = { 
+    "trimBlast" : { "doTrimStrategy":bool, "trimFlanking":int, "trimMinSize":int, "trimThreshold":float, 
+                    "trimWindowSize":int, "trimOutgroupFlanking":int },
+    "setup" : { "makeEventHeadersAlphaNumeric":bool },
+    "caf" : { "realign":bool, "chunkSize":int, "compressFiles":bool, "overlapSize":int, "filterByIdentity":bool, 
+              "identityRatio":float, "minimumDistance":float, "minimumSequenceLengthForBlast":int, "blockTrim":float, 
+              "minimumTreeCoverage":float, "minimumBlockDegree":int, "minimumIngroupDegree":int, "minimumOutgroupDegree":int, 
+              "singleCopyIngroup":bool, "singleCopyOutgroup":bool, "maxAdjacencyComponentSizeRatio":float, 
+              "minLengthForChromosome":int, "proportionOfUnalignedBasesForNewChromosome":float, 
+              "maximumMedianSequenceLengthBetweenLinkedEnds":int, "lastzMemory":int },
+    "bar" : { "runBar":bool, "spanningTrees":int, "gapGamma":float, "bandingLimit":float, "splitMatrixBiggerThanThis":int, 
+              "anchorMatrixBiggerThanThis":int, "repeatMaskMatrixBiggerThanThis":int, "constraintDiagonalTrim":int, 
+              "minimumBlockDegree":int, "minimumIngroupDegree":int, "minimumOutgroupDegree":int, 
+              "alignAmbiguityCharacters":bool, "pruneOutStubAlignments":bool, "veryLargeEndSize":int, "largeEndSize":int, 
+              "maximumNumberOfSequencesBeforeSwitchingToFast":int },
+    "normal" : { "iterations":int, "maxNumberOfChains":int, "normalised":bool, "buildFlowerTreeIndex":bool },
+    "avg" : { "buildAvgs":bool },
+    "reference" : { "buildReference":bool, "useSimulatedAnnealing":bool, "theta":float, "maxWalkForCalculatingZ":int, 
+                    "permutations":int, "ignoreUnalignedGaps":bool, "wiggle":float, "numberOfNs":int, 
+                    "minNumberOfSequencesToSupportAdjacency":int, "makeScaffolds":bool },
+    "check" : { "runCheck":bool },
+    "hal" : { "buildHal":bool, "buildMaf":bool, "buildFasta":bool, "joinMaf":bool, 
+              "showOnlySubstitutionsWithRespectToReference":bool } }
+
+constantsAttribTypes = { "defaultMemory":int, "defaultOverlargeMemory":int, "defaultCpu":int, "defaultOverlargeCpu":int,
+                         "flowerServiceIdleTimeout":int, "checkpointDatabase":bool,
+                         "stragglerRuntimeMultiple":float, "stragglerMinimumRuntime":int,
+                         "recordResourceUsage":bool, "resourceModelSafetyMargin":float }
 
 class ConfigWrapper:
     defaultOutgroupStrategy = 'none'
@@ -192,6 +228,24 @@ class ConfigWrapper:
         if ktServerElem is not None and "cpu" in ktServerElem.attrib:
             return int(ktServerElem.attrib["cpu"])
         return default           
+
+    def getKtserverReuseSecondary(self, default=False):
+        ktServerElem = self.xmlRoot.find("ktserver")
+        if ktServerElem is not None and "reuseSecondary" in ktServerElem.attrib:
+            return bool(int(ktServerElem.attrib["reuseSecondary"]))
+        return default
+
+    def getKtserverSecondaryInMemory(self, default=True):
+        ktServerElem = self.xmlRoot.find("ktserver")
+        if ktServerElem is not None and "secondaryInMemory" in ktServerElem.attrib:
+            return bool(int(ktServerElem.attrib["secondaryInMemory"]))
+        return default
+
+    def getKtserverMetricsInterval(self, default=0.0):
+        ktServerElem = self.xmlRoot.find("ktserver")
+        if ktServerElem is not None and "metricsInterval" in ktServerElem.attrib:
+            return float(ktServerElem.attrib["metricsInterval"])
+        return default
             
     # the minBlockDegree, when specified in the final, "base" 
     # iteration, does not play nicely with the required fraction
@@ -244,6 +298,49 @@ class ConfigWrapper:
             replaceAllDivergenceParameters(self.xmlRoot)
         return messages
     
+    def validate(self):
+        """Checks that the config has the nodes the workflow needs and that the attributes
+        listed in phaseAttribTypes, targetAttribTypes and constantsAttribTypes have values of
+        the right type, so that a malformed config fails when the workflow starts rather than
+        in a later phase. Raises a RuntimeError listing every problem found. Call it once the
+        predefined constants have been substituted.
+        """
+        errors = []
+        def checkAttribs(node, attribTypes):
+            for attribName, typeFn in attribTypes.items():
+                if attribName in node.attrib:
+                    try:
+                        convertAttrib(node.attrib[attribName], typeFn)
+                    except ValueError:
+                        errors.append("The %s attribute of the %s node is %s, which is not a valid %s" % \
+                                      (attribName, node.tag, node.attrib[attribName], typeFn.__name__))
+        constants = self.xmlRoot.find("constants")
+        if constants is None:
+            errors.append("The config has no constants node")
+        else:
+            checkAttribs(constants, constantsAttribTypes)
+            divergences = constants.find("divergences")
+            if divergences is not None:
+                checkAttribs(divergences, dict([ (i, float) for i in divergences.attrib.keys() if i != "useDefault" ] + [ ("useDefault", bool) ]))
+        for phaseName, attribTypes in phaseAttribTypes.items():
+            phaseNode = self.xmlRoot.find(phaseName)
+            if phaseNode is None:
+                errors.append("The config has no %s node" % phaseName)
+                continue
+            checkAttribs(phaseNode, attribTypes)
+            for child in phaseNode:
+                if child.tag == "divergence": #Each alternative value of the parameter must be valid
+                    if child.attrib.get("argName") in attribTypes:
+                        typeFn = attribTypes[child.attrib["argName"]]
+                        checkAttribs(child, dict([ (i, typeFn) for i in child.attrib.keys() if i != "argName" ]))
+                else:
+                    checkAttribs(child, targetAttribTypes)
+        ktServerElem = self.xmlRoot.find("ktserver")
+        if ktServerElem is not None:
+            checkAttribs(ktServerElem, { "memory":int, "cpu":int, "reuseSecondary":bool, "secondaryInMemory":bool, "metricsInterval":float })
+        if len(errors) > 0:
+            raise RuntimeError("The config is malformed:\n%s" % "\n".join(errors))
+    
     def turnAllModesOn(self):
         """Switches on check, normalisation etc. to use when debugging/testing
         """
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+#Copyright (C) 2026 by the cactus contributors
+#
+#Released under the MIT license, see LICENSE.txt
+"""Tests the checking of cactus config files.
+"""
+
+import unittest
+import os
+import sys
+import copy
+import xml.etree.ElementTree as ET
+
+from cactus.shared.common import cactusRootPath
+from cactus.shared.configWrapper import ConfigWrapper
+
+class TestCase(unittest.TestCase):
+    
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.configs = []
+        for configFile in ("cactus_config.xml", "cactus_progressive_config.xml"):
+            configWrapper = ConfigWrapper(ET.parse(os.path.join(cactusRootPath(), configFile)).getroot())
+            configWrapper.substituteAllPredefinedConstantsWithLiterals()
+            self.configs.append(configWrapper)
+    
+    def checkMalformed(self, configWrapper, messages):
+        try:
+            configWrapper.validate()
+            self.assertTrue(0)
+        except RuntimeError, e:
+            for message in messages:
+                self.assertTrue(message in str(e))
+    
+    def testValidate(self):
+        for configWrapper in self.configs:
+            configWrapper.validate()
+            
+            #Every problem is reported
+            malformed = ConfigWrapper(copy.deepcopy(configWrapper.xmlRoot))
+            malformed.xmlRoot.find("caf").attrib["chunkSize"] = "2Mb"
+            malformed.xmlRoot.find("bar").attrib["runBar"] = "yes"
+            malformed.xmlRoot.find("bar").find("CactusBarWrapper").attrib["memory"] = "littleMemory"
+            malformed.xmlRoot.find("constants").attrib["defaultCpu"] = "one"
+            self.checkMalformed(malformed, [ "chunkSize attribute of the caf node is 2Mb",
+                                             "runBar attribute of the bar node is yes",
+                                             "memory attribute of the CactusBarWrapper node is littleMemory",
+                                             "defaultCpu attribute of the constants node is one" ])
+            
+            #Every value of a divergence controlled parameter is checked
+            malformed = ConfigWrapper(copy.deepcopy(configWrapper.xmlRoot))
+            ET.SubElement(malformed.xmlRoot.find("bar"), "divergence", { "argName":"gapGamma", "default":"0.2", "low":"high" })
+            self.checkMalformed(malformed, [ "low attribute of the divergence node is high" ])
+            
+            #Missing phases are reported
+            malformed = ConfigWrapper(copy.deepcopy(configWrapper.xmlRoot))
+            malformed.xmlRoot.remove(malformed.xmlRoot.find("normal"))
+            self.checkMalformed(malformed, [ "The config has no normal node" ])
+
+if __name__ == '__main__':
+    unittest.main()
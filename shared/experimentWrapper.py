@@ -18,6 +18,7 @@ import random
 import math
 import copy
 import filecmp
+import zlib
 from optparse import OptionParser
 from sonLib.bioio import getRandomAlphaNumericString
 from sonLib.bioio import system
@@ -180,15 +181,119 @@ class DbElemWrapper(object):
         assert self.getDbType() == "kyoto_tycoon"
         self.dbElem.attrib["snapshot"] = str(int(snapshot))
     
+    def getPhaseCheckpointDir(self):
+        """The directory in which the workflow records the phases completed on the database.
+        """
+        assert self.getDbDir() != None
+        return self.getDbDir() + "_phaseCheckpoints"
+
+    def getKtserverReuseDir(self):
+        """The directory in which the workflow keeps the kill switch files of the reused 
+        ktservers of the secondary databases.
+        """
+        assert self.getDbDir() != None
+        return self.getDbDir() + "_ktserverReuse"
+
+    def getDbPartitionNumber(self):
+        """The number of servers the records of a kyoto tycoon database are partitioned 
+        between, by the hash of their keys (1 if it is not partitioned).
+        """
+        assert self.getDbType() == "kyoto_tycoon"
+        if "partitions" in self.dbElem.attrib:
+            return int(self.dbElem.attrib["partitions"])
+        return 1
+
+    def setDbPartitionNumber(self, partitionNumber):
+        assert self.getDbType() == "kyoto_tycoon"
+        assert partitionNumber >= 1
+        self.dbElem.attrib["partitions"] = str(partitionNumber)
+        for partitionElem in self.dbElem.findall("partition"):
+            self.dbElem.remove(partitionElem)
+
+    def getDbPartition(self, index):
+        """The database of one server of a partitioned database, as an unpartitioned
+        database whose directory is a subdirectory of the database's. Its host and port are 
+        those the server was launched on (see setDbPartition), or else the host of the 
+        database and the port of the database plus the index.
+        """
+        assert index >= 0 and index < self.getDbPartitionNumber()
+        confElem = copy.deepcopy(self.confElem)
+        partition = DbElemWrapper(confElem)
+        dbElem = partition.getDbElem()
+        dbElem.attrib.pop("partitions", None)
+        for partitionElem in dbElem.findall("partition"):
+            dbElem.remove(partitionElem)
+        if self.getDbPartitionNumber() == 1:
+            return partition
+        partition.setDbDir(os.path.join(self.getDbDir(), "partition_%i" % index))
+        partition.setDbPort(self.getDbPort() + index)
+        for partitionElem in self.dbElem.findall("partition"):
+            if int(partitionElem.attrib["index"]) == index:
+                partition.setDbHost(partitionElem.attrib["host"])
+                partition.setDbPort(int(partitionElem.attrib["port"]))
+        return partition
+
+    def getDbPartitions(self):
+        return [ self.getDbPartition(i) for i in xrange(self.getDbPartitionNumber()) ]
+
+    def setDbPartition(self, index, partition):
+        """Records the host and port of the server of a partition, once it is launched.
+        """
+        assert index >= 0 and index < self.getDbPartitionNumber()
+        if self.getDbPartitionNumber() == 1:
+            self.setDbHost(partition.getDbHost())
+            self.setDbPort(partition.getDbPort())
+            return
+        for partitionElem in self.dbElem.findall("partition"):
+            if int(partitionElem.attrib["index"]) == index:
+                self.dbElem.remove(partitionElem)
+        ET.SubElement(self.dbElem, "partition", { "index":str(index), "host":partition.getDbHost(),
+                                                  "port":str(partition.getDbPort()) })
+
+    def getDbPartitionIndex(self, key):
+        """The partition holding the record with the given key (the key as a string of bytes, 
+        for cactus a 64 bit integer), by the crc32 hash of the key.
+        """
+        return (zlib.crc32(key) & 0xffffffff) % self.getDbPartitionNumber()
+
+    def getDbPartitionsFile(self):
+        """The file in the database directory listing the host and port of the server of each 
+        partition, one per line, from which the cactus disk connects to the partitions.
+        """
+        return os.path.join(self.getDbDir(), "partitions.txt")
+
+    def writeDbPartitionsFile(self):
+        """Writes the partitions file once the servers are running, or removes a stale one 
+        if the database is not partitioned.
+        """
+        if self.getDbPartitionNumber() == 1:
+            if self.getDbDir() is None:
+                return
+            partitionsFile = self.getDbPartitionsFile()
+            if os.path.exists(partitionsFile):
+                os.remove(partitionsFile)
+            return
+        partitionsFile = self.getDbPartitionsFile()
+        if not os.path.isdir(self.getDbDir()):
+            os.makedirs(self.getDbDir())
+        tempFile = partitionsFile + ".tmp"
+        fileHandle = open(tempFile, "w")
+        for partition in self.getDbPartitions():
+            fileHandle.write("%s %s\n" % (partition.getDbHost(), partition.getDbPort()))
+        fileHandle.close()
+        os.rename(tempFile, partitionsFile)
+    
     def cleanupDb(self): #Replacement for cleanupDatabase
-        """Removes the database that was created.
+        """Removes the database that was created, and any record of the phases completed on it.
         """
         if self.getDbType() == "kyoto_tycoon":
-            system("ktremotemgr clear -port %s -host %s" % (self.getDbPort(), self.getDbHost()))
-            system("rm -rf %s" % self.getDbDir())
+            if not self.getDbInMemory(): #An in memory database went with its server
+                for partition in self.getDbPartitions():
+                    system("ktremotemgr clear -port %s -host %s" % (partition.getDbPort(), partition.getDbHost()))
+            system("rm -rf %s %s %s" % (self.getDbDir(), self.getPhaseCheckpointDir(), self.getKtserverReuseDir()))
         else:
             assert self.getDbDir() != None
-            system("rm -rf %s" % self.getDbDir())
+            system("rm -rf %s %s" % (self.getDbDir(), self.getPhaseCheckpointDir()))
 
 class ExperimentWrapper(DbElemWrapper):
     def __init__(self, xmlRoot):
@@ -10,6 +10,7 @@ import unittest
 import os
 import sys
 import copy
+import struct
 import xml.etree.ElementTree as ET
 from sonLib.bioio import TestStatus
 from sonLib.bioio import getTempDirectory
@@ -49,6 +50,53 @@ class TestCase(unittest.TestCase):
         for i in seqList:
             assert seqMap[os.path.splitext(i)[0].upper()] == i
     
+    def testDbPartitions(self):
+        exp = ExperimentWrapper(self.__makeXmlDummy(self.tree, self.sequences))
+        exp.setDbDir("/tmp/db")
+        exp.setDbHost("localhost")
+        exp.setDbPort(1978)
+        self.assertEquals(1, exp.getDbPartitionNumber())
+        self.assertEquals([ ("/tmp/db", 1978) ], [ (i.getDbDir(), i.getDbPort()) for i in exp.getDbPartitions() ])
+        self.assertEquals(0, exp.getDbPartitionIndex("\x01\x00\x00\x00\x00\x00\x00\x00"))
+        exp.setDbPartitionNumber(4)
+        self.assertEquals([ ("/tmp/db/partition_%i" % i, 1978 + i) for i in xrange(4) ],
+                          [ (i.getDbDir(), i.getDbPort()) for i in exp.getDbPartitions() ])
+        #The host and port a server was launched on are kept in the conf string
+        partition = exp.getDbPartition(2)
+        partition.setDbHost("node2")
+        partition.setDbPort(2000)
+        exp.setDbPartition(2, partition)
+        exp = ExperimentWrapper(ET.fromstring(ET.tostring(exp.xmlRoot)))
+        self.assertEquals(("node2", 2000), (exp.getDbPartition(2).getDbHost(), exp.getDbPartition(2).getDbPort()))
+        self.assertEquals(1, exp.getDbPartition(2).getDbPartitionNumber())
+        #Keys are spread between the partitions
+        counts = [ 0 ] * 4
+        for key in xrange(10000):
+            counts[exp.getDbPartitionIndex(struct.pack("<q", key))] += 1
+        self.assertTrue(min(counts) > 2000)
+
+    def testDbPartitionsFile(self):
+        tempDir = getTempDirectory(os.getcwd())
+        exp = ExperimentWrapper(self.__makeXmlDummy(self.tree, self.sequences))
+        exp.setDbDir(os.path.join(tempDir, "db"))
+        exp.setDbHost("localhost")
+        exp.setDbPort(1978)
+        exp.setDbPartitionNumber(3)
+        partition = exp.getDbPartition(1)
+        partition.setDbHost("node1")
+        partition.setDbPort(2000)
+        exp.setDbPartition(1, partition)
+        #The cactus disk reads the host and port of each partition, in order
+        exp.writeDbPartitionsFile()
+        fileHandle = open(exp.getDbPartitionsFile(), "r")
+        self.assertEquals([ "localhost 1978", "node1 2000", "localhost 1980" ], fileHandle.read().split("\n")[:-1])
+        fileHandle.close()
+        #An unpartitioned database has no partitions file
+        exp.setDbPartitionNumber(1)
+        exp.writeDbPartitionsFile()
+        self.assertFalse(os.path.exists(exp.getDbPartitionsFile()))
+        system("rm -rf %s" % tempDir)
+
     def __makeXmlDummy(self, treeString, sequenceString):
         rootElem =  ET.Element("dummy")
         rootElem.attrib['species_tree'] = self.tree